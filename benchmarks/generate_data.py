@@ -0,0 +1,218 @@
+"""Generatore di dati di pipeline sintetici, con le stesse colonne del foglio caricato nella dashboard.
+
+Produce cartelle di lavoro Excel e file Parquet con un numero configurabile di righe (da 10k a 10M),
+distribuzione dei canali e progressione delle date tra le fasi della pipeline. Le righe sono generate
+a blocchi, così anche i file da milioni di righe non richiedono di tenere tutto in memoria.
+
+Esempi:
+    python benchmarks/generate_data.py --rows 100000 --format both --out data/pipeline_100k
+    python benchmarks/generate_data.py --rows 10000000 --format parquet --channels "Referral=0.3,Sito=0.7"
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sales_dashboard as sd  # noqa: E402
+
+# Colonne del foglio di input e colonne di data nell'ordine delle fasi, prese dalla dashboard
+COLONNE = sd.expected_columns
+COLONNE_DATE = sd.date_columns
+
+# Distribuzione predefinita dei canali; ogni canale ha più varianti del testo, come nei fogli compilati a mano,
+# e un moltiplicatore della probabilità di chiusura
+CANALI_PREDEFINITI = {
+    'LinkedIn Inbound': 0.22,
+    'LinkedIn Outbound': 0.12,
+    'Referral': 0.14,
+    'Eventi': 0.10,
+    'Advertising': 0.12,
+    'Cold Calling': 0.12,
+    'Sito': 0.10,
+    'Rinnovi/Upselling': 0.08,
+}
+VARIANTI_CANALE = {
+    'LinkedIn Inbound': ['LinkedIn Inbound', 'linkedin in', 'Linkedin - Inbound'],
+    'LinkedIn Outbound': ['LinkedIn Outbound', 'linkedin out'],
+    'Referral': ['Referral', 'referral cliente'],
+    'Eventi': ['Eventi', 'eventi - fiera'],
+    'Advertising': ['Advertising', 'advertising google'],
+    'Cold Calling': ['Cold Calling', 'cold calling'],
+    'Sito': ['Sito', 'sito web'],
+    'Rinnovi/Upselling': ['Rinnovi', 'Upselling', 'rinnovi/upselling'],
+}
+FATTORE_CHIUSURA = {'Referral': 1.35, 'Rinnovi/Upselling': 1.5, 'Eventi': 1.1, 'Cold Calling': 0.7, 'Advertising': 0.85}
+
+# Probabilità predefinite di passare da una fase alla successiva:
+# meeting fissato -> effettuato -> offerta -> analisi -> contratto
+PASSAGGI_PREDEFINITI = (0.75, 0.65, 0.7, 0.55)
+# Intervalli di giorni tra una fase e la successiva
+GIORNI_TRA_FASI = ((1, 21), (3, 30), (3, 30), (5, 60))
+
+SALES = ['mario rossi', 'luca bianchi', 'anna verdi', 'sara neri', 'paolo russo', 'giulia ferrari', 'marco esposito',
+         'chiara romano', 'davide colombo', 'elena ricci', 'andrea marino', 'francesca greco']
+SERVIZI = ['Consulenza', 'Formazione', 'Software', 'Assessment', 'Supporto']
+RUOLI = ['CEO', 'CTO', 'CFO', 'HR Manager', 'Sales Manager', 'Marketing Manager', 'IT Manager']
+DIMENSIONI = ['Micro', 'PMI', 'Mid-Market', 'Enterprise']
+SETTORI = ['Retail', 'Finance', 'Tech', 'Manifattura', 'Sanità', 'Logistica', 'Pubblica Amministrazione', 'Energia']
+MOTIVI = ['Prezzo competitivo', 'Referenze', 'Demo convincente', 'Urgenza del progetto', '']
+OBIEZIONI = ['Budget', 'Tempistiche', 'Già un fornitore', 'Nessuna', '']
+
+# Righe massime di un foglio Excel, esclusa l'intestazione
+MAX_RIGHE_EXCEL = 1_048_575
+
+
+# Funzione per interpretare una distribuzione 'Canale=peso,Canale=peso', normalizzata a somma 1
+def parse_channels(testo):
+    pesi = {}
+    for parte in filter(None, (p.strip() for p in testo.split(','))):
+        nome, _, peso = parte.rpartition('=')
+        if not nome:
+            raise argparse.ArgumentTypeError(f"Canale senza peso: '{parte}'")
+        pesi[nome.strip()] = float(peso)
+    totale = sum(pesi.values())
+    if totale <= 0:
+        raise argparse.ArgumentTypeError("La somma dei pesi dei canali deve essere positiva")
+    return {nome: peso / totale for nome, peso in pesi.items()}
+
+
+# Funzione per generare un blocco di n righe del foglio di input
+def generate_chunk(n, rng, canali=None, passaggi=PASSAGGI_PREDEFINITI, inizio='2022-01-01', giorni=1095,
+                   aziende=5000, testo_date=False):
+    canali = canali or CANALI_PREDEFINITI
+    nomi_canale = list(canali)
+    indice_canale = rng.choice(len(nomi_canale), n, p=np.array(list(canali.values())))
+    testo_canale = np.empty(n, dtype=object)
+    for i, nome in enumerate(nomi_canale):
+        mask = indice_canale == i
+        testo_canale[mask] = rng.choice(VARIANTI_CANALE.get(nome, [nome]), mask.sum())
+
+    # Progressione delle fasi: ogni fase è raggiunta solo se lo è la precedente, a una data successiva
+    fattore = np.array([FATTORE_CHIUSURA.get(nome, 1.0) for nome in nomi_canale])[indice_canale]
+    giorno = rng.integers(0, giorni, n).astype(float)
+    date = [giorno]
+    raggiunta = np.ones(n, dtype=bool)
+    for fase, (probabilita, (minimo, massimo)) in enumerate(zip(passaggi, GIORNI_TRA_FASI)):
+        soglia = np.minimum(probabilita * fattore, 0.98) if fase == len(passaggi) - 1 else probabilita
+        raggiunta &= rng.random(n) < soglia
+        giorno = giorno + rng.integers(minimo, massimo + 1, n)
+        date.append(np.where(raggiunta, giorno, np.nan))
+
+    # Le opportunità non vinte sono perse con probabilità 0.6 qualche settimana dopo l'ultima fase raggiunta
+    vinta = raggiunta
+    ultima_fase = np.fmax.reduce(np.vstack(date), axis=0)
+    persa = ~vinta & (rng.random(n) < 0.6)
+    date.append(np.where(persa, ultima_fase + rng.integers(5, 61, n), np.nan))
+
+    origine = pd.Timestamp(inizio)
+    colonne_date = {}
+    for nome, valori in zip(COLONNE_DATE, date):
+        serie = origine + pd.to_timedelta(valori, unit='D')
+        colonne_date[nome] = serie.strftime('%d/%m/%Y').where(~serie.isna(), None) if testo_date else serie
+
+    valore = np.round(rng.lognormal(mean=9.6, sigma=0.7, size=n) * fattore, -2).astype(np.int64)
+    return pd.DataFrame({
+        'Sales': rng.choice(SALES, n),
+        'Canale': testo_canale,
+        **colonne_date,
+        'Stato': np.where(vinta, 'Vinto', np.where(persa, 'Perso', None)),
+        'Servizio': rng.choice(SERVIZI, n),
+        'Valore Tot €': valore,
+        'Azienda': np.char.add('Azienda ', rng.integers(0, aziende, n).astype(str)),
+        'Nome Persona': np.char.add('Contatto ', rng.integers(0, aziende * 3, n).astype(str)),
+        'Ruolo': rng.choice(RUOLI, n),
+        'Dimensioni': rng.choice(DIMENSIONI, n, p=[0.2, 0.45, 0.25, 0.1]),
+        'Settore': rng.choice(SETTORI, n),
+        'Come mai ha accettato?': rng.choice(MOTIVI, n),
+        'Obiezioni': rng.choice(OBIEZIONI, n),
+        'Note': '',
+    }, columns=COLONNE)
+
+
+# Funzione per generare i dati a blocchi di al più dimensione_blocco righe, in modo riproducibile per seme
+def generate_chunks(rows, seed=0, dimensione_blocco=500_000, **opzioni):
+    rng = np.random.default_rng(seed)
+    for inizio in range(0, rows, dimensione_blocco):
+        yield generate_chunk(min(dimensione_blocco, rows - inizio), rng, **opzioni)
+
+
+# Funzione per generare tutte le righe in un unico DataFrame
+def generate_dataframe(rows, seed=0, **opzioni):
+    return pd.concat(generate_chunks(rows, seed, **opzioni), ignore_index=True)
+
+
+# Funzione per scrivere i blocchi in un file Parquet, un row group per blocco
+def write_parquet(chunks, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# Funzione per scrivere la cartella di lavoro in modalità write-only, riga per riga, senza costruirla in memoria
+def write_excel(chunks, path, sheet_name='Input'):
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append(COLONNE)
+    for chunk in chunks:
+        for riga in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+            sheet.append(riga)
+    workbook.save(path)
+
+
+# Funzione per ottenere la cartella di lavoro di un DataFrame come bytes, come quelli caricati nella dashboard
+def excel_bytes(df, sheet_name='Input'):
+    import io
+
+    buffer = io.BytesIO()
+    write_excel([df], buffer, sheet_name)
+    return buffer.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera dati di pipeline sintetici per la dashboard")
+    parser.add_argument('--rows', type=int, default=10_000, help="numero di righe (da 10k a 10M)")
+    parser.add_argument('--format', choices=['xlsx', 'parquet', 'both'], default='both')
+    parser.add_argument('--out', default='pipeline_sintetica', help="percorso dei file senza estensione")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--channels', type=parse_channels, help="distribuzione dei canali, es. 'Referral=0.3,Sito=0.7'")
+    parser.add_argument('--stage-rates', default=','.join(map(str, PASSAGGI_PREDEFINITI)),
+                        help="probabilità di passaggio tra le 5 fasi, 4 valori separati da virgola")
+    parser.add_argument('--start', default='2022-01-01', help="data del primo meeting fissato")
+    parser.add_argument('--days', type=int, default=1095, help="ampiezza in giorni del periodo dei meeting fissati")
+    parser.add_argument('--companies', type=int, default=5000, help="numero di aziende distinte")
+    parser.add_argument('--text-dates', action='store_true', help="scrive le date come testo gg/mm/aaaa")
+    args = parser.parse_args(argv)
+
+    passaggi = tuple(float(p) for p in args.stage_rates.split(','))
+    if len(passaggi) != len(GIORNI_TRA_FASI):
+        parser.error(f"--stage-rates richiede {len(GIORNI_TRA_FASI)} valori")
+    if args.format in ('xlsx', 'both') and args.rows > MAX_RIGHE_EXCEL:
+        parser.error(f"un foglio Excel contiene al più {MAX_RIGHE_EXCEL:,} righe: usare --format parquet")
+
+    opzioni = dict(canali=args.channels, passaggi=passaggi, inizio=args.start, giorni=args.days,
+                   aziende=args.companies, testo_date=args.text_dates)
+    if args.format in ('parquet', 'both'):
+        write_parquet(generate_chunks(args.rows, args.seed, **opzioni), f"{args.out}.parquet")
+        print(f"Scritto {args.out}.parquet ({args.rows:,} righe)")
+    if args.format in ('xlsx', 'both'):
+        write_excel(generate_chunks(args.rows, args.seed, **opzioni), f"{args.out}.xlsx")
+        print(f"Scritto {args.out}.xlsx ({args.rows:,} righe)")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""Benchmark dell'avvio a freddo della dashboard: costo degli import e tempo al primo rendering.
+
+Ogni misura è eseguita in un interprete nuovo, così nessun modulo è già in cache. Il primo rendering
+è l'esecuzione dello script fino alla richiesta della chiave API; la seconda misura è il rerun dopo
+l'inserimento della chiave, subito oppure dopo un'attesa che lascia lavorare il precaricamento in
+background (come quando l'utente incolla la chiave qualche secondo dopo l'apertura della pagina).
+
+Esempi:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --repeat 5 --wait 0 2 5 --output benchmarks/results/import.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CARTELLA_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERCORSO_APP = os.path.join(CARTELLA_REPO, 'streamlit_app.py')
+
+# Moduli importati dalla dashboard, misurati uno alla volta dopo streamlit
+MODULI = ['numpy', 'pandas', 'openai', 'plotly.express', 'sklearn.linear_model', 'pyarrow.parquet', 'openpyxl', 'sales_dashboard']
+
+# Codice eseguito nell'interprete nuovo per il costo di un singolo import
+CODICE_IMPORT = """
+import json, sys, time
+sys.path.insert(0, sys.argv[2])
+import streamlit
+inizio = time.perf_counter()
+__import__(sys.argv[1])
+print(json.dumps({'secondi': time.perf_counter() - inizio}))
+"""
+
+# Codice eseguito nell'interprete nuovo per il primo rendering e il rerun dopo la chiave API.
+# Il runtime di streamlit è già caricato, come in un server avviato: si misura solo lo script.
+CODICE_RENDERING = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+percorso, attesa = sys.argv[1], float(sys.argv[2])
+at = AppTest.from_file(percorso, default_timeout=120)
+inizio = time.perf_counter()
+at.run()
+primo_rendering = time.perf_counter() - inizio
+assert not at.exception and len(at.warning) == 1, "la richiesta della chiave API non è stata mostrata"
+time.sleep(attesa)
+at.sidebar.text_input(key='chatbot_api_key').input('sk-benchmark')
+inizio = time.perf_counter()
+at.run()
+dopo_chiave = time.perf_counter() - inizio
+assert not at.exception, [e.value for e in at.exception]
+print(json.dumps({'primo_rendering': primo_rendering, 'dopo_chiave': dopo_chiave}))
+"""
+
+
+# Funzione per eseguire un frammento di codice in un interprete nuovo e leggerne il risultato JSON
+def run_fresh(codice, *argomenti):
+    risultato = subprocess.run([sys.executable, '-c', codice, *map(str, argomenti)], cwd=CARTELLA_REPO,
+                               capture_output=True, text=True, check=True)
+    return json.loads(risultato.stdout.strip().splitlines()[-1])
+
+
+# Funzione per riassumere una serie di tempi in millisecondi
+def summarize(tempi):
+    return {'min_ms': min(tempi) * 1000, 'mediana_ms': statistics.median(tempi) * 1000, 'max_ms': max(tempi) * 1000}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark degli import e del tempo al primo rendering")
+    parser.add_argument('--repeat', type=int, default=3, help="interpreti nuovi per ogni misura")
+    parser.add_argument('--wait', type=float, nargs='+', default=[0.0, 3.0],
+                        help="secondi tra il primo rendering e l'inserimento della chiave API")
+    parser.add_argument('--output', help="file JSON dei risultati")
+    args = parser.parse_args(argv)
+
+    risultati = {'import': {}, 'rendering': {}}
+    print("Costo degli import dopo streamlit:")
+    for modulo in MODULI:
+        tempi = [run_fresh(CODICE_IMPORT, modulo, CARTELLA_REPO)['secondi'] for _ in range(args.repeat)]
+        risultati['import'][modulo] = summarize(tempi)
+        print(f"  {modulo:<24} {statistics.median(tempi) * 1000:>8.1f} ms")
+
+    print("\nRendering dello script:")
+    for attesa in args.wait:
+        misure = [run_fresh(CODICE_RENDERING, PERCORSO_APP, attesa) for _ in range(args.repeat)]
+        primo = [m['primo_rendering'] for m in misure]
+        dopo = [m['dopo_chiave'] for m in misure]
+        risultati['rendering'][f"attesa_{attesa:g}s"] = {'primo_rendering': summarize(primo), 'dopo_chiave': summarize(dopo)}
+        print(f"  attesa {attesa:>4g} s: primo rendering {statistics.median(primo) * 1000:>8.1f} ms, "
+              f"dopo la chiave {statistics.median(dopo) * 1000:>8.1f} ms")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(risultati, f, indent=2)
+        print(f"\nRisultati scritti in {args.output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""Benchmark end-to-end delle fasi di calcolo della dashboard su dati sintetici.
+
+Misura separatamente lettura Excel e Parquet, pulizia, process_canale, filtri, calculate_metrics,
+ciascuna tabella aggregata, gli sketch e i percentili del ciclo di vendita, il modello di previsione,
+le esportazioni e la costruzione (con serializzazione) delle figure di ogni sezione, per una o
+più dimensioni del dataset. I risultati sono scritti in JSON, così le esecuzioni si possono confrontare
+nel tempo con --compare.
+
+Esempi:
+    python benchmarks/run_benchmarks.py --rows 10000 100000 --repeat 3
+    python benchmarks/run_benchmarks.py --rows 1000000 --skip-excel --compare benchmarks/results/precedente.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+CARTELLA_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CARTELLA_REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sales_dashboard as sd  # noqa: E402
+from generate_data import excel_bytes, generate_dataframe  # noqa: E402
+
+CARTELLA_RISULTATI = os.path.join(CARTELLA_REPO, 'benchmarks', 'results')
+
+
+# Funzione per misurare una fase: ripete la chiamata e restituisce tempi e ultimo risultato
+def time_stage(func, repeat):
+    tempi = []
+    risultato = None
+    for _ in range(repeat):
+        inizio = time.perf_counter()
+        risultato = func()
+        tempi.append(time.perf_counter() - inizio)
+    return tempi, risultato
+
+
+# Funzione per eseguire tutte le fasi su un dataset di n righe
+def run_suite(rows, repeat, seed, skip_excel):
+    risultati = []
+
+    def misura(fase, func, righe=rows):
+        tempi, risultato = time_stage(func, repeat)
+        risultati.append({
+            'fase': fase,
+            'righe': righe,
+            'ripetizioni': repeat,
+            'min_s': min(tempi),
+            'mediana_s': statistics.median(tempi),
+            'max_s': max(tempi),
+        })
+        print(f"  {fase:<32} {min(tempi) * 1000:>10.1f} ms (mediana {statistics.median(tempi) * 1000:.1f} ms)")
+        return risultato
+
+    grezzi = generate_dataframe(rows, seed)
+
+    # Lettura del file: Excel come nella dashboard, Parquet come alternativa colonnare
+    if not skip_excel:
+        contenuto_excel = excel_bytes(grezzi)
+        misura('lettura_excel', lambda: sd.read_input_sheet(contenuto_excel))
+    buffer_parquet = io.BytesIO()
+    grezzi.to_parquet(buffer_parquet, index=False)
+    misura('lettura_parquet', lambda: pd.read_parquet(io.BytesIO(buffer_parquet.getvalue())))
+
+    # Pulizia completa e, separatamente, la sola normalizzazione dei canali
+    misura('process_canale', lambda: grezzi['Canale'].apply(sd.process_canale))
+    data, mancanti = misura('pulizia', lambda: sd.clean_data(grezzi.copy()))
+    if mancanti:
+        raise RuntimeError(f"Colonne mancanti nei dati generati: {mancanti}")
+
+    # Filtri della barra laterale, tutti i valori selezionati sull'intero intervallo di date
+    filtri = sd.all_values_filters(data)
+    data_filtered = misura('filter_data', lambda: sd.filter_data(data, filtri))
+
+    # Metriche e tabelle aggregate
+    metrics = misura('calculate_metrics', lambda: sd.calculate_metrics(data_filtered))
+    misura('compute_summary', lambda: sd.compute_summary(data_filtered))
+    misura('compute_summary_rep', lambda: sd.compute_summary(data_filtered, 'TeamMember'))
+    trend_df = misura('aggregate_by_period_mese', lambda: sd.aggregate_by_period(data_filtered, 'M'))
+    misura('aggregate_by_period_giorno', lambda: sd.aggregate_by_period(data_filtered, 'D'))
+    channel_df = misura('aggregate_by_channel', lambda: sd.aggregate_by_channel(data_filtered))
+    funnel_df, _ = misura('compute_stage_funnel', lambda: sd.compute_stage_funnel(data_filtered))
+    misura('compute_cohorts', lambda: sd.compute_cohorts(data_filtered))
+    misura('compute_daily_prefix_sums', lambda: sd.compute_daily_prefix_sums(data_filtered))
+    misura('compute_leaderboards', lambda: sd.compute_leaderboards(data_filtered, 'Azienda', 'Revenue Totale', 10))
+    cells = misura('build_cycle_sketches', lambda: sd.build_cycle_sketches(data))
+    misura('compute_cycle_percentiles', lambda: sd.compute_cycle_percentiles(cells, data_filtered, filtri))
+    cube = misura('build_pivot_cube', lambda: sd.build_pivot_cube(data_filtered))
+    misura('compute_pivot', lambda: sd.compute_pivot(cube, ('Canale', 'Sales Rep')))
+    misura('build_query_cube', lambda: sd.build_query_cube(data_filtered))
+
+    # Modello di previsione, esportazioni e riduzione dei punti dei grafici
+    misura('train_win_model', lambda: sd.train_win_model(data))
+    misura('write_export_csv', lambda: sd.write_export(data_filtered, 'CSV'))
+    misura('write_export_parquet', lambda: sd.write_export(data_filtered, 'Parquet'))
+    giornaliero_df = sd.aggregate_by_period(data_filtered, 'D')
+    misura('downsample', lambda: sd.downsample(giornaliero_df, 'Periodo', sd.metriche_disponibili, 1200))
+
+    # Costruzione e serializzazione delle figure principali (la serializzazione è ciò che viene inviato al browser)
+    misura('figura_trend', lambda: px.line(trend_df, x='Periodo', y='Revenue Totale', markers=True).to_json())
+    misura('figura_canali', lambda: px.bar(channel_df, x='MainChannel', y=sd.metriche_disponibili, barmode='group').to_json())
+    funnel_tutti = funnel_df.loc['Tutti'].reset_index()
+    misura('figura_funnel', lambda: go.Figure(go.Funnel(y=funnel_tutti['Fase'], x=funnel_tutti['Opportunità'])).to_json())
+
+    # Figure della sezione trend (variazione percentuale e zoom sugli ultimi 12 periodi) e dei confronti
+    # temporali, a partire dalle serie ridotte come nella dashboard
+    trend_df = trend_df.assign(**{'Growth (%)': trend_df['Revenue Totale'].pct_change() * 100})
+    growth_df = sd.downsample(trend_df, 'Periodo', ['Revenue Totale', 'Growth (%)'], 1200)
+    misura('figura_growth', lambda: px.bar(growth_df, x='Periodo', y='Growth (%)').to_json())
+    zoom_df = sd.downsample(trend_df.tail(12), 'Periodo', ['Revenue Totale'], 1200)
+    misura('figura_zoom', lambda: px.line(zoom_df, x='Periodo', y='Revenue Totale', markers=True).to_json())
+    confronto_temporale_df = sd.downsample(giornaliero_df, 'Periodo', sd.metriche_disponibili, 1200)
+    misura('figura_confronto_temporale', lambda: px.line(confronto_temporale_df, x='Periodo', y=sd.metriche_disponibili,
+                                                         markers=True).to_json())
+
+    return risultati, int(metrics['totale_opportunita'])
+
+
+# Funzione per leggere il commit corrente, se disponibile
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=CARTELLA_REPO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Funzione per stampare il confronto con un'esecuzione precedente, fase per fase
+def print_comparison(risultati, percorso_precedente):
+    with open(percorso_precedente, encoding='utf-8') as f:
+        precedente = {(r['fase'], r['righe']): r for r in json.load(f)['risultati']}
+    print(f"\nConfronto con {percorso_precedente} (tempo minimo):")
+    for r in risultati:
+        vecchio = precedente.get((r['fase'], r['righe']))
+        if vecchio and vecchio['min_s'] > 0:
+            variazione = (r['min_s'] / vecchio['min_s'] - 1) * 100
+            print(f"  {r['fase']:<32} {r['righe']:>10,} righe  {vecchio['min_s'] * 1000:>10.1f} -> {r['min_s'] * 1000:>10.1f} ms ({variazione:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark delle fasi di calcolo della dashboard")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000], help="dimensioni del dataset")
+    parser.add_argument('--repeat', type=int, default=3, help="ripetizioni di ogni fase")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-excel', action='store_true', help="salta la lettura Excel (lenta oltre le 100k righe)")
+    parser.add_argument('--output', help="file JSON dei risultati (predefinito: benchmarks/results/<data>.json)")
+    parser.add_argument('--compare', help="file JSON di un'esecuzione precedente da confrontare")
+    args = parser.parse_args(argv)
+
+    risultati = []
+    for rows in args.rows:
+        print(f"\n{rows:,} righe")
+        risultati_righe, _ = run_suite(rows, args.repeat, args.seed, args.skip_excel)
+        risultati.extend(risultati_righe)
+
+    esecuzione = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'piattaforma': platform.platform(),
+        'cpu': os.cpu_count(),
+        'seed': args.seed,
+        'risultati': risultati,
+    }
+    output = args.output or os.path.join(CARTELLA_RISULTATI, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(esecuzione, f, indent=2)
+    print(f"\nRisultati scritti in {output}")
+
+    if args.compare:
+        print_comparison(risultati, args.compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Server stub compatibile con le API OpenAI per test di carico e benchmark offline.
+
+Risponde a POST /v1/chat/completions (anche in streaming) con risposte preregistrate e una
+latenza configurabile, senza chiamare alcun servizio esterno.
+
+Esempio:
+    python llm_stub_server.py --port 8001 --latency 0.8 --token-delay 0.02
+
+Nella dashboard impostare "Base URL" a http://localhost:8001/v1 (qualsiasi API key è accettata).
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Risposte predefinite, usate se non viene indicato un file con --responses
+RISPOSTE_PREDEFINITE = [
+    {
+        "match": "domanda",
+        "content": "Sulla base delle metriche disponibili, il canale con il win rate più alto è anche quello "
+                   "con il tempo medio di chiusura più breve: conviene aumentarne il volume di opportunità.",
+    },
+    {
+        "match": "",
+        "content": "**Obiettivi e Analisi delle Metriche**\n\n"
+                   "- Il win rate complessivo è in linea con il periodo precedente, mentre la revenue cresce "
+                   "grazie a un valore medio dei contratti più alto.\n"
+                   "- I canali Referral ed Eventi mostrano la conversione migliore; il Cold Calling genera "
+                   "volume ma con un tempo di chiusura superiore alla media.\n"
+                   "- Azioni suggerite: spostare budget verso i canali a conversione più alta e introdurre "
+                   "un follow-up strutturato per le opportunità ferme da oltre 60 giorni.",
+    },
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Server stub compatibile con le API OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.5, help="secondi prima del primo token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="variazione casuale massima della latenza, in secondi")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="secondi tra un token e il successivo in streaming")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="frazione di richieste che rispondono 503")
+    parser.add_argument("--responses", help="file JSON con una lista di {\"match\": ..., \"content\": ...}")
+    return parser.parse_args()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+    risposte = RISPOSTE_PREDEFINITE
+    contatore = itertools.count()
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "stub-model", "object": "model", "owned_by": "stub"}]})
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        lunghezza = int(self.headers.get("Content-Length", 0))
+        richiesta = json.loads(self.rfile.read(lunghezza) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+
+        with self.lock:
+            numero = next(self.contatore)
+        time.sleep(max(0.0, self.config.latency + random.uniform(-self.config.jitter, self.config.jitter)))
+
+        if random.random() < self.config.failure_rate:
+            self.send_json(503, {"error": {"message": "stub: errore simulato", "type": "server_error"}})
+            return
+
+        contenuto = self.scegli_risposta(richiesta, numero)
+        modello = richiesta.get("model", "stub-model")
+        if richiesta.get("stream"):
+            self.stream_response(contenuto, modello)
+        else:
+            prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in richiesta.get("messages", []))
+            self.send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": modello,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": contenuto}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(contenuto.split()),
+                          "total_tokens": prompt_tokens + len(contenuto.split())},
+            })
+
+    def scegli_risposta(self, richiesta, numero):
+        # La prima risposta il cui 'match' compare nell'ultimo messaggio dell'utente, altrimenti a rotazione
+        ultimo = next((str(m.get("content", "")) for m in reversed(richiesta.get("messages", [])) if m.get("role") == "user"), "")
+        for risposta in self.risposte:
+            if risposta.get("match") and risposta["match"].lower() in ultimo.lower():
+                return risposta["content"]
+        generiche = [r for r in self.risposte if not r.get("match")] or self.risposte
+        return generiche[numero % len(generiche)]["content"]
+
+    def stream_response(self, contenuto, modello):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        identificativo = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def evento(delta, finish_reason=None):
+            chunk = {
+                "id": identificativo,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": modello,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        evento({"role": "assistant", "content": ""})
+        for token in contenuto.split(" "):
+            evento({"content": token + " "})
+            time.sleep(self.config.token_delay)
+        evento({}, finish_reason="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def main():
+    args = parse_args()
+    StubHandler.config = args
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            StubHandler.risposte = json.load(f)
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Server stub LLM in ascolto su http://{args.host}:{args.port}/v1 (latenza {args.latency}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
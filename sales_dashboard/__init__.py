@@ -0,0 +1,126 @@
+"""Calcoli della dashboard di vendita, utilizzabili senza Streamlit.
+
+Le funzioni ricevono DataFrame e parametri espliciti e restituiscono DataFrame o dizionari,
+senza cache né stato di sessione: la dashboard le avvolge nelle proprie cache, mentre script
+batch, benchmark e processi worker le chiamano direttamente.
+
+    import sales_dashboard as sd
+
+    data, mancanti = sd.load_data(open('pipeline.xlsx', 'rb').read())
+    data_filtered = sd.filter_data(data, sd.all_values_filters(data))
+    metrics = sd.calculate_metrics(data_filtered)
+    summary_df = sd.compute_summary(data_filtered)
+"""
+from .aggregate import (
+    compute_cohorts,
+    compute_daily_prefix_sums,
+    compute_leaderboards,
+    compute_stage_funnel,
+    funnel_stage_columns,
+    rolling_from_prefix_sums,
+    select_top_k,
+)
+from .cycle import build_cycle_sketches, compute_cycle_percentiles
+from .downsample import downsample, lttb_indices
+from .export import (
+    celle_massime_esportazione_xlsx,
+    formati_esportazione,
+    righe_per_blocco_esportazione,
+    write_export,
+    write_export_file,
+    xlsx_export_allowed,
+)
+from .filters import Filters, all_values_filters, filter_data, frequenze_periodo
+from .forecast import (
+    build_win_model,
+    check_win_model_calibration,
+    train_win_model,
+    win_model_categorical,
+    win_model_features,
+    win_model_quota_verifica,
+    win_model_scarto_calibrazione,
+)
+from .ingest import clean_data, date_columns, expected_columns, load_data, process_canale, read_input_sheet
+from .metrics import (
+    Metrics,
+    aggregate_by_channel,
+    aggregate_by_period,
+    calculate_metrics,
+    compute_summary,
+    metriche_disponibili,
+)
+from .pivot import (
+    add_derived_metrics,
+    build_pivot_cube,
+    build_query_cube,
+    check_query_names,
+    compute_pivot,
+    filter_query_cube,
+    list_dimension_values,
+    pivot_altri,
+    pivot_dimensioni,
+    pivot_max_celle,
+    pivot_statistiche,
+    query_dimensioni,
+    query_max_righe,
+    query_metriche,
+    run_kpi_query,
+)
+
+__all__ = [
+    'Filters',
+    'Metrics',
+    'add_derived_metrics',
+    'aggregate_by_channel',
+    'aggregate_by_period',
+    'all_values_filters',
+    'build_cycle_sketches',
+    'build_pivot_cube',
+    'build_query_cube',
+    'build_win_model',
+    'calculate_metrics',
+    'celle_massime_esportazione_xlsx',
+    'check_query_names',
+    'check_win_model_calibration',
+    'clean_data',
+    'compute_cohorts',
+    'compute_cycle_percentiles',
+    'compute_daily_prefix_sums',
+    'compute_leaderboards',
+    'compute_pivot',
+    'compute_stage_funnel',
+    'compute_summary',
+    'date_columns',
+    'downsample',
+    'expected_columns',
+    'filter_data',
+    'filter_query_cube',
+    'formati_esportazione',
+    'frequenze_periodo',
+    'funnel_stage_columns',
+    'list_dimension_values',
+    'load_data',
+    'lttb_indices',
+    'metriche_disponibili',
+    'pivot_altri',
+    'pivot_dimensioni',
+    'pivot_max_celle',
+    'pivot_statistiche',
+    'process_canale',
+    'query_dimensioni',
+    'query_max_righe',
+    'query_metriche',
+    'read_input_sheet',
+    'righe_per_blocco_esportazione',
+    'rolling_from_prefix_sums',
+    'run_kpi_query',
+    'select_top_k',
+    'train_win_model',
+    'win_model_categorical',
+    'win_model_features',
+    'win_model_quota_verifica',
+    'win_model_scarto_calibrazione',
+    'write_export',
+    'write_export_file',
+    'xlsx_export_allowed',
+]
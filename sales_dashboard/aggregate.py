@@ -0,0 +1,143 @@
+"""Funnel, coorti, finestre mobili e classifiche calcolati sui dati filtrati."""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from .metrics import compute_summary, metriche_disponibili
+
+# Fasi della pipeline, nell'ordine in cui vengono raggiunte, con le etichette da visualizzare
+funnel_stage_columns = {
+    'Meeting FIssato': 'Meeting Fissato',
+    'Meeting Effettuato (SQL)': 'Meeting Effettuato (SQL)',
+    'Offerte Inviate': 'Offerta Inviata',
+    'Analisi Firmate': 'Analisi Firmata',
+    'Contratti Chiusi': 'Contratto Chiuso',
+}
+
+
+# Funzione per calcolare il funnel a più fasi di tutti i canali in un'unica passata
+def compute_stage_funnel(data_filtered: pd.DataFrame) -> tuple[pd.DataFrame, pd.Series]:
+    stage_columns = list(funnel_stage_columns)
+    stage_labels = list(funnel_stage_columns.values())
+    stage_dates = data_filtered[stage_columns]
+    canale = data_filtered['MainChannel'].rename('Canale')
+
+    # Matrice di bit delle fasi raggiunte: una data in una fase successiva implica
+    # che tutte le fasi precedenti siano state raggiunte (OR cumulativo da destra)
+    reached = np.logical_or.accumulate(stage_dates.notna().to_numpy()[:, ::-1], axis=1)[:, ::-1]
+    reached_df = pd.DataFrame(reached, columns=stage_labels, index=data_filtered.index)
+    reached_df['Persi'] = data_filtered['Persi'].notna()
+
+    # Giorni trascorsi in ciascuna fase prima di passare alla successiva
+    days_in_stage = pd.DataFrame({
+        label: (stage_dates[next_col] - stage_dates[col]).dt.days
+        for col, next_col, label in zip(stage_columns[:-1], stage_columns[1:], stage_labels[:-1])
+    }, index=data_filtered.index)
+    days_in_stage = days_in_stage.where(days_in_stage >= 0)
+
+    # Conteggi e mediane per tutti i canali, più la riga complessiva 'Tutti'
+    counts = reached_df.groupby(canale).sum()
+    counts.loc['Tutti'] = reached_df.sum()
+    medians = days_in_stage.groupby(canale).median()
+    medians.loc['Tutti'] = days_in_stage.median()
+    medians = medians.reindex(index=counts.index, columns=stage_labels)
+
+    stage_counts = counts[stage_labels]
+    # La prima fase non ha una fase precedente: la sua conversione è rispetto a sé stessa (100%)
+    previous = stage_counts.shift(1, axis=1)
+    previous[stage_labels[0]] = stage_counts[stage_labels[0]]
+    funnel_df = pd.DataFrame({
+        'Opportunità': stage_counts.stack(),
+        'Conversione dalla Fase Precedente (%)': (stage_counts / previous.replace(0, np.nan) * 100).stack(future_stack=True),
+        'Conversione dalla Prima Fase (%)': stage_counts.div(stage_counts[stage_labels[0]].replace(0, np.nan), axis=0).mul(100).stack(future_stack=True),
+        'Giorni Mediani nella Fase': medians.stack(future_stack=True),
+    })
+    funnel_df.index.names = ['Canale', 'Fase']
+    return funnel_df, counts['Persi']
+
+
+# Funzione per calcolare la matrice delle coorti per mese di creazione
+def compute_cohorts(data_filtered: pd.DataFrame, finestre_giorni: tuple[int, ...] = (30, 60, 90)) -> tuple[pd.DataFrame, pd.DataFrame]:
+    created = data_filtered['Opportunity_Created']
+    won = data_filtered['Closed_Won']
+    valid = created.notnull()
+    coorte = created[valid].dt.to_period('M').astype(str).rename('Coorte')
+    dimensione_coorte = coorte.value_counts().sort_index()
+
+    # Mesi dalla creazione alla chiusura, calcolati con aritmetica vettoriale sulle date
+    mesi_alla_chiusura = ((won.dt.year - created.dt.year) * 12 + (won.dt.month - created.dt.month))[valid]
+    chiusa = mesi_alla_chiusura.notnull() & (mesi_alla_chiusura >= 0)
+    vinte_per_mese = pd.crosstab(coorte[chiusa], mesi_alla_chiusura[chiusa].astype(int).rename('Mesi alla Chiusura'))
+    if len(vinte_per_mese.columns):
+        vinte_per_mese = vinte_per_mese.reindex(columns=range(int(vinte_per_mese.columns.max()) + 1), fill_value=0)
+    vinte_per_mese = vinte_per_mese.reindex(index=dimensione_coorte.index, fill_value=0)
+
+    # Percentuale cumulativa di opportunità vinte per coorte
+    matrice_coorti = vinte_per_mese.cumsum(axis=1).div(dimensione_coorte, axis=0) * 100
+
+    # Percentuale vinta entro 30/60/90 giorni dalla creazione
+    giorni_alla_chiusura = data_filtered['Days_to_Close'][valid]
+    entro_finestre = pd.DataFrame({
+        f"Vinte entro {giorni} giorni (%)": (giorni_alla_chiusura >= 0) & (giorni_alla_chiusura <= giorni)
+        for giorni in finestre_giorni
+    })
+    finestre_df = entro_finestre.groupby(coorte).mean() * 100
+    finestre_df.insert(0, 'Opportunità Create', dimensione_coorte)
+    return matrice_coorti, finestre_df
+
+
+# Funzione per calcolare le somme cumulative giornaliere degli eventi.
+# Ogni evento è contato alla propria data: creazione, chiusura vinta o persa.
+def compute_daily_prefix_sums(data_filtered: pd.DataFrame) -> pd.DataFrame:
+    giorno_vinta = data_filtered['Closed_Won'].dt.normalize()
+    daily = pd.DataFrame({
+        'Opportunità Create': data_filtered['Opportunity_Created'].dt.normalize().value_counts(),
+        'Opportunità Vinte': giorno_vinta.value_counts(),
+        'Opportunità Perse': data_filtered['Closed_Lost'].dt.normalize().value_counts(),
+        'Revenue Totale': data_filtered['Valore Tot €'].groupby(giorno_vinta).sum(),
+        'Giorni di Chiusura': data_filtered['Days_to_Close'].groupby(giorno_vinta).sum(),
+        'Vinte con Durata': data_filtered['Days_to_Close'].groupby(giorno_vinta).count(),
+    }).fillna(0).sort_index()
+    if daily.empty:
+        return daily
+    return daily.asfreq('D', fill_value=0).cumsum()
+
+
+# Funzione per calcolare le metriche su una finestra mobile a partire dalle somme cumulative:
+# la somma su qualsiasi finestra costa O(giorni), indipendentemente dalla sua lunghezza
+def rolling_from_prefix_sums(prefix_sums: pd.DataFrame, window: int) -> pd.DataFrame:
+    sums = prefix_sums - prefix_sums.shift(window, fill_value=0)
+    rolling_df = sums[metriche_disponibili].copy()
+    chiuse = sums['Opportunità Vinte'] + sums['Opportunità Perse']
+    rolling_df['Win Rate'] = sums['Opportunità Vinte'] / chiuse.replace(0, np.nan) * 100
+    acv = sums['Revenue Totale'] / sums['Opportunità Vinte'].replace(0, np.nan)
+    tempo_medio_chiusura = sums['Giorni di Chiusura'] / sums['Vinte con Durata'].replace(0, np.nan)
+    rolling_df['Pipeline Velocity'] = (sums['Opportunità Create'] * (rolling_df['Win Rate'] / 100) * acv) / tempo_medio_chiusura.where(tempo_medio_chiusura > 0)
+    return rolling_df
+
+
+# Funzione per selezionare le prime n righe per una metrica con selezione parziale:
+# argpartition isola i k elementi in O(righe) e solo quelli vengono ordinati
+def select_top_k(summary_df: pd.DataFrame, column: str, n: int, ascending: bool = False) -> pd.DataFrame:
+    values = summary_df[column].to_numpy(dtype=float)
+    valid = np.flatnonzero(~np.isnan(values))
+    n = min(n, len(valid))
+    if n == 0:
+        return summary_df.iloc[0:0]
+    keys = values[valid] if ascending else -values[valid]
+    if n < len(valid):
+        candidates = np.argpartition(keys, n - 1)[:n]
+    else:
+        candidates = np.arange(len(valid))
+    ordered = candidates[np.argsort(keys[candidates], kind='stable')]
+    return summary_df.iloc[valid[ordered]]
+
+
+# Funzione per calcolare le classifiche top/bottom per sales rep o azienda; la tabella riepilogativa
+# per grouping_column, se già calcolata (es. da una cache), può essere passata in summary_df
+def compute_leaderboards(data_filtered: pd.DataFrame, grouping_column: str, metrica: str, n: int,
+                         summary_df: pd.DataFrame | None = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    if summary_df is None:
+        summary_df = compute_summary(data_filtered, grouping_column)
+    return select_top_k(summary_df, metrica, n), select_top_k(summary_df, metrica, n, ascending=True)
@@ -0,0 +1,120 @@
+"""Percentili del ciclo di vendita con sketch KLL fondibili, calcolati per cella al caricamento."""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+# Sketch KLL per quantili: una lista di livelli, dove ogni elemento del livello h pesa 2**h.
+# Gli sketch si possono fondere tra loro, quindi i percentili di qualsiasi combinazione di
+# filtri si ottengono fondendo gli sketch delle celle invece di ordinare tutte le righe.
+kll_k = 200
+
+
+def kll_capacity(level: int, n_levels: int) -> int:
+    return max(2, int(np.ceil(kll_k * (2 / 3) ** (n_levels - level - 1))))
+
+
+def kll_compress(levels: list[np.ndarray]) -> list[np.ndarray]:
+    h = 0
+    while h < len(levels):
+        if len(levels[h]) > kll_capacity(h, len(levels)):
+            if h + 1 == len(levels):
+                levels.append(np.empty(0))
+            items = np.sort(levels[h])
+            # Con un numero dispari di elementi uno resta al livello corrente; l'offset
+            # alterna in modo deterministico tra elementi pari e dispari
+            odd = len(items) % 2
+            offset = (len(items) // 2 + h) % 2
+            levels[h + 1] = np.concatenate([levels[h + 1], items[odd + offset::2]])
+            levels[h] = items[:odd]
+        h += 1
+    return levels
+
+
+def kll_build(values) -> list[np.ndarray]:
+    return kll_compress([np.asarray(values, dtype=float)])
+
+
+def kll_merge(sketches: list[list[np.ndarray]]) -> list[np.ndarray]:
+    n_levels = max((len(sketch) for sketch in sketches), default=0)
+    levels = [
+        np.concatenate([sketch[h] for sketch in sketches if h < len(sketch)])
+        for h in range(n_levels)
+    ]
+    return kll_compress(levels)
+
+
+def kll_count(sketch: list[np.ndarray]) -> int:
+    return int(sum(len(items) * 2 ** h for h, items in enumerate(sketch)))
+
+
+def kll_quantiles(sketch: list[np.ndarray], quantiles: list[float]) -> list[float]:
+    items = np.concatenate(sketch) if sketch else np.empty(0)
+    if len(items) == 0:
+        return [np.nan] * len(quantiles)
+    weights = np.concatenate([np.full(len(level), 2 ** h) for h, level in enumerate(sketch)])
+    order = np.argsort(items, kind='stable')
+    cumulative = np.cumsum(weights[order])
+    ranks = np.searchsorted(cumulative, np.asarray(quantiles) * cumulative[-1], side='left')
+    return list(items[order][np.minimum(ranks, len(items) - 1)])
+
+
+# Funzione per costruire gli sketch dei giorni di chiusura al caricamento, una cella per
+# ogni combinazione di canale, sales rep, servizio, stato e mese di creazione
+def build_cycle_sketches(data: pd.DataFrame) -> pd.DataFrame:
+    won = data[data['Closed_Won'].notnull() & data['Days_to_Close'].notnull()]
+    mese = won['Opportunity_Created'].dt.to_period('M')
+    cell_columns = [won['MainChannel'], won['TeamMember'], won['Servizio'], won['Stato'], mese.rename('Mese')]
+    cells = won['Days_to_Close'].groupby(cell_columns, dropna=False).agg(kll_build).rename('sketch').reset_index()
+
+    # Colonne di periodo precalcolate per applicare i filtri temporali alle celle
+    cells['Trimestre'] = cells['Mese'].dt.asfreq('Q').astype(str)
+    cells['Anno'] = cells['Mese'].dt.year
+    cells['Inizio Mese'] = cells['Mese'].dt.start_time
+    cells['Fine Mese'] = cells['Mese'].dt.end_time
+    cells['Mese'] = cells['Mese'].astype(str)
+    return cells
+
+
+# Funzione per calcolare mediana, P75 e P90 del ciclo di vendita per canale e sales rep
+# fondendo gli sketch delle celle selezionate
+def compute_cycle_percentiles(cells: pd.DataFrame, data_filtered: pd.DataFrame, filtri: tuple) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    periodo_temporale, selezione_date, selected_canali, selected_sales_reps, selected_servizi, selected_stati = filtri
+    cell_mask = (
+        cells['MainChannel'].isin(selected_canali) &
+        cells['TeamMember'].isin(selected_sales_reps) &
+        cells['Servizio'].isin(selected_servizi) &
+        cells['Stato'].isin(selected_stati)
+    )
+    partial_rows = data_filtered.iloc[0:0]
+    if periodo_temporale == "Intervallo Date":
+        start_date, end_date = pd.to_datetime(selezione_date[0]), pd.to_datetime(selezione_date[1])
+        full_month = (cells['Inizio Mese'] >= start_date) & (cells['Fine Mese'] <= end_date)
+        cell_mask &= full_month
+        # I mesi tagliati dall'intervallo vengono aggiunti dalle righe già filtrate
+        mese_filtrato = data_filtered['Opportunity_Created'].dt.to_period('M').astype(str)
+        partial_rows = data_filtered[~mese_filtrato.isin(cells.loc[full_month, 'Mese'])]
+        partial_rows = partial_rows[partial_rows['Closed_Won'].notnull() & partial_rows['Days_to_Close'].notnull()]
+    else:
+        cell_mask &= cells[periodo_temporale].isin(selezione_date)
+
+    selected = pd.concat([
+        cells.loc[cell_mask, ['MainChannel', 'TeamMember', 'sketch']],
+        partial_rows.groupby(['MainChannel', 'TeamMember'])['Days_to_Close'].agg(kll_build).rename('sketch').reset_index(),
+    ], ignore_index=True)
+
+    quantiles = [0.5, 0.75, 0.9]
+
+    def percentiles_table(group_column, label):
+        rows = []
+        groups = [('Tutti', selected['sketch'])] if group_column is None else selected.groupby(group_column)['sketch']
+        for name, sketches in groups:
+            merged = kll_merge(list(sketches))
+            rows.append([name, kll_count(merged)] + kll_quantiles(merged, quantiles))
+        return pd.DataFrame(rows, columns=[label, 'Opportunità Vinte', 'Mediana (giorni)', 'P75 (giorni)', 'P90 (giorni)']).set_index(label)
+
+    return (
+        percentiles_table(None, 'Totale'),
+        percentiles_table('MainChannel', 'Canale'),
+        percentiles_table('TeamMember', 'Sales Rep'),
+    )
@@ -0,0 +1,48 @@
+"""Riduzione dei punti delle serie temporali da disegnare, con Largest-Triangle-Three-Buckets."""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+# Funzione per selezionare gli indici dei punti da mantenere con Largest-Triangle-Three-Buckets:
+# per ogni bucket si tiene il punto che forma il triangolo più grande con il punto scelto nel
+# bucket precedente e la media del successivo, preservando picchi e valli della serie
+def lttb_indices(x, y, n_out: int) -> np.ndarray:
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_start, next_end = end, (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_start:max(next_end, next_start + 1)].mean()
+        avg_y = y[next_start:max(next_end, next_start + 1)].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+# Funzione per ridurre i punti di un DataFrame entro max_points per traccia: ogni serie (colonna y
+# o gruppo) è campionata separatamente; in formato largo si tiene l'unione degli indici
+def downsample(df: pd.DataFrame, x: str, y_columns: list[str], max_points: int, group: str | None = None) -> pd.DataFrame:
+    if group is not None:
+        parti = [downsample(parte, x, y_columns, max_points) for _, parte in df.groupby(group, sort=False)]
+        return pd.concat(parti) if parti else df
+    if len(df) <= max_points:
+        return df
+    x_values = df[x]
+    if pd.api.types.is_datetime64_any_dtype(x_values):
+        x_numeric = x_values.astype('int64').to_numpy()
+    else:
+        # Periodi in formato stringa: le posizioni sono equispaziate sull'asse
+        x_numeric = np.arange(len(df))
+    budget = max(3, max_points // len(y_columns))
+    keep = np.unique(np.concatenate([lttb_indices(x_numeric, df[col].to_numpy(), budget) for col in y_columns]))
+    return df.iloc[keep]
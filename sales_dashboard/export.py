@@ -0,0 +1,80 @@
+"""Esportazione dei DataFrame in CSV, Parquet e XLSX."""
+from __future__ import annotations
+
+import io
+from typing import BinaryIO
+
+import pandas as pd
+
+# Formati di esportazione: estensione del file e tipo MIME
+formati_esportazione = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'XLSX': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+righe_per_blocco_esportazione = 50_000
+
+# Celle massime esportabili in XLSX: openpyxl serializza le celle una per una in Python (decine di
+# secondi per qualche centinaio di migliaia di righe) e la cartella di lavoro finisce comunque per
+# intero in memoria. Oltre questa soglia l'esportazione è proposta solo in CSV o Parquet.
+celle_massime_esportazione_xlsx = 1_000_000
+
+
+# Funzione per controllare se un DataFrame è esportabile in XLSX entro la soglia di celle
+def xlsx_export_allowed(df: pd.DataFrame) -> bool:
+    return len(df) * max(len(df.columns), 1) <= celle_massime_esportazione_xlsx
+
+
+# Funzione per scrivere un DataFrame nel formato richiesto nel file binario 'destinazione', a blocchi
+# di righe: per CSV e Parquet in memoria c'è un solo blocco alla volta oltre a quanto il file stesso
+# trattiene (nulla, per un file su disco). L'XLSX è limitato a celle_massime_esportazione_xlsx celle.
+def write_export_file(df: pd.DataFrame, formato: str, destinazione: BinaryIO) -> None:
+    blocchi = range(0, max(len(df), 1), righe_per_blocco_esportazione)
+
+    if formato == 'CSV':
+        testo = io.TextIOWrapper(destinazione, encoding='utf-8', newline='', write_through=True)
+        for inizio in blocchi:
+            df.iloc[inizio:inizio + righe_per_blocco_esportazione].to_csv(testo, index=False, header=(inizio == 0))
+        # Stacca il wrapper testuale senza chiudere il file sottostante
+        testo.flush()
+        testo.detach()
+
+    elif formato == 'Parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Le colonne con tipi misti (frequenti nei fogli Excel) vengono scritte come testo
+        misti = [col for col in df.columns if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True).startswith('mixed')]
+        df = df.astype({col: 'string' for col in misti})
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        with pq.ParquetWriter(destinazione, schema) as writer:
+            for inizio in blocchi:
+                blocco = df.iloc[inizio:inizio + righe_per_blocco_esportazione]
+                writer.write_table(pa.Table.from_pandas(blocco, schema=schema, preserve_index=False))
+
+    elif formato == 'XLSX':
+        if not xlsx_export_allowed(df):
+            raise ValueError(f"Troppe celle per l'esportazione XLSX (massimo {celle_massime_esportazione_xlsx:,}): usare CSV o Parquet")
+
+        # Modalità write-only di openpyxl: le righe non restano in memoria come celle, solo nel file
+        import openpyxl
+
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet("Dati")
+        sheet.append([str(col) for col in df.columns])
+        for inizio in blocchi:
+            blocco = df.iloc[inizio:inizio + righe_per_blocco_esportazione].astype(object)
+            for riga in blocco.where(blocco.notnull(), None).itertuples(index=False, name=None):
+                sheet.append(riga)
+        workbook.save(destinazione)
+
+    else:
+        raise ValueError(f"Formato di esportazione non supportato: {formato}")
+
+
+# Funzione per ottenere l'esportazione come bytes, per file piccoli o script batch: l'intero file
+# resta in memoria, quindi per le esportazioni grandi è preferibile write_export_file su un file
+def write_export(df: pd.DataFrame, formato: str) -> bytes:
+    buffer = io.BytesIO()
+    write_export_file(df, formato, buffer)
+    return buffer.getvalue()
@@ -0,0 +1,53 @@
+"""Filtri sui dati puliti, con lo stesso stato dei filtri della barra laterale della dashboard."""
+from __future__ import annotations
+
+from typing import NamedTuple
+
+import pandas as pd
+
+# Frequenze pandas corrispondenti ai periodi selezionabili
+frequenze_periodo = {'Mese': 'M', 'Trimestre': 'Q', 'Anno': 'Y'}
+
+
+# Stato dei filtri. È una tupla, quindi si può usare direttamente come chiave di cache.
+# selezione_date è la coppia (inizio, fine) per "Intervallo Date", altrimenti i periodi selezionati.
+class Filters(NamedTuple):
+    periodo_temporale: str
+    selezione_date: tuple
+    canali: tuple
+    sales_reps: tuple
+    servizi: tuple
+    stati: tuple
+
+
+# Funzione per creare i filtri che selezionano tutti i valori presenti nei dati
+def all_values_filters(data: pd.DataFrame) -> Filters:
+    return Filters(
+        "Intervallo Date",
+        (data['Opportunity_Created'].min().date(), data['Opportunity_Created'].max().date()),
+        tuple(data['MainChannel'].unique()),
+        tuple(data['TeamMember'].dropna().unique()),
+        tuple(data['Servizio'].dropna().unique()),
+        tuple(data['Stato'].dropna().unique()),
+    )
+
+
+# Funzione per filtrare i dati in base allo stato dei filtri
+def filter_data(data: pd.DataFrame, filtri: tuple) -> pd.DataFrame:
+    periodo_temporale, selezione_date, selected_canali, selected_sales_reps, selected_servizi, selected_stati = filtri
+
+    if periodo_temporale == "Intervallo Date":
+        start_date, end_date = selezione_date
+        date_mask = (data['Opportunity_Created'] >= pd.to_datetime(start_date)) & (data['Opportunity_Created'] <= pd.to_datetime(end_date))
+    elif periodo_temporale == "Anno":
+        date_mask = data['Opportunity_Created'].dt.year.isin(selezione_date)
+    else:
+        date_mask = data['Opportunity_Created'].dt.to_period(frequenze_periodo[periodo_temporale]).astype(str).isin(selezione_date)
+
+    return data[
+        date_mask &
+        (data['MainChannel'].isin(selected_canali)) &
+        (data['TeamMember'].isin(selected_sales_reps)) &
+        (data['Servizio'].isin(selected_servizi)) &
+        (data['Stato'].isin(selected_stati))
+    ]
@@ -0,0 +1,80 @@
+"""Modello di probabilità di vittoria delle opportunità aperte, con verifica della calibrazione."""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+# Variabili usate dal modello di probabilità di vittoria. L'età dell'opportunità non è usata:
+# per le chiuse sarebbe l'età alla chiusura, per le aperte l'età alla fine del dataset, due
+# grandezze non confrontabili che falsano le probabilità delle opportunità aperte
+win_model_categorical = ['MainChannel', 'Servizio', 'Settore', 'Dimensioni', 'Ruolo']
+
+# Quota delle opportunità chiuse più recenti tenute da parte per la verifica della calibrazione,
+# e scarto oltre il quale la probabilità media prevista è segnalata come poco affidabile
+win_model_quota_verifica = 0.2
+win_model_scarto_calibrazione = 10
+
+
+# Funzione per preparare le variabili del modello
+def win_model_features(data: pd.DataFrame) -> pd.DataFrame:
+    return data[win_model_categorical].astype(str).where(data[win_model_categorical].notnull(), 'N/D')
+
+
+# Funzione per costruire il modello da addestrare (scikit-learn è importato solo quando serve)
+def build_win_model():
+    from sklearn.compose import ColumnTransformer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import OneHotEncoder
+
+    return make_pipeline(
+        ColumnTransformer([('categoriche', OneHotEncoder(handle_unknown='ignore'), win_model_categorical)]),
+        LogisticRegression(max_iter=1000),
+    )
+
+
+# Funzione per verificare la calibrazione: il modello addestrato sulle opportunità chiuse meno recenti
+# prevede quelle chiuse più di recente, e la probabilità media prevista si confronta con il win rate
+# effettivo. Restituisce None se i dati non bastano per la verifica.
+def check_win_model_calibration(features: pd.DataFrame, vinta: pd.Series, data_chiusura: pd.Series) -> dict | None:
+    ordine = data_chiusura.sort_values(kind='stable').index
+    n_verifica = int(len(ordine) * win_model_quota_verifica)
+    if n_verifica:
+        addestramento, verifica = ordine[:-n_verifica], ordine[-n_verifica:]
+    else:
+        addestramento, verifica = ordine, ordine[:0]
+    if n_verifica < 5 or vinta[addestramento].nunique() < 2:
+        return None
+    model = build_win_model().fit(features.loc[addestramento], vinta[addestramento])
+    return {
+        'opportunita': n_verifica,
+        'probabilita_media': float(model.predict_proba(features.loc[verifica])[:, 1].mean() * 100),
+        'win_rate_effettivo': float(vinta[verifica].mean() * 100),
+    }
+
+
+# Funzione per addestrare il modello sulle opportunità chiuse e calcolare in un'unica passata
+# la probabilità di vittoria di tutte le opportunità aperte. Restituisce None se le opportunità
+# chiuse non bastano per l'addestramento.
+def train_win_model(data: pd.DataFrame) -> dict | None:
+    features = win_model_features(data)
+    vinta = data['Closed_Won'].notnull()
+    data_chiusura = data['Closed_Won'].combine_first(data['Closed_Lost'])
+    chiusa = vinta | data['Closed_Lost'].notnull()
+
+    if chiusa.sum() < 10 or vinta[chiusa].nunique() < 2:
+        return None
+
+    calibrazione = check_win_model_calibration(features[chiusa], vinta[chiusa], data_chiusura[chiusa])
+    model = build_win_model().fit(features[chiusa], vinta[chiusa])
+
+    aperte = data['Stato'] == 'In Progress'
+    probabilita = pd.Series(np.nan, index=data.index)
+    if aperte.any():
+        probabilita[aperte] = model.predict_proba(features[aperte])[:, 1]
+    return {
+        'probabilita': probabilita,
+        'opportunita_addestramento': int(chiusa.sum()),
+        'win_rate_addestramento': float(vinta[chiusa].mean() * 100),
+        'calibrazione': calibrazione,
+    }
@@ -0,0 +1,124 @@
+"""Lettura e pulizia del foglio dei dati di vendita."""
+from __future__ import annotations
+
+import io
+
+import pandas as pd
+
+# Colonne attese nel foglio dei dati
+expected_columns = ['Sales', 'Canale', 'Meeting FIssato', 'Meeting Effettuato (SQL)', 'Offerte Inviate', 'Analisi Firmate', 'Contratti Chiusi', 'Persi', 'Stato', 'Servizio', 'Valore Tot €', 'Azienda', 'Nome Persona', 'Ruolo', 'Dimensioni', 'Settore', 'Come mai ha accettato?', 'Obiezioni', 'Note']
+
+# Colonne di data del foglio, nell'ordine delle fasi della pipeline
+date_columns = ['Meeting FIssato', 'Meeting Effettuato (SQL)', 'Offerte Inviate', 'Analisi Firmate', 'Contratti Chiusi', 'Persi']
+
+
+# Funzione per processare il campo 'Canale'
+def process_canale(canale: object) -> str:
+    canale = str(canale).strip().lower()
+    main_channel = canale.title()  # Valore predefinito
+
+    # Gestione dei canali
+    if 'linkedin' in canale:
+        if 'in' in canale:
+            main_channel = 'LinkedIn Inbound'
+        elif 'out' in canale:
+            main_channel = 'LinkedIn Outbound'
+        else:
+            main_channel = 'LinkedIn'
+    elif 'advertising' in canale:
+        main_channel = 'Advertising'
+    elif 'eventi' in canale:
+        main_channel = 'Eventi'
+    elif 'referral' in canale:
+        main_channel = 'Referral'
+    elif 'rinnovi' in canale or 'upselling' in canale:
+        main_channel = 'Rinnovi-Upselling'
+    elif 'cold calling' in canale:
+        main_channel = 'Cold Calling'
+    elif 'sito' in canale:
+        main_channel = 'Sito'
+    else:
+        main_channel = canale.title()
+
+    return main_channel
+
+
+# Funzione per leggere il foglio dei dati dal file Excel
+def read_input_sheet(file_bytes: bytes) -> pd.DataFrame:
+    # Ottiene i nomi dei fogli nel file Excel
+    xls = pd.ExcelFile(io.BytesIO(file_bytes))
+    sheet_names = xls.sheet_names
+
+    # Cerca il foglio che contiene 'input' (case-insensitive)
+    sheet_name = None
+    for name in sheet_names:
+        if 'input' in name.lower():
+            sheet_name = name
+            break
+
+    if sheet_name is None:
+        # Se non trova un foglio con 'input', usa il primo foglio
+        sheet_name = xls.sheet_names[0]
+
+    # Legge il foglio corretto
+    data = pd.read_excel(xls, sheet_name=sheet_name)
+
+    # Rimuove eventuali spazi nei nomi delle colonne
+    data.columns = data.columns.str.strip()
+    return data
+
+
+# Funzione per pulire i dati letti e aggiungere le colonne derivate usate dalla dashboard.
+# Restituisce i dati puliti e l'elenco delle colonne mancanti (vuoto se il foglio è valido).
+def clean_data(data: pd.DataFrame) -> tuple[pd.DataFrame | None, list[str]]:
+    # Verifica se le colonne sono state lette correttamente
+    missing_columns = [col for col in expected_columns if col not in data.columns]
+    if missing_columns:
+        return None, missing_columns
+
+    # Pulizia delle colonne di data
+    for col in date_columns:
+        if col in data.columns:
+            data[col] = pd.to_datetime(data[col], dayfirst=True, errors='coerce')
+
+    # Pulizia della colonna 'Valore Tot €'
+    if 'Valore Tot €' in data.columns:
+        data['Valore Tot €'] = data['Valore Tot €'].astype(str).replace({'€': '', ',': '', r'\.': ''}, regex=True)
+        data['Valore Tot €'] = pd.to_numeric(data['Valore Tot €'], errors='coerce').fillna(0)
+    else:
+        data['Valore Tot €'] = 0
+
+    # Processamento del campo 'Canale'
+    if 'Canale' in data.columns:
+        data['MainChannel'] = data['Canale'].apply(process_canale)
+    else:
+        data['MainChannel'] = 'Unknown'
+
+    # Aggiunta del campo 'TeamMember' dal campo 'Sales'
+    if 'Sales' in data.columns:
+        data['TeamMember'] = data['Sales'].str.title()
+    else:
+        data['TeamMember'] = None
+
+    # Creazione delle colonne 'Opportunity_Created', 'Closed_Won', 'Closed_Lost'
+    # 'Opportunity_Created' lo prendiamo da 'Meeting Effettuato (SQL)' o 'Meeting FIssato'
+    data['Opportunity_Created'] = data['Meeting Effettuato (SQL)'].combine_first(data['Meeting FIssato'])
+
+    # 'Closed_Won' lo prendiamo da 'Contratti Chiusi'
+    data['Closed_Won'] = data['Contratti Chiusi']
+
+    # 'Closed_Lost' lo prendiamo da 'Persi'
+    data['Closed_Lost'] = data['Persi']
+
+    # Tempo di chiusura per le opportunità vinte, calcolato una sola volta al caricamento
+    data['Days_to_Close'] = (data['Closed_Won'] - data['Opportunity_Created']).dt.days
+
+    # Aggiusta la colonna 'Stato'
+    data['Stato'] = data['Stato'].fillna('In Progress')
+
+    return data, []
+
+
+# Funzione per caricare e pulire i dati di un file Excel
+def load_data(file_bytes: bytes) -> tuple[pd.DataFrame | None, list[str]]:
+    return clean_data(read_input_sheet(file_bytes))
@@ -0,0 +1,93 @@
+"""Metriche generali e tabelle aggregate per canale, sales rep e periodo."""
+from __future__ import annotations
+
+from typing import TypedDict
+
+import pandas as pd
+
+# Metriche additive disponibili per trend e confronti
+metriche_disponibili = ['Opportunità Create', 'Opportunità Vinte', 'Opportunità Perse', 'Revenue Totale']
+
+
+# Metriche generali calcolate su un insieme di opportunità
+class Metrics(TypedDict):
+    totale_opportunita: int
+    totale_vinti: int
+    totale_persi: int
+    totale_revenue: float
+    win_rate: float
+    lost_rate: float
+    tempo_medio_chiusura: float
+    acv: float
+    pipeline_velocity: float
+
+
+# Funzione per calcolare le metriche
+def calculate_metrics(data: pd.DataFrame) -> Metrics:
+    totale_opportunita = data['Opportunity_Created'].notnull().sum()
+    totale_vinti = data['Closed_Won'].notnull().sum()
+    totale_persi = data['Closed_Lost'].notnull().sum()
+    totale_revenue = data.loc[data['Closed_Won'].notnull(), 'Valore Tot €'].sum()
+    win_rate = (totale_vinti / (totale_vinti + totale_persi)) * 100 if (totale_vinti + totale_persi) > 0 else 0
+    lost_rate = (totale_persi / (totale_vinti + totale_persi)) * 100 if (totale_vinti + totale_persi) > 0 else 0
+
+    # Tempo medio di chiusura per le opportunità vinte ('Days_to_Close' è calcolato al caricamento)
+    tempo_medio_chiusura = data.loc[data['Closed_Won'].notnull(), 'Days_to_Close'].mean()
+
+    # ACV
+    acv = data.loc[data['Closed_Won'].notnull(), 'Valore Tot €'].mean()
+
+    # Pipeline Velocity
+    pipeline_velocity = (totale_opportunita * (win_rate/100) * acv) / tempo_medio_chiusura if tempo_medio_chiusura and tempo_medio_chiusura > 0 else 0
+
+    return {
+        'totale_opportunita': totale_opportunita,
+        'totale_vinti': totale_vinti,
+        'totale_persi': totale_persi,
+        'totale_revenue': totale_revenue,
+        'win_rate': win_rate,
+        'lost_rate': lost_rate,
+        'tempo_medio_chiusura': tempo_medio_chiusura,
+        'acv': acv,
+        'pipeline_velocity': pipeline_velocity
+    }
+
+
+# Funzione per creare la tabella riepilogativa per canale (o per un'altra colonna di raggruppamento)
+def compute_summary(data_filtered: pd.DataFrame, grouping_column: str = 'MainChannel') -> pd.DataFrame:
+    # 'count' conta i valori non nulli: equivale a x.notnull().sum() ma è vettorizzato
+    summary_df = data_filtered.groupby(grouping_column).agg(**{
+        'Opportunità Create': ('Opportunity_Created', 'count'),
+        'Opportunità Perse': ('Closed_Lost', 'count'),
+        'Opportunità Vinte': ('Closed_Won', 'count'),
+        'Revenue Totale': ('Valore Tot €', 'sum'),
+        'Tempo Medio di Chiusura (giorni)': ('Days_to_Close', 'mean'),
+    })
+
+    summary_df['Valore Medio Contratto'] = summary_df['Revenue Totale'] / summary_df['Opportunità Vinte']
+    summary_df['Win Rate'] = (summary_df['Opportunità Vinte'] / (summary_df['Opportunità Vinte'] + summary_df['Opportunità Perse'])) * 100
+    summary_df['Pipeline Velocity'] = (summary_df['Opportunità Create'] * (summary_df['Win Rate']/100) * summary_df['Valore Medio Contratto']) / summary_df['Tempo Medio di Chiusura (giorni)']
+    summary_df['Pipeline Velocity'] = summary_df['Pipeline Velocity'].fillna(0)
+    return summary_df
+
+
+# Funzione per aggregare le metriche per periodo (frequenza pandas, es. 'M', 'Q', 'Y', 'D')
+def aggregate_by_period(data_filtered: pd.DataFrame, freq: str) -> pd.DataFrame:
+    periodo = data_filtered['Opportunity_Created'].dt.to_period(freq).astype(str).rename('Periodo')
+    period_df = data_filtered.groupby(periodo).agg(**{
+        'Opportunità Create': ('Opportunity_Created', 'count'),
+        'Opportunità Vinte': ('Closed_Won', 'count'),
+        'Opportunità Perse': ('Closed_Lost', 'count'),
+        'Revenue Totale': ('Valore Tot €', 'sum'),
+    }).reset_index()
+    return period_df.sort_values('Periodo')
+
+
+# Funzione per aggregare le metriche per canale
+def aggregate_by_channel(data_filtered: pd.DataFrame) -> pd.DataFrame:
+    return data_filtered.groupby('MainChannel').agg(**{
+        'Opportunità Create': ('Opportunity_Created', 'count'),
+        'Opportunità Vinte': ('Closed_Won', 'count'),
+        'Opportunità Perse': ('Closed_Lost', 'count'),
+        'Revenue Totale': ('Valore Tot €', 'sum'),
+    }).reset_index()
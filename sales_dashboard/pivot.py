@@ -0,0 +1,148 @@
+"""Aggregato sparso per il pivot con subtotali e API di interrogazione dei KPI."""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from .aggregate import select_top_k
+
+# Dimensioni disponibili per il pivot e budget di memoria dell'aggregato sparso
+pivot_dimensioni = {'Canale': 'MainChannel', 'Sales Rep': 'TeamMember', 'Servizio': 'Servizio', 'Settore': 'Settore', 'Dimensioni': 'Dimensioni', 'Azienda': 'Azienda'}
+pivot_statistiche = ['Opportunità Create', 'Opportunità Vinte', 'Opportunità Perse', 'Revenue Totale', 'Giorni di Chiusura', 'Vinte con Durata']
+pivot_max_celle = 100_000
+pivot_altri = 'Altri'
+
+
+# Funzione per costruire l'aggregato sparso delle statistiche additive su tutte le dimensioni del
+# pivot: contiene solo le combinazioni presenti nei dati
+def build_pivot_cube(data_filtered: pd.DataFrame) -> pd.DataFrame:
+    chiavi = [data_filtered[col].fillna('N/D').rename(nome) for nome, col in pivot_dimensioni.items()]
+    cube = data_filtered.groupby(chiavi).agg(**{
+        'Opportunità Create': ('Opportunity_Created', 'count'),
+        'Opportunità Vinte': ('Closed_Won', 'count'),
+        'Opportunità Perse': ('Closed_Lost', 'count'),
+        'Revenue Totale': ('Valore Tot €', 'sum'),
+        'Giorni di Chiusura': ('Days_to_Close', 'sum'),
+        'Vinte con Durata': ('Days_to_Close', 'count'),
+    }).reset_index()
+
+    # Entro il budget di memoria: i valori meno rilevanti per revenue delle dimensioni ad alta
+    # cardinalità (es. Sales Rep x Azienda) vengono accorpati in 'Altri', ri-aggregando il cubo
+    # stesso senza tornare alle righe grezze
+    max_valori = 1000
+    while len(cube) > pivot_max_celle and max_valori > 1:
+        for nome in pivot_dimensioni:
+            revenue_per_valore = cube.groupby(nome)['Revenue Totale'].sum()
+            if len(revenue_per_valore) > max_valori:
+                tenuti = revenue_per_valore.nlargest(max_valori).index
+                cube[nome] = cube[nome].where(cube[nome].isin(tenuti), pivot_altri)
+        cube = cube.groupby(list(pivot_dimensioni), as_index=False)[pivot_statistiche].sum()
+        max_valori //= 2
+    return cube
+
+
+# Funzione per aggiungere le metriche derivate alle statistiche additive
+def add_derived_metrics(stats_df: pd.DataFrame) -> pd.DataFrame:
+    stats_df['Valore Medio Contratto'] = stats_df['Revenue Totale'] / stats_df['Opportunità Vinte'].replace(0, np.nan)
+    stats_df['Win Rate'] = stats_df['Opportunità Vinte'] / (stats_df['Opportunità Vinte'] + stats_df['Opportunità Perse']).replace(0, np.nan) * 100
+    stats_df['Tempo Medio di Chiusura (giorni)'] = stats_df['Giorni di Chiusura'] / stats_df['Vinte con Durata'].replace(0, np.nan)
+    stats_df['Pipeline Velocity'] = ((stats_df['Opportunità Create'] * (stats_df['Win Rate'] / 100) * stats_df['Valore Medio Contratto']) / stats_df['Tempo Medio di Chiusura (giorni)']).fillna(0)
+    return stats_df.drop(columns=['Giorni di Chiusura', 'Vinte con Durata'])
+
+
+# Funzione per calcolare il pivot con subtotali sulle dimensioni scelte a partire dal cubo
+def compute_pivot(cube: pd.DataFrame, dimensioni: tuple[str, ...], dettaglio: str | None = None) -> pd.DataFrame:
+    if dettaglio is not None:
+        cube = cube[cube[dimensioni[0]].astype(str) == dettaglio]
+
+    # Un livello di aggregazione per ogni prefisso delle dimensioni: il più profondo dà le righe
+    # di dettaglio, gli altri i subtotali; il totale generale chiude la tabella
+    livelli = []
+    for profondita in range(len(dimensioni), -1, -1):
+        if profondita:
+            livello = cube.groupby(list(dimensioni[:profondita]), as_index=False)[pivot_statistiche].sum()
+        else:
+            livello = cube[pivot_statistiche].sum().to_frame().T.astype(cube[pivot_statistiche].dtypes)
+        for nome in dimensioni[profondita:]:
+            livello[nome] = 'Totale'
+        livelli.append(livello)
+
+    pivot_df = pd.concat(livelli, ignore_index=True)
+    pivot_df = pivot_df.sort_values(list(dimensioni), key=lambda col: col.astype(str).where(col != 'Totale', '\uffff'), kind='stable')
+    return add_derived_metrics(pivot_df.set_index(list(dimensioni)))
+
+
+# API di interrogazione degli aggregati, esposta dalla dashboard al modello come strumenti
+# (function calling): il modello chiede solo i dati che gli servono.
+# Dimensioni e metriche ammesse e numero massimo di righe restituite.
+query_dimensioni = {**{nome: col for nome, col in pivot_dimensioni.items() if nome != 'Azienda'}, 'Stato': 'Stato', 'Mese': None}
+query_metriche = ['Opportunità Create', 'Opportunità Vinte', 'Opportunità Perse', 'Revenue Totale',
+                  'Valore Medio Contratto', 'Win Rate', 'Tempo Medio di Chiusura (giorni)', 'Pipeline Velocity']
+query_max_righe = 50
+
+
+# Funzione per costruire l'aggregato additivo interrogato dagli strumenti, con il mese di
+# creazione come dimensione temporale
+def build_query_cube(data_filtered: pd.DataFrame) -> pd.DataFrame:
+    mese = data_filtered['Opportunity_Created'].dt.to_period('M').astype(str).where(data_filtered['Opportunity_Created'].notna(), 'N/D')
+    chiavi = [data_filtered[col].fillna('N/D').astype(str).rename(nome) for nome, col in query_dimensioni.items() if col]
+    return data_filtered.groupby(chiavi + [mese.rename('Mese')]).agg(**{
+        'Opportunità Create': ('Opportunity_Created', 'count'),
+        'Opportunità Vinte': ('Closed_Won', 'count'),
+        'Opportunità Perse': ('Closed_Lost', 'count'),
+        'Revenue Totale': ('Valore Tot €', 'sum'),
+        'Giorni di Chiusura': ('Days_to_Close', 'sum'),
+        'Vinte con Durata': ('Days_to_Close', 'count'),
+    }).reset_index()
+
+
+# Funzione per validare i nomi richiesti dal modello
+def check_query_names(nomi: list, ammessi: list, tipo: str) -> None:
+    sconosciuti = [nome for nome in nomi if nome not in ammessi]
+    if sconosciuti:
+        raise ValueError(f"{tipo} non disponibili: {', '.join(map(str, sconosciuti))}. Valori ammessi: {', '.join(ammessi)}")
+
+
+# Funzione per filtrare l'aggregato: valori delle dimensioni (senza distinzione tra maiuscole e
+# minuscole) e intervallo di mesi 'AAAA-MM' estremi inclusi
+def filter_query_cube(cube: pd.DataFrame, filtri: dict | None = None, mese_da: str | None = None, mese_a: str | None = None) -> pd.DataFrame:
+    filtri = filtri or {}
+    check_query_names(list(filtri), list(query_dimensioni), "Dimensioni")
+    for nome, valori in filtri.items():
+        valori = valori if isinstance(valori, list) else [valori]
+        cube = cube[cube[nome].str.lower().isin({str(valore).lower() for valore in valori})]
+    if mese_da or mese_a:
+        cube = cube[cube['Mese'] != 'N/D']
+        if mese_da:
+            cube = cube[cube['Mese'] >= str(mese_da)[:7]]
+        if mese_a:
+            cube = cube[cube['Mese'] <= str(mese_a)[:7]]
+    return cube
+
+
+# Funzione per eseguire un'interrogazione dei KPI: filtro, raggruppamento e top-k per una metrica
+def run_kpi_query(cube: pd.DataFrame, raggruppa_per=(), metriche=(), filtri: dict | None = None, mese_da: str | None = None,
+                  mese_a: str | None = None, ordina_per: str | None = None, crescente: bool = False, limite: int = 20) -> tuple[pd.DataFrame, int]:
+    raggruppa_per, metriche = list(raggruppa_per), list(metriche) or query_metriche
+    check_query_names(raggruppa_per, list(query_dimensioni), "Dimensioni")
+    check_query_names(metriche + ([ordina_per] if ordina_per else []), query_metriche, "Metriche")
+
+    cube = filter_query_cube(cube, filtri, mese_da, mese_a)
+    if raggruppa_per:
+        stats = cube.groupby(raggruppa_per, as_index=False)[pivot_statistiche].sum()
+    else:
+        stats = cube[pivot_statistiche].sum().to_frame('Totale').T
+    stats = add_derived_metrics(stats.set_index(raggruppa_per) if raggruppa_per else stats)
+
+    ordina_per = ordina_per or ('Revenue Totale' if 'Revenue Totale' in metriche else metriche[0])
+    limite = min(max(int(limite), 1), query_max_righe)
+    risultato = select_top_k(stats, ordina_per, limite, ascending=crescente)
+    colonne = metriche + ([ordina_per] if ordina_per not in metriche else [])
+    return risultato[colonne], len(stats)
+
+
+# Funzione per elencare i valori di una dimensione, ordinati per numero di opportunità
+def list_dimension_values(cube: pd.DataFrame, dimensione: str, limite: int = query_max_righe) -> tuple[list, int]:
+    check_query_names([dimensione], list(query_dimensioni), "Dimensioni")
+    conteggi = cube.groupby(dimensione)['Opportunità Create'].sum().sort_values(ascending=False)
+    return list(conteggi.index[:min(max(int(limite), 1), query_max_righe)]), len(conteggi)
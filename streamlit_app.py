@@ -1,10 +1,26 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime
-import openai  # Importazione della libreria OpenAI
+import contextlib
+import difflib
+import functools
+import hashlib
+import importlib
+import json
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+
+# I moduli pesanti (pandas, numpy, openai, plotly, sklearn, pyarrow, openpyxl) non vengono importati qui:
+# la richiesta della chiave API deve apparire subito. Sono importati dove servono la prima volta e
+# precaricati in background dopo il primo rendering (vedi warm_up_imports)
 
 # Configurazione della pagina
 st.set_page_config(
@@ -18,213 +34,819 @@ st.set_page_config(
 with st.sidebar:
     openai_api_key = st.text_input("OpenAI API Key", key="chatbot_api_key", type="password")
 
+    # Qualsiasi servizio compatibile con le API OpenAI (es. il server stub locale llm_stub_server.py)
+    with st.expander("Impostazioni AI"):
+        llm_base_url = st.text_input("Base URL", value=os.environ.get("OPENAI_BASE_URL", ""), placeholder="https://api.openai.com/v1", key="llm_base_url")
+        llm_model = st.text_input("Modello", value=os.environ.get("OPENAI_MODEL", "gpt-4o-2024-08-06"), key="llm_model")
+        llm_budget_token = st.number_input("Budget token per i dati nel prompt", min_value=200, max_value=20000, value=1500, step=100, key="llm_budget_token")
+        llm_tpm_limite = st.number_input("Limite token al minuto", min_value=1000, max_value=10_000_000, value=int(os.environ.get("OPENAI_TPM_LIMIT", 30000)), step=1000, key="llm_tpm_limite")
+
+    # Profilazione facoltativa dei tempi (e della memoria) di ogni sezione a ogni rerun
+    with st.expander("Profilazione"):
+        st.checkbox("Misura i tempi delle sezioni", value=os.environ.get("DASHBOARD_PROFILING") == "1", key="profilazione_attiva")
+        st.checkbox("Misura anche la memoria (rallenta l'app)", key="profilazione_memoria")
+
+# Moduli pesanti da precaricare, nell'ordine in cui la dashboard li usa
+moduli_precaricati = (
+    'numpy', 'pandas', 'openai', 'sales_dashboard', 'plotly.express', 'plotly.graph_objects',
+    'sklearn.compose', 'sklearn.linear_model', 'sklearn.pipeline', 'sklearn.preprocessing',
+    'pyarrow.parquet', 'openpyxl',
+)
+
+
+# Funzione per importare i moduli pesanti in un thread in background, una sola volta per processo:
+# quando l'utente inserisce la chiave o apre una sezione, il costo dell'import è già stato pagato.
+# Gli import concorrenti dello stesso modulo sono serializzati dal lock di import di Python.
+@st.cache_resource(show_spinner=False)
+def warm_up_imports():
+    def importa_moduli():
+        for nome in moduli_precaricati:
+            try:
+                importlib.import_module(nome)
+            except ImportError:
+                pass
+
+    thread = threading.Thread(target=importa_moduli, name="precaricamento-import", daemon=True)
+    thread.start()
+    return thread
+
+
+# La barra laterale è già stata inviata al browser: il precaricamento parte dopo il primo rendering
+warm_up_imports()
+
 # Verifica che la chiave API sia stata inserita
 if not openai_api_key:
     st.warning("Inserisci la tua OpenAI API Key nella barra laterale per continuare.")
 else:
-    # Imposta la chiave API di OpenAI
-    openai.api_key = openai_api_key
+    import numpy as np
+    import pandas as pd
+    import openai  # Importazione della libreria OpenAI
+
+    # Calcoli della dashboard, indipendenti da Streamlit: qui vengono avvolti nelle cache dell'app
+    import sales_dashboard as sd
+    from sales_dashboard import (
+        filter_data,
+        formati_esportazione,
+        frequenze_periodo,
+        list_dimension_values,
+        metriche_disponibili,
+        pivot_altri,
+        pivot_dimensioni,
+        pivot_max_celle,
+        query_dimensioni,
+        query_max_righe,
+        query_metriche,
+        rolling_from_prefix_sums,
+        run_kpi_query,
+        select_top_k,
+        win_model_scarto_calibrazione,
+        xlsx_export_allowed,
+    )
+
+    # Numero di rerun conservati nello storico della profilazione e durata dopo cui una sessione
+    # inattiva (es. una scheda chiusa) non tiene più attiva la misura della memoria
+    profilo_storico_max = 200
+    profilo_memoria_scadenza_secondi = 1800
+
+    # Funzione per ottenere l'identificativo della sessione corrente
+    def session_id():
+        return st.session_state.setdefault('id_sessione', os.urandom(8).hex())
+
+    # Sessioni che misurano la memoria, condivise nel processo, con l'ultimo rerun di ciascuna
+    @st.cache_resource
+    def get_memory_tracing():
+        return {'sessioni': {}, 'lock': threading.Lock()}
+
+    # Funzione per registrare se la sessione corrente misura la memoria. tracemalloc vale per l'intero
+    # processo: si avvia con la prima sessione che lo richiede e si ferma solo quando nessuna lo usa più.
+    def update_memory_tracing(misura_memoria):
+        stato = get_memory_tracing()
+        sessione = session_id()
+        adesso = time.monotonic()
+        with stato['lock']:
+            sessioni = stato['sessioni']
+            if misura_memoria:
+                sessioni[sessione] = adesso
+            else:
+                sessioni.pop(sessione, None)
+            for altra, ultimo_rerun in list(sessioni.items()):
+                if adesso - ultimo_rerun > profilo_memoria_scadenza_secondi:
+                    del sessioni[altra]
+            if sessioni and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            elif not sessioni and tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    # Funzione per iniziare la profilazione di un rerun completo dello script
+    def start_profile_rerun():
+        st.session_state['profilo_rerun_corrente'] = None
+        update_memory_tracing(bool(st.session_state.get('profilazione_attiva') and st.session_state.get('profilazione_memoria')))
+        if st.session_state.get('profilazione_attiva'):
+            st.session_state['profilo_rerun_corrente'] = {'tipo': 'completo', 'inizio': time.perf_counter(), 'misure': [], 'profondita': 0}
+
+    # Funzione per chiudere il rerun in corso e aggiungerlo allo storico della sessione
+    def finish_profile_rerun():
+        rerun = st.session_state.get('profilo_rerun_corrente')
+        st.session_state['profilo_rerun_corrente'] = None
+        if rerun is None:
+            return
+        storico = st.session_state.setdefault('profilo_storico', [])
+        storico.append({'tipo': rerun['tipo'], 'totale_ms': (time.perf_counter() - rerun['inizio']) * 1000, 'misure': rerun['misure']})
+        del storico[:-profilo_storico_max]
+
+    # Funzione per misurare un blocco della dashboard: durata e, se richiesto, variazione della memoria
+    # allocata. Le misure annidate (es. un grafico dentro una sezione) ne riportano la profondità; una
+    # misura avviata fuori da un rerun completo appartiene a un fragment rieseguito da solo.
+    @contextlib.contextmanager
+    def profile_span(nome):
+        if not st.session_state.get('profilazione_attiva'):
+            yield
+            return
+
+        rerun = st.session_state.get('profilo_rerun_corrente')
+        solo_fragment = rerun is None
+        if solo_fragment:
+            rerun = {'tipo': 'fragment', 'inizio': time.perf_counter(), 'misure': [], 'profondita': 0}
+            st.session_state['profilo_rerun_corrente'] = rerun
+
+        misura = {'sezione': nome, 'profondita': rerun['profondita'], 'ms': None, 'memoria_kb': None}
+        rerun['misure'].append(misura)
+        rerun['profondita'] += 1
+        memoria_iniziale = tracemalloc.get_traced_memory()[0] if st.session_state.get('profilazione_memoria') and tracemalloc.is_tracing() else None
+        inizio = time.perf_counter()
+        try:
+            yield
+        finally:
+            misura['ms'] = (time.perf_counter() - inizio) * 1000
+            if memoria_iniziale is not None and tracemalloc.is_tracing():
+                misura['memoria_kb'] = (tracemalloc.get_traced_memory()[0] - memoria_iniziale) / 1024
+            rerun['profondita'] -= 1
+            if solo_fragment:
+                finish_profile_rerun()
+
+    # Decoratore per misurare un'intera sezione, anche quando il suo fragment si riesegue da solo
+    def profiled(nome):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with profile_span(nome):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Funzione per mostrare il pannello di profilazione nella barra laterale: il dettaglio dell'ultimo
+    # rerun e i percentili p50/p95 di ogni sezione sullo storico della sessione
+    def render_profiler_panel():
+        storico = st.session_state.get('profilo_storico', [])
+        with st.sidebar.expander("Prestazioni del rerun", expanded=True):
+            if not storico:
+                st.caption("Nessun rerun misurato.")
+                return
+
+            ultimo = next((rerun for rerun in reversed(storico) if rerun['tipo'] == 'completo'), storico[-1])
+            st.caption(f"Ultimo rerun completo: {format_number(ultimo['totale_ms'])} ms")
+            dettaglio = pd.DataFrame([{
+                'Sezione': "\u2003" * misura['profondita'] + misura['sezione'],
+                'ms': misura['ms'],
+                '% rerun': misura['ms'] / ultimo['totale_ms'] * 100 if ultimo['totale_ms'] else np.nan,
+                'Memoria (KB)': misura['memoria_kb'],
+            } for misura in ultimo['misure'] if misura['ms'] is not None])
+            if not dettaglio.empty:
+                st.dataframe(dettaglio.round(1), hide_index=True, use_container_width=True)
+
+            misure = pd.DataFrame([misura for rerun in storico for misura in rerun['misure'] if misura['ms'] is not None])
+            if not misure.empty:
+                st.caption(f"Storico: {len(storico)} rerun (compresi quelli dei soli fragment)")
+                percentili = misure.groupby('sezione', sort=False)['ms'].agg(
+                    campioni='count',
+                    p50=lambda ms: np.percentile(ms, 50),
+                    p95=lambda ms: np.percentile(ms, 95),
+                ).reset_index().rename(columns={'sezione': 'Sezione', 'p50': 'p50 (ms)', 'p95': 'p95 (ms)'})
+                st.dataframe(percentili.round(1), hide_index=True, use_container_width=True)
+
+            if st.button("Azzera storico", key='azzera_profilo'):
+                st.session_state['profilo_storico'] = []
+
+    start_profile_rerun()
+
+    # Parametri del client LLM: scadenza complessiva di ogni chiamata, tentativi e circuit breaker
+    llm_deadline_secondi = 60
+    llm_max_tentativi = 3
+    llm_backoff_base_secondi = 0.5
+    llm_breaker_soglia_errori = 5
+    llm_breaker_pausa_secondi = 30
+    llm_errori_ritentabili = (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError, openai.InternalServerError)
+
+    # Errore sollevato quando il circuit breaker esclude temporaneamente il servizio LLM
+    class LLMUnavailableError(Exception):
+        pass
+
+    # Client HTTP condiviso da tutte le sessioni: riutilizza le connessioni verso il servizio LLM
+    @st.cache_resource
+    def get_http_client():
+        # httpx è la libreria HTTP su cui si appoggia openai; alcune distribuzioni recenti di openai
+        # la includono come httpx2, con la stessa API
+        try:
+            import httpx
+        except ImportError:
+            import httpx2 as httpx
+
+        limiti = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        return openai.DefaultHttpxClient(limits=limiti, timeout=httpx.Timeout(llm_deadline_secondi, connect=5))
+
+    # Client OpenAI per chiave API e base URL, tutti appoggiati allo stesso pool di connessioni.
+    # I tentativi sono gestiti da llm_chat, quindi quelli interni della libreria sono disattivati.
+    @st.cache_resource(max_entries=64)
+    def get_llm_client(_api_key, api_key_hash, base_url):
+        return openai.OpenAI(api_key=_api_key, base_url=base_url or None, max_retries=0, http_client=get_http_client())
+
+    # Stato del circuit breaker per ciascun servizio LLM, condiviso tra le sessioni
+    @st.cache_resource
+    def get_circuit_breaker(base_url):
+        return {'errori_consecutivi': 0, 'aperto_dal': None, 'prova_in_corso': False, 'lock': threading.Lock()}
+
+    # Quota del limite di token al minuto riservata a ciascun tipo di richiesta: insight generale, commenti
+    # per segmento e domande dell'utente hanno ciascuno un secchio proprio, così un lotto di commenti
+    # per segmento non può ritardare l'insight generale né le risposte alle domande
+    llm_quote_tpm = {'insight': 0.25, 'segmenti': 0.5, 'domande': 0.25}
+
+    # Secchio di token per servizio LLM e pool, condiviso tra le sessioni: limita i token al minuto inviati
+    @st.cache_resource
+    def get_token_bucket(base_url, pool):
+        return {'disponibili': None, 'aggiornato': time.monotonic(), 'lock': threading.Lock()}
+
+    # Funzione per attendere che il secchio del pool contenga i token stimati per una richiesta; il
+    # secchio si riempie in modo continuo al ritmo della quota del pool e non la supera mai
+    def acquire_tokens(llm_session, pool, richiesti):
+        bucket = llm_session['secchi'][pool]
+        limite_minuto = llm_session['tpm'] * llm_quote_tpm[pool]
+        richiesti = min(richiesti, limite_minuto)
+        while True:
+            with bucket['lock']:
+                adesso = time.monotonic()
+                disponibili = limite_minuto if bucket['disponibili'] is None else min(
+                    limite_minuto, bucket['disponibili'] + (adesso - bucket['aggiornato']) * limite_minuto / 60)
+                bucket['aggiornato'] = adesso
+                if disponibili >= richiesti:
+                    bucket['disponibili'] = disponibili - richiesti
+                    return
+                bucket['disponibili'] = disponibili
+                attesa = (richiesti - disponibili) * 60 / limite_minuto
+            time.sleep(attesa)
+
+    # Funzione per leggere una risposta in streaming entro la scadenza della chiamata: la scadenza vale
+    # anche per il corpo della risposta, così un servizio che invia i token molto lentamente non la
+    # supera. Allo scadere lo stream viene chiuso e la lettura termina con un errore.
+    def stream_with_deadline(stream, scadenza, deadline_secondi):
+        try:
+            for chunk in stream:
+                yield chunk
+                if time.monotonic() > scadenza:
+                    raise TimeoutError(f"Risposta del servizio AI oltre la scadenza di {deadline_secondi} secondi")
+        finally:
+            stream.close()
+
+    # Funzione per chiamare il modello con scadenza complessiva, tentativi con backoff esponenziale
+    # e jitter sugli errori transitori e circuit breaker dopo troppi errori consecutivi. Trascorsa la
+    # pausa del breaker passa una sola chiamata di prova alla volta: le altre restano escluse finché
+    # la prova non riesce, mentre un suo errore riapre il breaker per un'altra pausa.
+    def llm_chat(llm, messages, stream=False, deadline_secondi=llm_deadline_secondi, **kwargs):
+        breaker = llm['breaker']
+        prova = False
+        with breaker['lock']:
+            if breaker['aperto_dal'] is not None:
+                if breaker['prova_in_corso'] or time.monotonic() - breaker['aperto_dal'] < llm_breaker_pausa_secondi:
+                    raise LLMUnavailableError("Servizio AI temporaneamente non disponibile dopo errori ripetuti, riprova tra poco.")
+                breaker['prova_in_corso'] = prova = True
+
+        try:
+            scadenza = time.monotonic() + deadline_secondi
+            for tentativo in range(llm_max_tentativi):
+                rimanente = max(scadenza - time.monotonic(), 1)
+                try:
+                    response = llm['client'].chat.completions.create(
+                        model=llm['model'], messages=messages, stream=stream, timeout=rimanente, **kwargs
+                    )
+                    with breaker['lock']:
+                        breaker['errori_consecutivi'] = 0
+                        breaker['aperto_dal'] = None
+                    return stream_with_deadline(response, scadenza, deadline_secondi) if stream else response
+
+                except llm_errori_ritentabili:
+                    with breaker['lock']:
+                        breaker['errori_consecutivi'] += 1
+                        if prova or breaker['errori_consecutivi'] >= llm_breaker_soglia_errori:
+                            breaker['aperto_dal'] = time.monotonic()
+                            raise
+                    rimanente = scadenza - time.monotonic()
+                    if tentativo == llm_max_tentativi - 1 or rimanente <= 0:
+                        raise
+                    # Backoff esponenziale con jitter completo, entro la scadenza della chiamata
+                    time.sleep(min(rimanente, random.uniform(0, llm_backoff_base_secondi * 2 ** tentativo)))
+        finally:
+            if prova:
+                with breaker['lock']:
+                    breaker['prova_in_corso'] = False
+
+    # Client e modello LLM della sessione corrente, con il circuit breaker e i secchi di token del servizio.
+    # Sono risolti qui, sul thread dello script: i thread in background che generano gli insight non
+    # hanno il contesto di Streamlit e non devono chiamare le funzioni in cache.
+    llm_client = get_llm_client(openai_api_key, hashlib.sha256(openai_api_key.encode()).hexdigest(), llm_base_url.strip())
+    llm = {
+        'client': llm_client,
+        'model': llm_model.strip() or "gpt-4o-2024-08-06",
+        'tpm': llm_tpm_limite,
+        'breaker': get_circuit_breaker(str(llm_client.base_url)),
+        'secchi': {pool: get_token_bucket(str(llm_client.base_url), pool) for pool in llm_quote_tpm},
+    }
     st.success("Chiave API di OpenAI configurata correttamente!")
 
     # Titolo dell'app
     st.title("📈 Dashboard Sales KPI + AI 🚀")
 
-    # Stile personalizzato
-    st.markdown("""
-        <style>
-        /* Font e colori */
-        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;600&display=swap');
-
-        html, body, [class*="css"]  {
-            font-family: 'Inter', sans-serif;
-        }
-
-        /* Stile delle metriche */
-        .kpi-card {
-            background-color: #ffffff;
-            border: 1px solid #e0e0e0;
-            border-radius: 10px;
-            padding: 20px;
-            margin-bottom: 20px;
-            text-align: center;
-            box-shadow: 2px 2px 5px rgba(0,0,0,0.1);
-        }
-        .kpi-title {
-            font-size: 18px;
-            color: #333333;
-            margin-bottom: 10px;
-            font-weight: bold;
-        }
-        .kpi-value {
-            font-size: 32px;
-            color: #007bff;
-            font-weight: bold;
-        }
-
-        /* Pulsanti e interattività */
-        .stButton>button {
-            color: #ffffff;
-            background-color: #007bff;
-            border-radius: 8px;
-            height: 3em;
-            font-size: 16px;
-        }
+    # Stile personalizzato: il foglio di stile è servito come file statico, quindi il browser lo
+    # scarica una sola volta per sessione e a ogni rerun viene inviato solo il riferimento
+    st.markdown('<link rel="stylesheet" href="app/static/dashboard.css">', unsafe_allow_html=True)
 
-        /* Tabelle */
-        .dataframe {
-            border: none;
-        }
-        .dataframe th {
-            background-color: #007bff;
-            color: white;
-            text-align: center;
-        }
-        .dataframe td {
-            text-align: center;
-        }
-
-        /* Grafici */
-        .plotly-graph-div .legend .traces .legendtoggle {
-            cursor: pointer;
-        }
-
-        </style>
-        """, unsafe_allow_html=True)
+    # Tabella di traduzione dei separatori dalla convenzione inglese a quella italiana,
+    # applicata con un solo passaggio invece di tre replace concatenati
+    separatori_italiani = str.maketrans({',': '.', '.': ','})
 
     # Funzione per formattare i numeri secondo le convenzioni italiane
     def format_number(value):
-        s = "{:,.2f}".format(value)
-        s = s.replace(',', 'X').replace('.', ',').replace('X', '.')
-        return s
-
-    # Funzione per processare il campo 'Canale'
-    def process_canale(canale):
-        canale = str(canale).strip().lower()
-        main_channel = canale.title()  # Valore predefinito
-
-        # Gestione dei canali
-        if 'linkedin' in canale:
-            if 'in' in canale:
-                main_channel = 'LinkedIn Inbound'
-            elif 'out' in canale:
-                main_channel = 'LinkedIn Outbound'
-            else:
-                main_channel = 'LinkedIn'
-        elif 'advertising' in canale:
-            main_channel = 'Advertising'
-        elif 'eventi' in canale:
-            main_channel = 'Eventi'
-        elif 'referral' in canale:
-            main_channel = 'Referral'
-        elif 'rinnovi' in canale or 'upselling' in canale:
-            main_channel = 'Rinnovi-Upselling'
-        elif 'cold calling' in canale:
-            main_channel = 'Cold Calling'
-        elif 'sito' in canale:
-            main_channel = 'Sito'
+        return "{:,.2f}".format(value).translate(separatori_italiani)
+
+    # Funzione per formattare un'intera colonna numerica secondo le convenzioni italiane, con le
+    # funzioni vettoriali di np.strings: la parte intera, allineata a destra su gruppi di tre cifre, è
+    # tagliata per gruppi e unita con '.', i centesimi seguono la ','. Il risultato è costruito come
+    # object a partire da na_rep, così anche colonne vuote, tutte NaN o con infiniti restano valide.
+    def format_number_column(values, prefix='', suffix='', na_rep='-'):
+        values = pd.Series(values, dtype=float)
+        formatted = pd.Series(na_rep, index=values.index, dtype=object)
+        finiti = np.isfinite(values.to_numpy())
+        if finiti.any():
+            numeri = values.to_numpy()[finiti]
+            centesimi = np.round(np.abs(numeri) * 100).astype(np.int64)
+            interi = (centesimi // 100).astype(str)
+            larghezza = -(-int(np.strings.str_len(interi).max()) // 3) * 3
+            allineati = np.strings.rjust(interi, larghezza)
+            gruppi = np.strings.slice(allineati, 0, 3)
+            for inizio in range(3, larghezza, 3):
+                gruppi = np.strings.add(np.strings.add(gruppi, '.'), np.strings.slice(allineati, inizio, inizio + 3))
+            decimali = np.strings.zfill((centesimi % 100).astype(str), 2)
+            testo = np.strings.add(np.where(numeri < 0, prefix + '-', prefix), np.strings.lstrip(gruppi, ' .'))
+            formatted[finiti] = np.strings.add(np.strings.add(testo, ','), np.strings.add(decimali, suffix))
+        return formatted
+
+    # Prefissi e suffissi dei formati di colonna usati nelle tabelle
+    formati_colonne = {'euro': ('€', ''), 'percentuale': ('', '%'), 'numero': ('', '')}
+
+    # Funzione per preparare il contenuto di una tabella: colonne formattate per intero e stili di
+    # evidenziazione calcolati in modo vettoriale (in cache per versione dell'aggregato e formato)
+    @st.cache_data(show_spinner=False, max_entries=128)
+    def build_table_payload(_df, table_key, format_spec, highlight_spec=()):
+        display_df = _df.copy()
+        for colonna, formato in format_spec:
+            prefix, suffix = formati_colonne[formato]
+            display_df[colonna] = format_number_column(_df[colonna], prefix, suffix)
+
+        css_df = pd.DataFrame('', index=_df.index, columns=_df.columns)
+        for colonna, criterio, colore in highlight_spec:
+            valori = _df[colonna]
+            target = valori.max() if criterio == 'max' else valori.min()
+            css_df.loc[(valori == target).to_numpy(), colonna] = f'background-color: {colore}'
+        return display_df, css_df
+
+    # Funzione per visualizzare una tabella formattata
+    def render_table(df, table_key, format_spec, highlight_spec=(), **kwargs):
+        display_df, css_df = build_table_payload(df, table_key, format_spec, highlight_spec)
+        if highlight_spec:
+            st.dataframe(display_df.style.apply(lambda _: css_df, axis=None), use_container_width=True, **kwargs)
         else:
-            main_channel = canale.title()
-
-        return main_channel
-
-    # Funzione per calcolare le metriche
-    def calculate_metrics(data):
-        totale_opportunita = data['Opportunity_Created'].notnull().sum()
-        totale_vinti = data['Closed_Won'].notnull().sum()
-        totale_persi = data['Closed_Lost'].notnull().sum()
-        totale_revenue = data.loc[data['Closed_Won'].notnull(), 'Valore Tot €'].sum()
-        win_rate = (totale_vinti / (totale_vinti + totale_persi)) * 100 if (totale_vinti + totale_persi) > 0 else 0
-        lost_rate = (totale_persi / (totale_vinti + totale_persi)) * 100 if (totale_vinti + totale_persi) > 0 else 0
-
-        # Tempo medio di chiusura per le opportunità vinte
-        data['Days_to_Close'] = (data['Closed_Won'] - data['Opportunity_Created']).dt.days
-        tempo_medio_chiusura = data.loc[data['Closed_Won'].notnull(), 'Days_to_Close'].mean()
-
-        # ACV
-        acv = data.loc[data['Closed_Won'].notnull(), 'Valore Tot €'].mean()
-
-        # Pipeline Velocity
-        pipeline_velocity = (totale_opportunita * (win_rate/100) * acv) / tempo_medio_chiusura if tempo_medio_chiusura and tempo_medio_chiusura > 0 else 0
-
+            st.dataframe(display_df, use_container_width=True, **kwargs)
+
+    # Funzione per calcolare le metriche (in cache per dataset e stato dei filtri)
+    @st.cache_data(show_spinner=False, max_entries=64)
+    def calculate_metrics(_data, filter_key):
+        return sd.calculate_metrics(_data)
+
+    # Funzione per creare la tabella riepilogativa per canale (in cache per dataset e stato dei filtri)
+    @st.cache_data(show_spinner=False, max_entries=64)
+    def compute_summary(_data_filtered, filter_key, grouping_column='MainChannel'):
+        return sd.compute_summary(_data_filtered, grouping_column)
+
+    # Funzione per aggregare le metriche per periodo (in cache per dataset, stato dei filtri e periodo)
+    @st.cache_data(show_spinner=False, max_entries=64)
+    def aggregate_by_period(_data_filtered, filter_key, freq):
+        return sd.aggregate_by_period(_data_filtered, freq)
+
+    # Funzione per aggregare le metriche per canale (in cache per dataset e stato dei filtri)
+    @st.cache_data(show_spinner=False, max_entries=64)
+    def aggregate_by_channel(_data_filtered, filter_key):
+        return sd.aggregate_by_channel(_data_filtered)
+
+    # Durata e dimensione massima della cache degli insight AI
+    insight_cache_ttl_secondi = 3600
+    insight_cache_max_entries = 512
+
+    # Commenti per segmento: richieste contemporanee e numero massimo di segmenti per dimensione
+    insight_segmenti_concorrenza = 4
+    insight_segmenti_max = 50
+    # Dimensioni dei segmenti: colonna del segmento e colonna per cui è riepilogato ciascun segmento
+    insight_segmenti = {'Canale': ('MainChannel', 'TeamMember'), 'Sales Rep': ('TeamMember', 'MainChannel')}
+
+    # Cache degli insight condivisa tra le sessioni, con il pool di thread che li genera in background
+    @st.cache_resource
+    def get_insight_cache():
         return {
-            'totale_opportunita': totale_opportunita,
-            'totale_vinti': totale_vinti,
-            'totale_persi': totale_persi,
-            'totale_revenue': totale_revenue,
-            'win_rate': win_rate,
-            'lost_rate': lost_rate,
-            'tempo_medio_chiusura': tempo_medio_chiusura,
-            'acv': acv,
-            'pipeline_velocity': pipeline_velocity
+            'voci': OrderedDict(),
+            'lock': threading.Lock(),
+            'executor': ThreadPoolExecutor(max_workers=4, thread_name_prefix='insight-ai'),
+            # Pool separato per i commenti per segmento, così un lotto non ritarda l'insight generale
+            'executor_segmenti': ThreadPoolExecutor(max_workers=insight_segmenti_concorrenza, thread_name_prefix='insight-segmenti'),
         }
 
-    # Funzione per generare gli insight utilizzando GPT-4o
-    def generate_ai_insights(metrics, summary_df):
-        # Preparazione del prompt per GPT-4o
+    # Funzione per calcolare l'impronta delle metriche e della tabella riepilogativa
+    def insight_fingerprint(metrics, summary_df):
+        metriche = repr(sorted((chiave, round(float(valore), 4)) for chiave, valore in metrics.items()))
+        servizio = f"{llm['client'].base_url}|{llm['model']}|{llm_budget_token}"
+        return hashlib.sha1((servizio + metriche + fingerprint_df(summary_df)).encode()).hexdigest()
+
+    # Etichette e unità delle metriche generali riportate nei prompt
+    metriche_prompt = [
+        ('totale_opportunita', 'Totale Opportunità Create', ''),
+        ('totale_vinti', 'Totale Opportunità Vinte', ''),
+        ('totale_persi', 'Totale Opportunità Perse', ''),
+        ('win_rate', 'Win Rate', '%'),
+        ('lost_rate', 'Lost Rate', '%'),
+        ('totale_revenue', 'Revenue Totale', ' €'),
+        ('acv', 'Valore Medio Contratto', ' €'),
+        ('tempo_medio_chiusura', 'Tempo Medio di Chiusura', ' giorni'),
+        ('pipeline_velocity', 'Pipeline Velocity', ' €'),
+    ]
+
+    # Funzione per stimare localmente i token di un testo, senza chiamare l'API: le parole
+    # contano circa un token ogni 4 lettere, i numeri un token ogni 3 cifre, la punteggiatura uno a testa
+    def estimate_tokens(testo):
+        return sum(math.ceil(len(pezzo) / 4) if pezzo[0].isalpha() else 1
+                   for pezzo in re.findall(r"\d{1,3}|[^\W\d_]+|\S", testo))
+
+    # Funzione per arrotondare un valore in forma compatta: interi per valori grandi, un decimale altrimenti
+    def compact_number(value):
+        # Valori mancanti e infiniti (es. valore medio con revenue ma nessuna vinta) restano vuoti
+        if pd.isna(value) or not np.isfinite(value):
+            return ''
+        if abs(value) >= 100 or float(value).is_integer():
+            return str(int(round(value)))
+        return f"{value:.1f}"
+
+    # Funzione per serializzare le metriche generali, una per riga
+    def serialize_metrics(metrics):
+        return "\n".join(f"- {etichetta}: {compact_number(metrics[chiave])}{unita}" for chiave, etichetta, unita in metriche_prompt)
+
+    # Funzione per serializzare la tabella per canale in CSV con numeri arrotondati
+    def serialize_table(summary_df):
+        return summary_df.apply(lambda colonna: colonna.map(compact_number)).to_csv(lineterminator="\n").strip()
+
+    # Funzione per raggruppare i canali oltre i primi n (per opportunità create) in un'unica riga
+    # 'Altri', ricalcolando le metriche derivate con le stesse formule di compute_summary
+    def summarize_channel_rows(summary_df, n):
+        ordinato = summary_df.sort_values('Opportunità Create', ascending=False)
+        principali, altri = ordinato.iloc[:n], ordinato.iloc[n:]
+        if altri.empty:
+            return principali
+
+        riga = altri[['Opportunità Create', 'Opportunità Perse', 'Opportunità Vinte', 'Revenue Totale']].sum()
+        pesi = altri['Opportunità Vinte'].where(altri['Tempo Medio di Chiusura (giorni)'].notna(), 0)
+        riga['Tempo Medio di Chiusura (giorni)'] = (altri['Tempo Medio di Chiusura (giorni)'].fillna(0) * pesi).sum() / pesi.sum() if pesi.sum() else np.nan
+        riga['Valore Medio Contratto'] = riga['Revenue Totale'] / riga['Opportunità Vinte'] if riga['Opportunità Vinte'] else np.nan
+        chiusi = riga['Opportunità Vinte'] + riga['Opportunità Perse']
+        riga['Win Rate'] = riga['Opportunità Vinte'] / chiusi * 100 if chiusi else np.nan
+        riga['Pipeline Velocity'] = np.nan_to_num(riga['Opportunità Create'] * (riga['Win Rate'] / 100) * riga['Valore Medio Contratto'] / riga['Tempo Medio di Chiusura (giorni)'])
+
+        riga_altri = pd.DataFrame([riga[summary_df.columns]], index=pd.Index([f"Altri ({len(altri)})"], name=summary_df.index.name))
+        return pd.concat([principali, riga_altri])
+
+    # Funzione per preparare metriche e tabella per canale entro il budget di token: se la tabella
+    # completa non ci sta, vengono mantenuti i canali principali e il resto è riassunto in 'Altri'.
+    # Restituisce il testo e le informazioni sulla dimensione prodotta.
+    def build_data_context(metrics, summary_df, budget_token, dimensione='canale'):
+        metriche_testo = serialize_metrics(metrics)
+        righe_totali = len(summary_df)
+        righe = righe_totali
+        tabella = serialize_table(summary_df)
+        disponibili = budget_token - estimate_tokens(metriche_testo)
+
+        if estimate_tokens(tabella) > disponibili and righe_totali > 1:
+            # Prima stima dal costo medio per riga, poi si scende finché il testo non rientra nel budget
+            intestazione = estimate_tokens(tabella.split("\n", 1)[0])
+            per_riga = max(1, (estimate_tokens(tabella) - intestazione) / righe_totali)
+            righe = int(max(1, min(righe_totali - 1, (disponibili - intestazione) // per_riga - 1)))
+            while True:
+                tabella = serialize_table(summarize_channel_rows(summary_df, righe))
+                if righe == 1 or estimate_tokens(tabella) <= disponibili:
+                    break
+                righe = max(1, righe // 2 if estimate_tokens(tabella) > 2 * disponibili else righe - 1)
+
+        testo = f"Metriche generali:\n{metriche_testo}\n\nPerformance per {dimensione} (CSV):\n{tabella}"
+        if righe < righe_totali:
+            testo += f"\n(le {righe_totali - righe} righe minori sono riassunte nella riga 'Altri')"
+        return testo, {'token_stimati': estimate_tokens(testo), 'budget': budget_token, 'righe_incluse': righe, 'righe_totali': righe_totali}
+
+    # Funzione per descrivere la dimensione del prompt prodotto
+    def prompt_size_caption(info):
+        testo = f"Prompt: ~{info['token_stimati']:,} token stimati (budget dati {info['budget']:,})".replace(",", ".")
+        if info['righe_incluse'] < info['righe_totali']:
+            testo += f" · {info['righe_incluse']} righe su {info['righe_totali']}, le altre riassunte"
+        if info.get('strumenti'):
+            testo += f" · {info['strumenti']} interrogazioni dei dati"
+        return testo
+
+    # Funzione per preparare il prompt degli insight per GPT-4o
+    def build_insights_prompt(metrics, summary_df):
+        dati, info = build_data_context(metrics, summary_df, llm_budget_token)
         prompt = f"""
 Sei un assistente virtuale che analizza le performance di vendita di un'azienda. Fornisci un'interpretazione delle metriche e degli obiettivi per l'acquisizione e la conversione, seguendo questo schema:
 
  **Obiettivi e Analisi delle Metriche**
    - Fornisci un'analisi dettagliata delle performance, identificando punti di forza, aree di miglioramento e possibili azioni da intraprendere. Usa un linguaggio professionale e specifico.
 
-Ecco le metriche:
+Analizza le metriche generali e le performance per canale:
 
-- Totale Opportunità Create: {metrics['totale_opportunita']}
-- Totale Opportunità Vinte: {metrics['totale_vinti']}
-- Totale Opportunità Perse: {metrics['totale_persi']}
-- Win Rate: {format_number(metrics['win_rate'])}%
-- Lost Rate: {format_number(metrics['lost_rate'])}%
-- Revenue Totale: €{format_number(metrics['totale_revenue'])}
-- Valore Medio Contratto: €{format_number(metrics['acv'])}
-- Tempo Medio di Chiusura: {format_number(metrics['tempo_medio_chiusura'])} giorni
-- Pipeline Velocity: €{format_number(metrics['pipeline_velocity'])}
+{dati}
 
-Analizza anche le performance per canale:
+Fornisci l'interpretazione come descritto sopra.
+"""
+        info['token_stimati'] = estimate_tokens(prompt)
+        return prompt, info
 
-{summary_df.to_string()}
+    # Funzione per preparare il prompt del commento su un singolo segmento (un canale o un sales rep)
+    def build_segment_prompt(dimensione, valore, dimensione_dettaglio, metrics, summary_df):
+        dati, info = build_data_context(metrics, summary_df, llm_budget_token, dimensione_dettaglio.lower())
+        prompt = f"""
+Sei un assistente virtuale che analizza le performance di vendita di un'azienda. Commenta in modo sintetico
+(al massimo 5 punti) le performance del segmento {dimensione} = "{valore}": punti di forza, criticità e una
+o due azioni concrete. Usa un linguaggio professionale e specifico.
 
-Fornisci l'interpretazione come descritto sopra.
+{dati}
 """
+        info['token_stimati'] = estimate_tokens(prompt)
+        return prompt, info
 
-        # Chiamata all'API di OpenAI
+    # Funzione eseguita in background: riceve la risposta in streaming e aggiorna la voce di cache
+    # token per token, così la pagina può mostrare il testo man mano che arriva. La cache degli insight
+    # e la sessione LLM arrivano già risolte dal thread dello script.
+    def stream_insight(cache, voce, prompt, llm_session, pool='insight', max_tokens=1000):
         try:
-            response = openai.chat.completions.create(
-                model="gpt-4o-2024-08-06",
+            # Stima dei token della richiesta (prompt più risposta massima) entro la quota del pool
+            acquire_tokens(llm_session, pool, estimate_tokens(prompt) + max_tokens)
+            stream = llm_chat(
+                llm_session,
                 messages=[
                     {"role": "system", "content": "Sei un esperto analista di vendite."},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=1000,
+                max_tokens=max_tokens,
                 temperature=0.7,
+                stream=True,
             )
-
-            # Estrazione del testo dalla risposta
-            insights = response.choices[0].message.content
-            return insights
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    voce['testo'] += chunk.choices[0].delta.content
+            voce['stato'] = 'completato'
 
         except Exception as e:
-            st.error(f"Errore durante la generazione degli insight: {e}")
-            return None
+            # Gli errori non restano in cache: il prossimo rerun riproverà la generazione
+            voce['errore'] = str(e)
+            voce['stato'] = 'errore'
+            with cache['lock']:
+                if cache['voci'].get(voce['chiave']) is voce:
+                    del cache['voci'][voce['chiave']]
+
+    # Funzione per ottenere una voce dalla cache degli insight o avviarne la generazione in background
+    # sul pool di thread e con la quota di token indicati. Stati di filtro identici non chiamano mai
+    # l'API due volte, nemmeno durante la generazione; il prompt viene preparato solo se la voce manca.
+    def get_or_submit_insight(chiave, build_prompt, args, executor='executor', pool='insight', max_tokens=1000):
+        cache = get_insight_cache()
+        adesso = time.time()
+
+        with cache['lock']:
+            voci = cache['voci']
+            scadute = [k for k, v in voci.items() if v['stato'] != 'in corso' and adesso - v['creato'] > insight_cache_ttl_secondi]
+            for k in scadute:
+                del voci[k]
+
+            voce = voci.get(chiave)
+            if voce is not None:
+                voci.move_to_end(chiave)
+                return voce
+
+            prompt, info = build_prompt(*args)
+            voce = {'chiave': chiave, 'testo': '', 'stato': 'in corso', 'errore': None, 'creato': adesso, 'prompt_info': info}
+            voci[chiave] = voce
+            # Eviction LRU delle voci completate oltre la dimensione massima
+            for k in [k for k, v in voci.items() if v['stato'] != 'in corso'][:max(0, len(voci) - insight_cache_max_entries)]:
+                del voci[k]
+
+        cache[executor].submit(stream_insight, cache, voce, prompt, llm, pool, max_tokens)
+        return voce
+
+    # Funzione per ottenere gli insight generali dalla cache o avviarne la generazione
+    def generate_ai_insights(metrics, summary_df):
+        return get_or_submit_insight(insight_fingerprint(metrics, summary_df), build_insights_prompt, (metrics, summary_df))
+
+    # Funzione per avviare in parallelo i commenti per ogni canale e sales rep (i più grandi per numero
+    # di opportunità), sul pool dedicato e nel rispetto della sua quota di token al minuto. Le voci finiscono
+    # nella cache degli insight: i segmenti già commentati sugli stessi dati sono disponibili subito.
+    def generate_segment_insights(data_filtered, filter_key):
+        voci = {}
+        for dimensione, (colonna, colonna_dettaglio) in insight_segmenti.items():
+            principali = data_filtered[colonna].value_counts().index[:insight_segmenti_max]
+            for valore, segmento in data_filtered[data_filtered[colonna].isin(principali)].groupby(colonna):
+                segment_key = (filter_key, colonna, valore)
+                metrics = calculate_metrics(segmento, segment_key)
+                summary_df = compute_summary(segmento, segment_key, colonna_dettaglio)
+                chiave = hashlib.sha1(f"{insight_fingerprint(metrics, summary_df)}|{colonna}={valore}".encode()).hexdigest()
+                dettaglio = next(nome for nome, col in pivot_dimensioni.items() if col == colonna_dettaglio)
+                voci[(dimensione, valore)] = get_or_submit_insight(
+                    chiave, build_segment_prompt, (dimensione, valore, dettaglio, metrics, summary_df),
+                    executor='executor_segmenti', pool='segmenti', max_tokens=400,
+                )
+        return voci
+
+    # Funzione per mostrare i commenti per segmento: il fragment si aggiorna ogni secondo finché
+    # il lotto non è completato
+    def render_segment_insights(voci):
+        in_corso = sum(voce['stato'] == 'in corso' for voce in voci.values())
+
+        @st.fragment(run_every=1 if in_corso else None)
+        def segment_fragment():
+            completate = sum(voce['stato'] != 'in corso' for voce in voci.values())
+            if completate < len(voci):
+                st.progress(completate / len(voci), text=f"Commenti generati: {completate} su {len(voci)}")
+
+            for dimensione, tab in zip(insight_segmenti, st.tabs([f"Per {dimensione}" for dimensione in insight_segmenti])):
+                with tab:
+                    for (dimensione_voce, valore), voce in voci.items():
+                        if dimensione_voce != dimensione:
+                            continue
+                        with st.expander(f"{valore}" + (" ⏳" if voce['stato'] == 'in corso' else "")):
+                            if voce['stato'] == 'errore':
+                                st.error(f"Errore durante la generazione del commento: {voce['errore']}")
+                            elif voce['testo']:
+                                st.markdown(voce['testo'] + (" ▌" if voce['stato'] == 'in corso' else ""))
+                            else:
+                                st.info("In attesa di generazione...")
+
+            # A lotto concluso un rerun completo ferma l'aggiornamento periodico
+            tutte_concluse = completate == len(voci)
+            if tutte_concluse and st.session_state.get('segmenti_in_attesa'):
+                st.session_state['segmenti_in_attesa'] = False
+                st.rerun()
+            if not tutte_concluse:
+                st.session_state['segmenti_in_attesa'] = True
+
+        segment_fragment()
+
+    # Funzione per mostrare gli insight: finché la generazione è in corso il fragment si aggiorna
+    # ogni secondo mostrando il testo ricevuto fino a quel momento
+    def render_insight(voce):
+        @st.fragment(run_every=1 if voce['stato'] == 'in corso' else None)
+        def insight_fragment():
+            st.subheader("Interpretazione delle Metriche")
+            st.caption(prompt_size_caption(voce['prompt_info']))
+            if voce['stato'] == 'errore':
+                st.error(f"Errore durante la generazione degli insight: {voce['errore']}")
+            elif voce['testo']:
+                st.markdown(voce['testo'] + (" ▌" if voce['stato'] == 'in corso' else ""))
+            else:
+                st.info("Generazione degli insight in corso...")
+
+            # A generazione conclusa un rerun completo ferma l'aggiornamento periodico
+            if voce['stato'] != 'in corso' and st.session_state.get('insight_in_attesa') == voce['chiave']:
+                st.session_state['insight_in_attesa'] = None
+                st.rerun()
+            if voce['stato'] == 'in corso':
+                st.session_state['insight_in_attesa'] = voce['chiave']
+
+        insight_fragment()
+
+    # Cache delle risposte alle domande: dimensione massima, soglia di somiglianza tra domande e file
+    # su disco che la conserva tra un riavvio e l'altro
+    qa_cache_max_entries = 512
+    qa_cache_soglia_similarita = 0.85
+    qa_cache_soglia_parola = 0.8
+    qa_parole_vuote = frozenset(
+        "il lo la i gli le l un uno una di a da in con su per tra fra del dello della dei degli delle "
+        "al allo alla ai agli alle dal dalla dai nel nella nei nelle sul sulla e ed o che mi ci ti si".split()
+    )
+    qa_cache_path = os.environ.get("QA_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "qa_cache.json"))
+
+    # Cache delle risposte condivisa tra le sessioni, caricata dal disco al primo utilizzo
+    @st.cache_resource
+    def get_qa_cache():
+        voci = OrderedDict()
+        try:
+            with open(qa_cache_path, encoding="utf-8") as f:
+                for voce in json.load(f):
+                    voci[(voce['impronta'], voce['domanda_normalizzata'])] = voce
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return {'voci': voci, 'lock': threading.Lock()}
+
+    # Funzione per salvare la cache su disco (in ordine LRU); la scrittura passa da un file
+    # temporaneo così un'interruzione non lascia mai il file a metà
+    def save_qa_cache(cache):
+        try:
+            os.makedirs(os.path.dirname(qa_cache_path), exist_ok=True)
+            temporaneo = f"{qa_cache_path}.{os.getpid()}.tmp"
+            with open(temporaneo, "w", encoding="utf-8") as f:
+                json.dump(list(cache['voci'].values()), f, ensure_ascii=False)
+            os.replace(temporaneo, qa_cache_path)
+        except OSError:
+            # La persistenza è facoltativa: senza disco scrivibile la cache resta solo in memoria
+            pass
+
+    # Funzione per normalizzare una domanda: minuscole, senza accenti, punteggiatura e spazi superflui
+    def normalize_question(question):
+        testo = unicodedata.normalize("NFKD", question.lower())
+        testo = "".join(c for c in testo if not unicodedata.combining(c))
+        return " ".join(re.sub(r"[^\w\s]", " ", testo).split())
+
+    # Funzione per confrontare due domande normalizzate parola per parola, ignorando le parole vuote:
+    # ogni termine deve avere un corrispondente nell'altra domanda (numeri identici, parole che
+    # differiscono al più per un refuso), così "meglio"/"peggio" o "2023"/"2024" non coincidono mai.
+    # Restituisce la somiglianza complessiva, oppure 0 se i termini non corrispondono.
+    def question_similarity(domanda_a, domanda_b):
+        termini_a = [t for t in domanda_a.split() if t not in qa_parole_vuote]
+        termini_b = [t for t in domanda_b.split() if t not in qa_parole_vuote]
+
+        def corrisponde(termine, altri):
+            if termine.isdigit():
+                return termine in altri
+            return any(termine == altro or (not altro.isdigit() and difflib.SequenceMatcher(None, termine, altro).ratio() >= qa_cache_soglia_parola)
+                       for altro in altri)
+
+        if not termini_a or not all(corrisponde(t, termini_b) for t in termini_a) or not all(corrisponde(t, termini_a) for t in termini_b):
+            return 0.0
+        return difflib.SequenceMatcher(None, " ".join(termini_a), " ".join(termini_b)).ratio()
+
+    # Funzione per cercare una risposta in cache per gli stessi dati: prima la domanda identica,
+    # poi la domanda più simile sopra la soglia
+    def lookup_cached_answer(impronta, domanda_normalizzata):
+        cache = get_qa_cache()
+        with cache['lock']:
+            voci = cache['voci']
+            voce = voci.get((impronta, domanda_normalizzata))
+            esito = 'identica'
+            if voce is None:
+                esito = 'simile'
+                migliore = qa_cache_soglia_similarita
+                for (impronta_voce, domanda_voce), candidata in voci.items():
+                    if impronta_voce != impronta:
+                        continue
+                    somiglianza = question_similarity(domanda_normalizzata, domanda_voce)
+                    if somiglianza >= migliore:
+                        migliore, voce = somiglianza, candidata
+            if voce is None:
+                return None, None
+            voci.move_to_end((voce['impronta'], voce['domanda_normalizzata']))
+            return voce, esito
+
+    # Funzione per salvare una nuova risposta in cache, con eviction LRU oltre la dimensione massima
+    def store_cached_answer(impronta, domanda_normalizzata, question, answer):
+        cache = get_qa_cache()
+        with cache['lock']:
+            voci = cache['voci']
+            voci[(impronta, domanda_normalizzata)] = {
+                'impronta': impronta,
+                'domanda_normalizzata': domanda_normalizzata,
+                'domanda': question,
+                'risposta': answer,
+                'creato': time.time(),
+            }
+            while len(voci) > qa_cache_max_entries:
+                voci.popitem(last=False)
+            save_qa_cache(cache)
 
     # Funzione per gestire le domande dell'utente
-    def answer_user_question(question, metrics, summary_df):
-        # Preparazione del prompt
+    def answer_user_question(question, metrics, summary_df, query_cube):
+        # Le domande già poste (o quasi identiche) sugli stessi dati non richiamano l'API
+        impronta = hashlib.sha1((insight_fingerprint(metrics, summary_df) + fingerprint_df(query_cube)).encode()).hexdigest()
+        domanda_normalizzata = normalize_question(question)
+        voce, esito = lookup_cached_answer(impronta, domanda_normalizzata)
+        if voce is not None:
+            return voce['risposta'], {'cache': esito, 'domanda': voce['domanda']}
+
+        # Preparazione del prompt: solo il riepilogo, il dettaglio si ottiene con gli strumenti
+        dati, info = build_data_context(metrics, summary_df, llm_budget_token)
         prompt = f"""
 Sei un esperto analista di vendite che risponde a domande sulla base delle seguenti metriche e dati:
 
-Metriche generali:
-- Totale Opportunità Create: {metrics['totale_opportunita']}
-- Totale Opportunità Vinte: {metrics['totale_vinti']}
-- Totale Opportunità Perse: {metrics['totale_persi']}
-- Win Rate: {format_number(metrics['win_rate'])}%
-- Lost Rate: {format_number(metrics['lost_rate'])}%
-- Revenue Totale: €{format_number(metrics['totale_revenue'])}
-- Valore Medio Contratto: €{format_number(metrics['acv'])}
-- Tempo Medio di Chiusura: {format_number(metrics['tempo_medio_chiusura'])} giorni
-- Pipeline Velocity: €{format_number(metrics['pipeline_velocity'])}
+{dati}
 
-Performance per canale:
-{summary_df.to_string()}
+Per dettagli per sales rep, servizio, settore, stato o mese usa gli strumenti query_kpi e list_dimension_values
+invece di fare supposizioni: restituiscono i KPI calcolati sugli stessi dati filtrati.
 
 Domanda dell'utente:
 \"\"\"
@@ -233,278 +855,607 @@ Domanda dell'utente:
 
 Rispondi in modo dettagliato e professionale, fornendo analisi e suggerimenti pertinenti.
 """
+        info['token_stimati'] = estimate_tokens(prompt)
+        info['strumenti'] = 0
+        messages = [
+            {"role": "system", "content": "Sei un esperto analista di vendite."},
+            {"role": "user", "content": prompt}
+        ]
 
-        # Chiamata all'API di OpenAI
+        # Chiamata all'API di OpenAI: il modello può chiedere aggregati con gli strumenti per al più
+        # query_max_giri volte, dopodiché deve rispondere con i dati ottenuti
         try:
-            response = openai.chat.completions.create(
-                model="gpt-4o-2024-08-06",
-                messages=[
-                    {"role": "system", "content": "Sei un esperto analista di vendite."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.7,
-            )
+            for giro in range(query_max_giri + 1):
+                with profile_span("Chiamata OpenAI"):
+                    # Ogni giro rinvia tutta la conversazione: si stima l'intera richiesta più la risposta massima
+                    acquire_tokens(llm, 'domande', sum(estimate_tokens(m['content'] or '') for m in messages) + 1000)
+                    response = llm_chat(
+                        llm,
+                        messages=messages,
+                        max_tokens=1000,
+                        temperature=0.7,
+                        tools=analytics_tools,
+                        tool_choice="auto" if giro < query_max_giri else "none",
+                    )
+                message = response.choices[0].message
+                if not message.tool_calls:
+                    break
+
+                messages.append({
+                    "role": "assistant",
+                    "content": message.content,
+                    "tool_calls": [
+                        {"id": call.id, "type": "function", "function": {"name": call.function.name, "arguments": call.function.arguments}}
+                        for call in message.tool_calls
+                    ],
+                })
+                for call in message.tool_calls:
+                    risultato = execute_tool_call(query_cube, call.function.name, call.function.arguments)
+                    info['strumenti'] += 1
+                    info['token_stimati'] += estimate_tokens(risultato)
+                    messages.append({"role": "tool", "tool_call_id": call.id, "content": risultato})
 
             # Estrazione del testo dalla risposta
-            answer = response.choices[0].message.content
-            return answer
+            answer = message.content
+            if answer:
+                store_cached_answer(impronta, domanda_normalizzata, question, answer)
+            return answer, info
 
         except Exception as e:
             st.error(f"Errore durante la generazione della risposta: {e}")
-            return None
-
-    # Caricamento dati
-    st.header("Caricamento dei Dati")
-
-    # Aggiunta del pulsante per pulire la cache
-    if st.button("Pulisci Cache"):
-        st.cache_data.clear()
-        st.success("Cache pulita con successo!")
-
-    uploaded_file = st.file_uploader("Carica un file Excel con i dati di vendita", type=["xlsx"])
-    if uploaded_file is not None:
-        # Pulisce la cache prima di caricare nuovi dati
-        st.cache_data.clear()
-
-        # Ottiene i nomi dei fogli nel file Excel
-        xls = pd.ExcelFile(uploaded_file)
-        sheet_names = xls.sheet_names
-
-        # Cerca il foglio che contiene 'input' (case-insensitive)
-        sheet_name = None
-        for name in sheet_names:
-            if 'input' in name.lower():
-                sheet_name = name
-                break
-
-        if sheet_name is None:
-            # Se non trova un foglio con 'input', usa il primo foglio
-            sheet_name = xls.sheet_names[0]
-
-        # Legge il foglio corretto
-        data = pd.read_excel(uploaded_file, sheet_name=sheet_name)
-
-        # Rimuove eventuali spazi nei nomi delle colonne
-        data.columns = data.columns.str.strip()
-
-        # Verifica se le colonne sono state lette correttamente
-        expected_columns = ['Sales', 'Canale', 'Meeting FIssato', 'Meeting Effettuato (SQL)', 'Offerte Inviate', 'Analisi Firmate', 'Contratti Chiusi', 'Persi', 'Stato', 'Servizio', 'Valore Tot €', 'Azienda', 'Nome Persona', 'Ruolo', 'Dimensioni', 'Settore', 'Come mai ha accettato?', 'Obiezioni', 'Note']
-        missing_columns = [col for col in expected_columns if col not in data.columns]
-        if missing_columns:
-            st.error(f"Le seguenti colonne sono mancanti nel file caricato: {', '.join(missing_columns)}")
+            return None, info
+
+    # Funzione per costruire gli sketch KLL dei giorni di chiusura al caricamento, una cella per
+    # ogni combinazione di canale, sales rep, servizio, stato e mese di creazione
+    # (condivisi tra le sessioni e in cache per dataset)
+    @st.cache_resource(show_spinner=False, max_entries=8)
+    def build_cycle_sketches(_data, data_key):
+        return sd.build_cycle_sketches(_data)
+
+    # Funzione per calcolare mediana, P75 e P90 del ciclo di vendita per canale e sales rep
+    # fondendo gli sketch delle celle selezionate (in cache per dataset e stato dei filtri)
+    @st.cache_data(show_spinner=False, max_entries=64)
+    def compute_cycle_percentiles(_cells, _data_filtered, filter_key):
+        return sd.compute_cycle_percentiles(_cells, _data_filtered, filter_key[1])
+
+    # Funzione per calcolare il funnel a più fasi di tutti i canali in un'unica passata
+    # (in cache per dataset e stato dei filtri)
+    @st.cache_data(show_spinner=False, max_entries=64)
+    def compute_stage_funnel(_data_filtered, filter_key):
+        return sd.compute_stage_funnel(_data_filtered)
+
+    # Funzione per calcolare la matrice delle coorti per mese di creazione (in cache per dataset e stato dei filtri)
+    @st.cache_data(show_spinner=False, max_entries=64)
+    def compute_cohorts(_data_filtered, filter_key, finestre_giorni=(30, 60, 90)):
+        return sd.compute_cohorts(_data_filtered, finestre_giorni)
+
+    # Funzione per calcolare le somme cumulative giornaliere degli eventi (in cache per dataset e stato dei filtri)
+    @st.cache_data(show_spinner=False, max_entries=64)
+    def compute_daily_prefix_sums(_data_filtered, filter_key):
+        return sd.compute_daily_prefix_sums(_data_filtered)
+
+    # Funzione per calcolare le classifiche top/bottom per sales rep o azienda, riusando la tabella
+    # riepilogativa in cache (in cache per dataset, stato dei filtri e parametri della classifica)
+    @st.cache_data(show_spinner=False, max_entries=128)
+    def compute_leaderboards(_data_filtered, filter_key, grouping_column, metrica, n):
+        summary_df = compute_summary(_data_filtered, filter_key, grouping_column)
+        return sd.compute_leaderboards(_data_filtered, grouping_column, metrica, n, summary_df=summary_df)
+
+    # Funzione per addestrare il modello di probabilità di vittoria sulle opportunità chiuse e stimare
+    # quella delle aperte (condiviso tra le sessioni e in cache per impronta del dataset: i semplici
+    # rerun non riaddestrano mai il modello)
+    @st.cache_resource(show_spinner="Addestramento del modello di previsione...", max_entries=8)
+    def train_win_model(_data, data_key):
+        return sd.train_win_model(_data)
+
+    # Funzione per costruire l'aggregato sparso delle statistiche additive su tutte le dimensioni del
+    # pivot (in cache per dataset e stato dei filtri)
+    @st.cache_data(show_spinner=False, max_entries=16)
+    def build_pivot_cube(_data_filtered, filter_key):
+        return sd.build_pivot_cube(_data_filtered)
+
+    # Funzione per calcolare il pivot con subtotali sulle dimensioni scelte a partire dal cubo
+    # (in cache per dataset, stato dei filtri, dimensioni e dettaglio selezionato)
+    @st.cache_data(show_spinner=False, max_entries=64)
+    def compute_pivot(_cube, filter_key, dimensioni, dettaglio=None):
+        return sd.compute_pivot(_cube, dimensioni, dettaglio)
+
+    # Numero massimo di giri di strumenti per domanda nel function calling
+    query_max_giri = 5
+
+    # Funzione per costruire l'aggregato interrogato dagli strumenti, con il mese di creazione
+    # come dimensione temporale (in cache per dataset e stato dei filtri)
+    @st.cache_data(show_spinner=False, max_entries=16)
+    def build_query_cube(_data_filtered, filter_key):
+        return sd.build_query_cube(_data_filtered)
+
+    # Descrizione degli strumenti nel formato function calling delle API OpenAI
+    analytics_tools = [
+        {
+            "type": "function",
+            "function": {
+                "name": "query_kpi",
+                "description": "Calcola i KPI di vendita sui dati filtrati della dashboard, raggruppati per dimensioni "
+                               "e ordinati per una metrica (top-k). Senza raggruppamento restituisce il totale.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "raggruppa_per": {"type": "array", "items": {"type": "string", "enum": list(query_dimensioni)}},
+                        "metriche": {"type": "array", "items": {"type": "string", "enum": query_metriche}},
+                        "filtri": {
+                            "type": "object",
+                            "description": "Valori ammessi per dimensione, es. {\"Canale\": [\"Referral\"]}",
+                            "properties": {nome: {"type": "array", "items": {"type": "string"}} for nome in query_dimensioni},
+                            "additionalProperties": False,
+                        },
+                        "mese_da": {"type": "string", "description": "Primo mese incluso, formato AAAA-MM"},
+                        "mese_a": {"type": "string", "description": "Ultimo mese incluso, formato AAAA-MM"},
+                        "ordina_per": {"type": "string", "enum": query_metriche},
+                        "crescente": {"type": "boolean", "description": "true per i valori più bassi (bottom-k)"},
+                        "limite": {"type": "integer", "minimum": 1, "maximum": query_max_righe},
+                    },
+                    "additionalProperties": False,
+                },
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "list_dimension_values",
+                "description": "Elenca i valori presenti di una dimensione (es. i nomi dei Sales Rep o i mesi disponibili).",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "dimensione": {"type": "string", "enum": list(query_dimensioni)},
+                        "limite": {"type": "integer", "minimum": 1, "maximum": query_max_righe},
+                    },
+                    "required": ["dimensione"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+    ]
+
+    # Funzione per eseguire uno strumento richiesto dal modello e restituirne il risultato in forma
+    # compatta; gli errori di validazione tornano al modello come testo, così può correggere la richiesta
+    def execute_tool_call(cube, nome, argomenti):
+        try:
+            argomenti = json.loads(argomenti or "{}")
+            if nome == 'query_kpi':
+                risultato, righe_totali = run_kpi_query(cube, **argomenti)
+                return f"{len(risultato)} righe su {righe_totali}\n{serialize_table(risultato)}"
+            if nome == 'list_dimension_values':
+                valori, totale = list_dimension_values(cube, **argomenti)
+                return f"{len(valori)} valori su {totale}: " + json.dumps(valori, ensure_ascii=False)
+            return f"Errore: strumento sconosciuto '{nome}'"
+        except (ValueError, TypeError, KeyError) as e:
+            return f"Errore: {e}"
+
+    # Numero massimo di figure Plotly conservate nella cache dei grafici (eviction LRU)
+    figure_cache_max_entries = 256
+
+    # Cache dei grafici condivisa tra le sessioni: figure già costruite, indicizzate per impronta
+    # della tabella aggregata, tipo di grafico e parametri, con i contatori di hit e miss
+    @st.cache_resource
+    def get_figure_cache():
+        return {'figure': OrderedDict(), 'hit': 0, 'miss': 0, 'lock': threading.Lock()}
+
+    # Funzione per calcolare l'impronta di una tabella aggregata
+    def fingerprint_df(df):
+        valori = pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()
+        return hashlib.sha1(valori + repr(list(df.columns)).encode()).hexdigest()
+
+    # Funzione per riutilizzare una figura già costruita o costruirla e metterla in cache.
+    # Le figure in cache sono condivise e non vanno modificate dopo la costruzione.
+    def cached_figure(chart_type, df, params, build):
+        cache = get_figure_cache()
+        key = (chart_type, fingerprint_df(df), params)
+        with cache['lock']:
+            fig = cache['figure'].get(key)
+            if fig is not None:
+                cache['figure'].move_to_end(key)
+                cache['hit'] += 1
+                return fig
+            cache['miss'] += 1
+
+        with profile_span(f"Costruzione grafico {chart_type}"):
+            fig = build()
+        with cache['lock']:
+            cache['figure'][key] = fig
+            while len(cache['figure']) > figure_cache_max_entries:
+                cache['figure'].popitem(last=False)
+        return fig
+
+    # Funzione per mostrare un grafico Plotly, misurandone la serializzazione e l'invio al browser
+    def show_chart(fig, nome):
+        with profile_span(f"Grafico {nome}"):
+            st.plotly_chart(fig, use_container_width=True)
+
+    # Funzione per ridurre i punti di un grafico con LTTB entro il budget per traccia impostato nella barra laterale
+    def downsample_for_chart(df, x, y_columns, group=None):
+        return sd.downsample(df, x, y_columns, int(st.session_state.get('larghezza_grafici', 1200)), group=group)
+
+    # Funzione per scegliere il rendering delle tracce: WebGL oltre la soglia di punti configurata
+    def chart_render_mode(df, y_columns):
+        soglia_webgl = int(st.session_state.get('soglia_webgl', 5000))
+        return 'webgl' if len(df) * len(y_columns) > soglia_webgl else 'svg'
+
+    # Colonne di testo libero escluse per default dall'esploratore dei dati grezzi
+    colonne_testo_libero = ['Come mai ha accettato?', 'Obiezioni', 'Note']
+    lunghezza_massima_testo = 200
+
+    # Chiavi di ordinamento per colonna dei dati grezzi, calcolate una volta per dataset alla
+    # prima richiesta (condivise tra le sessioni e in cache per dataset)
+    @st.cache_resource(show_spinner=False, max_entries=8)
+    def get_sort_keys(_data, data_key):
+        return {}
+
+    # Funzione per ottenere l'ordine delle righe di una colonna (valori mancanti in fondo)
+    def sort_order(data, data_key, colonna):
+        sort_keys = get_sort_keys(data, data_key)
+        if colonna not in sort_keys:
+            valori = data[colonna].reset_index(drop=True)
+            try:
+                ordine = valori.sort_values(kind='stable', na_position='last').index.to_numpy()
+            except TypeError:
+                # Colonne con tipi misti: ordinamento sul testo
+                ordine = valori.astype(str).where(valori.notnull()).sort_values(kind='stable', na_position='last').index.to_numpy()
+            sort_keys[colonna] = (ordine, valori.isnull().to_numpy())
+        return sort_keys[colonna]
+
+    # Funzione per estrarre una pagina di righe filtrate e ordinate senza ordinare di nuovo i dati
+    def raw_data_page(data, data_key, data_filtered, colonna_ordinamento, decrescente, pagina, righe_per_pagina):
+        # Maschera dei filtri della barra laterale sulle posizioni dei dati completi
+        nel_filtro = np.zeros(len(data), dtype=bool)
+        nel_filtro[data.index.get_indexer(data_filtered.index)] = True
+
+        if colonna_ordinamento is None:
+            posizioni = np.flatnonzero(nel_filtro)
         else:
-            # Pulizia delle colonne di data
-            date_columns = ['Meeting FIssato', 'Meeting Effettuato (SQL)', 'Offerte Inviate', 'Analisi Firmate', 'Contratti Chiusi', 'Persi']
-            for col in date_columns:
-                if col in data.columns:
-                    data[col] = pd.to_datetime(data[col], dayfirst=True, errors='coerce')
-
-            # Pulizia della colonna 'Valore Tot €'
-            if 'Valore Tot €' in data.columns:
-                data['Valore Tot €'] = data['Valore Tot €'].astype(str).replace({'€': '', ',': '', '\.': ''}, regex=True)
-                data['Valore Tot €'] = pd.to_numeric(data['Valore Tot €'], errors='coerce').fillna(0)
-            else:
-                data['Valore Tot €'] = 0
-
-            # Processamento del campo 'Canale'
-            if 'Canale' in data.columns:
-                data['MainChannel'] = data['Canale'].apply(process_canale)
-            else:
-                data['MainChannel'] = 'Unknown'
-
-            # Aggiunta del campo 'TeamMember' dal campo 'Sales'
-            if 'Sales' in data.columns:
-                data['TeamMember'] = data['Sales'].str.title()
-            else:
-                data['TeamMember'] = None
-
-            # Creazione delle colonne 'Opportunity_Created', 'Closed_Won', 'Closed_Lost'
-            # 'Opportunity_Created' lo prendiamo da 'Meeting Effettuato (SQL)' o 'Meeting FIssato'
-            data['Opportunity_Created'] = data['Meeting Effettuato (SQL)'].combine_first(data['Meeting FIssato'])
-
-            # 'Closed_Won' lo prendiamo da 'Contratti Chiusi'
-            data['Closed_Won'] = data['Contratti Chiusi']
-
-            # 'Closed_Lost' lo prendiamo da 'Persi'
-            data['Closed_Lost'] = data['Persi']
-
-            # Aggiusta la colonna 'Stato'
-            data['Stato'] = data['Stato'].fillna('In Progress')
-
-            st.success("Dati caricati con successo!")
-            if st.checkbox("Mostra dati grezzi"):
-                st.subheader("Dati Grezzi")
-                st.write(data)
-            st.session_state['data'] = data
-
-    else:
-        st.warning("Per favore, carica un file Excel per iniziare.")
-
-    if 'data' in st.session_state:
-        data = st.session_state['data']
-
-        # Selezione dei filtri
-        st.sidebar.header("Filtri")
-        # Periodo temporale specifico per mese/trimestre/anno
-        periodo_temporale = st.sidebar.selectbox("Filtro Temporale", ["Intervallo Date", "Mese", "Trimestre", "Anno"])
+            ordine, mancanti = sort_order(data, data_key, colonna_ordinamento)
+            posizioni = ordine[nel_filtro[ordine]]
+            if decrescente:
+                presenti = posizioni[~mancanti[posizioni]]
+                posizioni = np.concatenate([presenti[::-1], posizioni[mancanti[posizioni]]])
+
+        inizio = (pagina - 1) * righe_per_pagina
+        return data.iloc[posizioni[inizio:inizio + righe_per_pagina]], len(posizioni)
+
+    # Esportazioni: le tabelle piccole (es. il riepilogo) restano in cache come bytes per un tempo limitato;
+    # quelle più grandi, come i dati filtrati, non vanno in cache e sono scritte in un file temporaneo
+    # che passa su disco oltre esportazione_memoria_massima_mb
+    righe_massime_cache_esportazione = 10_000
+    esportazione_cache_ttl_secondi = 600
+    esportazione_memoria_massima_mb = 32
+
+    # Funzione per generare un file piccolo da scaricare (in cache per stato dei filtri, contenuto e formato)
+    @st.cache_data(show_spinner=False, max_entries=8, ttl=esportazione_cache_ttl_secondi)
+    def export_bytes(_df, export_key, formato):
+        return sd.write_export(_df, formato)
+
+    # Funzione per scrivere un'esportazione grande in un file temporaneo, riavvolto per la lettura
+    def export_file(df, formato):
+        file = tempfile.SpooledTemporaryFile(max_size=esportazione_memoria_massima_mb * 1024 ** 2)
+        sd.write_export_file(df, formato, file)
+        file.seek(0)
+        return file
+
+    # Funzione per ricostruire al clic di un download i dati filtrati dal registro, così il pulsante
+    # (che resta registrato finché la sessione è aperta) non trattiene una copia dei dati
+    def filtered_export_source(filter_key):
+        registro = get_dataset_registry()
+
+        def sorgente():
+            data_filtered = registry_filtered_view(registro, filter_key)
+            if data_filtered is None:
+                raise ValueError("Il dataset non è più in memoria: ricarica la pagina")
+            return data_filtered
+        return sorgente
+
+    # Funzione per mostrare un pulsante di download che genera il file solo al clic, a partire da df
+    # o, se indicata, dalla funzione 'sorgente' che lo ricostruisce.
+    # Le tabelle troppo grandi per l'XLSX mostrano un avviso al posto del pulsante.
+    def render_download_button(df, export_key, formato, label, file_name, key, sorgente=None):
+        if formato == 'XLSX' and not xlsx_export_allowed(df):
+            st.info(f"{label}: {len(df):,} righe sono troppe per l'XLSX. Scegli CSV o Parquet.".replace(',', '.'))
+            return
+        if sorgente is None:
+            sorgente = lambda: df
+        if len(df) <= righe_massime_cache_esportazione:
+            genera = lambda: export_bytes(sorgente(), export_key, formato)
+        else:
+            genera = lambda: export_file(sorgente(), formato)
+        estensione, mime = formati_esportazione[formato]
+        st.download_button(
+            label=label,
+            data=genera,
+            file_name=f"{file_name}.{estensione}",
+            mime=mime,
+            key=key
+        )
 
+    # Funzione per disegnare una sparkline SVG in linea a partire da una serie di valori
+    def sparkline_svg(valori, width=160, height=32):
+        valori = np.asarray(valori, dtype=float)
+        valori = valori[~np.isnan(valori)]
+        if len(valori) < 2:
+            return ''
+        x = np.linspace(2, width - 2, len(valori))
+        y = height - 2 - (valori - valori.min()) / (np.ptp(valori) or 1) * (height - 4)
+        punti = ' '.join(f"{xi:.1f},{yi:.1f}" for xi, yi in zip(x, y))
+        return (f'<svg class="kpi-sparkline" width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+                f'<polyline fill="none" stroke="#007bff" stroke-width="2" points="{punti}"/></svg>')
+
+    # Funzione per visualizzare tutte le schede KPI in un unico blocco HTML, con variazione
+    # rispetto al periodo precedente e sparkline opzionali
+    def render_kpi_cards(cards):
+        html = []
+        for card in cards:
+            delta_html = ''
+            if card.get('delta') is not None and np.isfinite(card['delta']):
+                positiva = (card['delta'] >= 0) != card.get('delta_inverso', False)
+                freccia = '▲' if card['delta'] >= 0 else '▼'
+                classe = 'kpi-delta-positive' if positiva else 'kpi-delta-negative'
+                delta_html = f'<div class="kpi-delta {classe}">{freccia} {format_number(abs(card["delta"]))}% vs periodo precedente</div>'
+            sparkline_html = sparkline_svg(card['sparkline']) if card.get('sparkline') is not None else ''
+            html.append(f'<div class="kpi-card"><div class="kpi-title">{card["titolo"]}</div>'
+                        f'<div class="kpi-value">{card["valore"]}</div>{delta_html}{sparkline_html}</div>')
+        st.markdown(f'<div class="kpi-grid">{"".join(html)}</div>', unsafe_allow_html=True)
+
+    # Funzione per preparare il record dei KPI principali: valori, variazione rispetto al periodo
+    # precedente di pari durata (solo con l'intervallo di date) e andamento degli ultimi 12 mesi
+    # (in cache per dataset e stato dei filtri)
+    @st.cache_data(show_spinner=False, max_entries=64)
+    def compute_kpi_record(_data, _data_filtered, filter_key):
+        metrics = calculate_metrics(_data_filtered, filter_key)
+
+        precedenti = None
+        periodo_temporale, selezione_date, *altri_filtri = filter_key[1]
         if periodo_temporale == "Intervallo Date":
-            # Periodo temporale
-            min_date = data['Opportunity_Created'].min()
-            max_date = data['Opportunity_Created'].max()
-            if pd.isnull(min_date) or pd.isnull(max_date):
-                min_date = datetime.today()
-                max_date = datetime.today()
-            start_date, end_date = st.sidebar.date_input("Seleziona il periodo", [min_date, max_date])
-            date_mask = (data['Opportunity_Created'] >= pd.to_datetime(start_date)) & (data['Opportunity_Created'] <= pd.to_datetime(end_date))
-        elif periodo_temporale == "Mese":
-            mesi = data['Opportunity_Created'].dt.to_period('M').unique().astype(str)
-            selected_months = st.sidebar.multiselect("Seleziona Mese/i", mesi, default=mesi)
-            date_mask = data['Opportunity_Created'].dt.to_period('M').astype(str).isin(selected_months)
-        elif periodo_temporale == "Trimestre":
-            trimestri = data['Opportunity_Created'].dt.to_period('Q').unique().astype(str)
-            selected_quarters = st.sidebar.multiselect("Seleziona Trimestre/i", trimestri, default=trimestri)
-            date_mask = data['Opportunity_Created'].dt.to_period('Q').astype(str).isin(selected_quarters)
-        elif periodo_temporale == "Anno":
-            anni = data['Opportunity_Created'].dt.year.unique()
-            selected_years = st.sidebar.multiselect("Seleziona Anno/i", anni, default=anni)
-            date_mask = data['Opportunity_Created'].dt.year.isin(selected_years)
-
-        # Canale
-        canali = data['MainChannel'].unique()
-        selected_canali = st.sidebar.multiselect("Seleziona Canali", canali, default=canali)
-
-        # Sales Rep
-        sales_reps = data['TeamMember'].dropna().unique()
-        selected_sales_reps = st.sidebar.multiselect("Seleziona Sales Rep", sales_reps, default=sales_reps)
-
-        # Tipo di opportunità (Servizio)
-        servizi = data['Servizio'].dropna().unique()
-        selected_servizi = st.sidebar.multiselect("Seleziona Servizi", servizi, default=servizi)
-
-        # Stato opportunità
-        stati = data['Stato'].dropna().unique()
-        selected_stati = st.sidebar.multiselect("Seleziona Stato Opportunità", stati, default=stati)
-
-        # Filtro dei dati in base alle selezioni
-        data_filtered = data[
-            date_mask &
-            (data['MainChannel'].isin(selected_canali)) &
-            (data['TeamMember'].isin(selected_sales_reps)) &
-            (data['Servizio'].isin(selected_servizi)) &
-            (data['Stato'].isin(selected_stati))
+            start_date, end_date = pd.to_datetime(selezione_date[0]), pd.to_datetime(selezione_date[1])
+            durata = end_date - start_date + pd.Timedelta(days=1)
+            filtri_precedenti = ("Intervallo Date", ((start_date - durata).date(), (start_date - pd.Timedelta(days=1)).date()), *altri_filtri)
+            precedenti = calculate_metrics(filter_data(_data, filtri_precedenti), (filter_key[0], filtri_precedenti))
+
+        def delta(chiave):
+            if precedenti is None or not precedenti[chiave] or pd.isnull(precedenti[chiave]):
+                return None
+            return (metrics[chiave] - precedenti[chiave]) / abs(precedenti[chiave]) * 100
+
+        mensile = aggregate_by_period(_data_filtered, filter_key, 'M').tail(12)
+        chiuse = (mensile['Opportunità Vinte'] + mensile['Opportunità Perse']).replace(0, np.nan)
+
+        return [
+            {'titolo': 'Opportunità Totali', 'valore': f"{metrics['totale_opportunita']}",
+             'delta': delta('totale_opportunita'), 'sparkline': mensile['Opportunità Create'].tolist()},
+            {'titolo': 'Opportunità Vinte', 'valore': f"{metrics['totale_vinti']}",
+             'delta': delta('totale_vinti'), 'sparkline': mensile['Opportunità Vinte'].tolist()},
+            {'titolo': 'Revenue Totale', 'valore': f"€{format_number(metrics['totale_revenue'])}",
+             'delta': delta('totale_revenue'), 'sparkline': mensile['Revenue Totale'].tolist()},
+            {'titolo': 'Win Rate', 'valore': f"{format_number(metrics['win_rate'])}%",
+             'delta': delta('win_rate'), 'sparkline': (mensile['Opportunità Vinte'] / chiuse * 100).tolist()},
+            {'titolo': 'Lost Rate', 'valore': f"{format_number(metrics['lost_rate'])}%",
+             'delta': delta('lost_rate'), 'delta_inverso': True, 'sparkline': (mensile['Opportunità Perse'] / chiuse * 100).tolist()},
+            {'titolo': 'Pipeline Velocity', 'valore': f"€{format_number(metrics['pipeline_velocity'])}",
+             'delta': delta('pipeline_velocity')},
         ]
 
-        # Calcolo delle metriche
-        metrics = calculate_metrics(data_filtered)
+    # Tetto di memoria dei dataset condivisi tra le sessioni (MB) e durata del riferimento di una
+    # sessione inattiva: oltre questa durata la sessione non trattiene più il proprio dataset
+    dataset_memoria_massima_mb = float(os.environ.get("DATASET_MEMORY_LIMIT_MB", 2048))
+    dataset_riferimento_scadenza_secondi = 1800
+    # Viste filtrate conservate per ciascun dataset, condivise tra le sessioni con gli stessi filtri
+    dataset_viste_max = 8
+
+    # Registro dei dataset caricati, condiviso da tutte le sessioni del processo: ogni file viene
+    # pulito una sola volta e tenuto in un'unica copia, indicizzata per impronta del contenuto.
+    # Per ogni dataset conserva le sessioni che lo usano (con l'ultimo accesso) e la memoria occupata.
+    # I dataset del registro sono condivisi e non vanno modificati.
+    @st.cache_resource
+    def get_dataset_registry():
+        return {'voci': OrderedDict(), 'rimossi': 0, 'lock': threading.Lock()}
+
+    # Funzione per rimuovere i riferimenti delle sessioni inattive da più di dataset_riferimento_scadenza_secondi
+    def prune_dataset_references(voci, adesso):
+        for voce in voci.values():
+            for sessione, ultimo_accesso in list(voce['sessioni'].items()):
+                if adesso - ultimo_accesso > dataset_riferimento_scadenza_secondi:
+                    del voce['sessioni'][sessione]
+
+    # Funzione per calcolare la memoria di un dataset del registro, comprese le sue viste filtrate
+    def dataset_bytes(voce):
+        return voce['byte'] + sum(vista['byte'] for vista in voce['viste'].values())
+
+    # Funzione per rientrare nel tetto di memoria rimuovendo i dataset meno usati di recente: prima quelli
+    # senza sessioni, poi, se non basta, anche quelli in uso (le sessioni li ricaricano dal file al rerun
+    # successivo). Il dataset 'tieni', appena richiesto, non viene mai rimosso.
+    def evict_datasets(registro, tieni=None):
+        voci = registro['voci']
+        limite = dataset_memoria_massima_mb * 1024 ** 2
+        totale = sum(dataset_bytes(voce) for voce in voci.values())
+        for solo_inutilizzati in (True, False):
+            for chiave in list(voci):
+                if totale <= limite:
+                    return
+                if chiave != tieni and (not solo_inutilizzati or not voci[chiave]['sessioni']):
+                    totale -= dataset_bytes(voci.pop(chiave))
+                    registro['rimossi'] += 1
+
+    # Funzione per ottenere il dataset di un file per la sessione corrente: lo riusa se un'altra sessione
+    # lo ha già caricato, altrimenti lo carica e lo registra. La sessione rilascia il dataset usato prima.
+    def acquire_dataset(file_bytes, data_key):
+        registro = get_dataset_registry()
+        sessione = session_id()
+        with registro['lock']:
+            voce = registro['voci'].get(data_key)
+
+        # Il caricamento avviene fuori dal lock, per non bloccare le altre sessioni
+        if voce is None:
+            data, missing_columns = sd.load_data(file_bytes)
+            if missing_columns:
+                return None, missing_columns
+            voce = {'data': data, 'righe': len(data), 'byte': int(data.memory_usage(deep=True).sum()), 'sessioni': {}, 'viste': OrderedDict()}
+
+        with registro['lock']:
+            # Se un'altra sessione ha registrato lo stesso file nel frattempo, si usa la copia già registrata
+            voce = registro['voci'].setdefault(data_key, voce)
+            registro['voci'].move_to_end(data_key)
+            adesso = time.time()
+            for altra in registro['voci'].values():
+                altra['sessioni'].pop(sessione, None)
+            voce['sessioni'][sessione] = adesso
+            voce['ultimo_accesso'] = adesso
+            prune_dataset_references(registro['voci'], adesso)
+            evict_datasets(registro, tieni=data_key)
+        return voce['data'], []
+
+    # Funzione per leggere dal registro il dataset della sessione corrente, aggiornandone l'ultimo
+    # accesso; restituisce None se è stato rimosso per liberare memoria
+    def session_dataset():
+        data_key = st.session_state.get('data_key')
+        registro = get_dataset_registry()
+        sessione = session_id()
+        with registro['lock']:
+            voce = registro['voci'].get(data_key)
+            if voce is None:
+                return None
+            registro['voci'].move_to_end(data_key)
+            voce['sessioni'][sessione] = voce['ultimo_accesso'] = time.time()
+            return voce['data']
+
+    # Funzione per ottenere il dataset nelle sezioni: se è stato rimosso dal registro mentre la
+    # sezione era aperta, un rerun completo lo ricarica dal file caricato
+    def fragment_dataset():
+        data = session_dataset()
+        if data is None:
+            st.rerun()
+        return data
+
+    # Funzione per ottenere dal registro i dati filtrati di un dataset: ogni stato dei filtri è calcolato
+    # una sola volta e la vista è condivisa tra le sessioni, con la memoria stimata in proporzione alle
+    # righe e conteggiata nel tetto. Se i filtri selezionano tutte le righe la vista è il dataset stesso.
+    # Non usa lo stato di sessione, quindi può essere chiamata anche fuori dallo script (es. al clic
+    # di un download); restituisce None se il dataset non è più nel registro.
+    def registry_filtered_view(registro, filter_key):
+        data_key, filtri = filter_key
+        with registro['lock']:
+            voce = registro['voci'].get(data_key)
+            if voce is None:
+                return None
+            vista = voce['viste'].get(filtri)
+            if vista is not None:
+                voce['viste'].move_to_end(filtri)
+                return vista['data']
+            data = voce['data']
+
+        # Il filtro avviene fuori dal lock, per non bloccare le altre sessioni
+        data_filtered = filter_data(data, filtri)
+        if len(data_filtered) == len(data):
+            data_filtered = data
+        byte = 0 if data_filtered is data else int(voce['byte'] * len(data_filtered) / max(len(data), 1))
+
+        with registro['lock']:
+            if registro['voci'].get(data_key) is voce:
+                vista = voce['viste'].setdefault(filtri, {'data': data_filtered, 'byte': byte})
+                voce['viste'].move_to_end(filtri)
+                while len(voce['viste']) > dataset_viste_max:
+                    voce['viste'].popitem(last=False)
+                evict_datasets(registro, tieni=data_key)
+                data_filtered = vista['data']
+        return data_filtered
+
+    # Funzione per ottenere i dati filtrati nelle sezioni a partire dallo stato dei filtri
+    def fragment_filtered_dataset(filter_key):
+        fragment_dataset()
+        data_filtered = registry_filtered_view(get_dataset_registry(), filter_key)
+        if data_filtered is None:
+            st.rerun()
+        return data_filtered
+
+    # Funzione per riassumere l'uso del registro: memoria totale, tetto e dettaglio per dataset
+    def dataset_registry_usage():
+        registro = get_dataset_registry()
+        with registro['lock']:
+            prune_dataset_references(registro['voci'], time.time())
+            dataset = [
+                {'Dataset': chiave[:10], 'Righe': voce['righe'], 'Memoria (MB)': dataset_bytes(voce) / 1024 ** 2,
+                 'Sessioni': len(voce['sessioni']), 'Ultimo accesso': datetime.fromtimestamp(voce['ultimo_accesso'])}
+                for chiave, voce in reversed(registro['voci'].items())
+            ]
+            rimossi = registro['rimossi']
+        return {
+            'byte_totali': sum(voce['Memoria (MB)'] for voce in dataset) * 1024 ** 2,
+            'byte_massimi': dataset_memoria_massima_mb * 1024 ** 2,
+            'rimossi': rimossi,
+            'dataset': dataset,
+        }
 
-        # Sezione metriche chiave
-        st.subheader("Key Performance Indicators")
+    # Funzione per mostrare nella barra laterale la memoria usata dai dataset condivisi
+    def render_dataset_usage():
+        uso = dataset_registry_usage()
+        st.sidebar.caption(f"Dataset in memoria: {len(uso['dataset'])}, {format_number(uso['byte_totali'] / 1024 ** 2)} MB "
+                           f"su {format_number(uso['byte_massimi'] / 1024 ** 2)} MB ({uso['rimossi']} rimossi)")
+        if uso['dataset']:
+            with st.sidebar.expander("Dataset in memoria"):
+                st.dataframe(pd.DataFrame(uso['dataset']).round({'Memoria (MB)': 1}), hide_index=True, use_container_width=True)
+
+    formato_metriche = (
+        ('Revenue Totale', 'euro'),
+        ('Valore Medio Contratto', 'euro'),
+        ('Pipeline Velocity', 'euro'),
+        ('Win Rate', 'percentuale'),
+        ('Tempo Medio di Chiusura (giorni)', 'numero'),
+    )
+
+    # Sezione tabella riepilogativa
+    @st.fragment
+    @profiled("Sezione Tabella Riepilogativa")
+    def render_summary_section(filter_key):
+        data_filtered = fragment_filtered_dataset(filter_key)
+        st.subheader("Tabella Riepilogativa per Canale")
 
-        # Creazione di un layout a 3 colonne per i KPI
-        col1, col2, col3 = st.columns(3, gap="large")
+        summary_df = compute_summary(data_filtered, filter_key)
 
-        with col1:
-            st.markdown(f"""
-            <div class="kpi-card">
-                <div class="kpi-title">Opportunità Totali</div>
-                <div class="kpi-value">{metrics['totale_opportunita']}</div>
-            </div>
-            """, unsafe_allow_html=True)
+        # Aggiunta della colonna 'Tempo Medio di Chiusura (giorni)' alle colonne da visualizzare
+        columns_to_display = ['Opportunità Create', 'Opportunità Vinte', 'Opportunità Perse', 'Revenue Totale', 'Valore Medio Contratto', 'Win Rate', 'Tempo Medio di Chiusura (giorni)', 'Pipeline Velocity']
 
-            st.markdown(f"""
-            <div class="kpi-card">
-                <div class="kpi-title">Win Rate</div>
-                <div class="kpi-value">{format_number(metrics['win_rate'])}%</div>
-            </div>
-            """, unsafe_allow_html=True)
+        # Formattazione e visualizzazione della tabella
+        render_table(summary_df[columns_to_display], (filter_key, 'summary'), formato_metriche, (
+            ('Opportunità Create', 'max', '#d4edda'),
+            ('Revenue Totale', 'max', '#d4edda'),
+            ('Win Rate', 'max', '#d4edda'),
+            ('Pipeline Velocity', 'max', '#d4edda'),
+            ('Tempo Medio di Chiusura (giorni)', 'min', '#f8d7da'),
+        ))
 
+        # Esportazione dati: i file vengono generati solo al clic
+        formato = st.radio("Formato di esportazione", list(formati_esportazione), horizontal=True, key='formato_esportazione')
+        col1, col2 = st.columns(2)
+        with col1:
+            render_download_button(summary_df[columns_to_display].reset_index(), (filter_key, 'summary'), formato,
+                                   f"Scarica tabella riepilogativa ({formato})", 'summary', 'download_summary')
         with col2:
-            st.markdown(f"""
-            <div class="kpi-card">
-                <div class="kpi-title">Opportunità Vinte</div>
-                <div class="kpi-value">{metrics['totale_vinti']}</div>
-            </div>
-            """, unsafe_allow_html=True)
-
-            st.markdown(f"""
-            <div class="kpi-card">
-                <div class="kpi-title">Lost Rate</div>
-                <div class="kpi-value">{format_number(metrics['lost_rate'])}%</div>
-            </div>
-            """, unsafe_allow_html=True)
-
-        with col3:
-            st.markdown(f"""
-            <div class="kpi-card">
-                <div class="kpi-title">Revenue Totale</div>
-                <div class="kpi-value">€{format_number(metrics['totale_revenue'])}</div>
-            </div>
-            """, unsafe_allow_html=True)
-
-            st.markdown(f"""
-            <div class="kpi-card">
-                <div class="kpi-title">Pipeline Velocity</div>
-                <div class="kpi-value">€{format_number(metrics['pipeline_velocity'])}</div>
-            </div>
-            """, unsafe_allow_html=True)
-
-        # Tabella riepilogativa
-        st.subheader("Tabella Riepilogativa per Canale")
-
-        grouping_column = 'MainChannel'
-        if grouping_column in data_filtered.columns:
-            summary_df = data_filtered.groupby(grouping_column).agg({
-                'Opportunity_Created': 'count',
-                'Closed_Lost': lambda x: x.notnull().sum(),
-                'Closed_Won': lambda x: x.notnull().sum(),
-                'Valore Tot €': 'sum',
-                'Days_to_Close': 'mean'
-            }).rename(columns={
-                'Opportunity_Created': 'Opportunità Create',
-                'Closed_Lost': 'Opportunità Perse',
-                'Closed_Won': 'Opportunità Vinte',
-                'Valore Tot €': 'Revenue Totale',
-                'Days_to_Close': 'Tempo Medio di Chiusura (giorni)'
-            })
-
-            summary_df['Valore Medio Contratto'] = summary_df['Revenue Totale'] / summary_df['Opportunità Vinte']
-            summary_df['Win Rate'] = (summary_df['Opportunità Vinte'] / (summary_df['Opportunità Vinte'] + summary_df['Opportunità Perse'])) * 100
-            summary_df['Pipeline Velocity'] = (summary_df['Opportunità Create'] * (summary_df['Win Rate']/100) * summary_df['Valore Medio Contratto']) / summary_df['Tempo Medio di Chiusura (giorni)']
-            summary_df['Pipeline Velocity'] = summary_df['Pipeline Velocity'].fillna(0)
-
-            # Aggiunta della colonna 'Tempo Medio di Chiusura (giorni)' alle colonne da visualizzare
-            columns_to_display = ['Opportunità Create', 'Opportunità Vinte', 'Opportunità Perse', 'Revenue Totale', 'Valore Medio Contratto', 'Win Rate', 'Tempo Medio di Chiusura (giorni)', 'Pipeline Velocity']
-
-            # Formattazione dei dati
-            summary_df_formatted = summary_df[columns_to_display].style.format({
-                "Revenue Totale": lambda x: f"€{format_number(x)}",
-                "Valore Medio Contratto": lambda x: f"€{format_number(x)}",
-                "Pipeline Velocity": lambda x: f"€{format_number(x)}",
-                "Win Rate": lambda x: f"{format_number(x)}%",
-                "Tempo Medio di Chiusura (giorni)": lambda x: format_number(x)
-            }).highlight_max(subset=['Opportunità Create', 'Revenue Totale', 'Win Rate', 'Pipeline Velocity'], color='#d4edda').highlight_min(subset=['Tempo Medio di Chiusura (giorni)'], color='#f8d7da')
-
-            # Visualizzazione tabella
-            st.dataframe(summary_df_formatted, use_container_width=True)
-
-            # Esportazione dati
-            csv = summary_df[columns_to_display].to_csv(index=True).encode('utf-8')
-            st.download_button(
-                label="Scarica dati come CSV",
-                data=csv,
-                file_name='summary.csv',
-                mime='text/csv',
-                key='download_summary'
-            )
-
-        # Generazione degli insight utilizzando GPT-4o
-        insights = generate_ai_insights(metrics, summary_df)
-
-        if insights:
-            st.subheader("Interpretazione delle Metriche")
-            st.markdown(insights)
+            render_download_button(data_filtered, (filter_key, 'dati_filtrati'), formato,
+                                   f"Scarica dati filtrati ({formato})", 'dati_filtrati', 'download_dati_filtrati',
+                                   sorgente=filtered_export_source(filter_key))
+
+    # Sezione insight AI e domande dell'utente
+    @st.fragment
+    @profiled("Sezione Interpretazione AI")
+    def render_ai_section(filter_key, metrics):
+        data_filtered = fragment_filtered_dataset(filter_key)
+        summary_df = compute_summary(data_filtered, filter_key)
+
+        # Generazione degli insight utilizzando GPT-4o, in background e in cache
+        render_insight(generate_ai_insights(metrics, summary_df))
+
+        # Commenti per canale e sales rep, generati in parallelo su richiesta
+        st.subheader("Commenti per Segmento")
+        if st.button("Genera commenti per canale e sales rep"):
+            st.session_state['insight_segmenti'] = (filter_key, generate_segment_insights(data_filtered, filter_key))
+        segmenti_salvati = st.session_state.get('insight_segmenti')
+        if segmenti_salvati and segmenti_salvati[0] == filter_key:
+            render_segment_insights(segmenti_salvati[1])
 
         # Sezione per le domande aggiuntive
         st.subheader("Chiedi all'Esperto di Vendite AI")
@@ -512,201 +1463,605 @@ Rispondi in modo dettagliato e professionale, fornendo analisi e suggerimenti pe
 
         if user_question:
             with st.spinner("Sto elaborando la tua domanda..."):
-                answer = answer_user_question(user_question, metrics, summary_df)
+                answer, prompt_info = answer_user_question(user_question, metrics, summary_df, build_query_cube(data_filtered, filter_key))
                 if answer:
                     st.markdown("**Risposta dell'esperto AI:**")
                     st.markdown(answer)
-
-        
-        # Visualizzazioni grafiche
-        st.subheader("Visualizzazioni Grafiche")
-
-            # Selezione della metrica per il trend temporale
-        metriche_disponibili = ['Opportunità Create', 'Opportunità Vinte', 'Opportunità Perse', 'Revenue Totale']
+                if prompt_info.get('cache') == 'identica':
+                    st.caption("Risposta dalla cache: domanda già posta sugli stessi dati.")
+                elif prompt_info.get('cache') == 'simile':
+                    st.caption(f"Risposta dalla cache per una domanda simile: \"{prompt_info['domanda']}\"")
+                else:
+                    st.caption(prompt_size_caption(prompt_info))
+
+    # Sezione trend temporale, growth e zoom: dipendono tutti da 'metrica_trend'
+    @st.fragment
+    @profiled("Sezione Trend Temporale")
+    def render_trend_section(filter_key, periodo_temporale):
+        import plotly.express as px
+
+        data_filtered = fragment_filtered_dataset(filter_key)
+
+        # Selezione della metrica per il trend temporale
         metrica_selezionata = st.selectbox("Seleziona la metrica per il trend temporale", metriche_disponibili, key='metrica_trend')
 
-            # Preparazione dei dati per il trend temporale
-        if periodo_temporale == "Mese":
-                data_filtered['Periodo'] = data_filtered['Opportunity_Created'].dt.to_period('M').astype(str)
-        elif periodo_temporale == "Trimestre":
-                data_filtered['Periodo'] = data_filtered['Opportunity_Created'].dt.to_period('Q').astype(str)
-        elif periodo_temporale == "Anno":
-                data_filtered['Periodo'] = data_filtered['Opportunity_Created'].dt.to_period('A').astype(str)
-        else:
-                data_filtered['Periodo'] = data_filtered['Opportunity_Created'].dt.to_period('D').astype(str)
-
-        trend_df = data_filtered.groupby(['Periodo']).agg({
-                'Opportunity_Created': 'count',
-                'Closed_Won': lambda x: x.notnull().sum(),
-                'Closed_Lost': lambda x: x.notnull().sum(),
-                'Valore Tot €': 'sum'
-        }).rename(columns={
-                'Opportunity_Created': 'Opportunità Create',
-                'Closed_Won': 'Opportunità Vinte',
-                'Closed_Lost': 'Opportunità Perse',
-                'Valore Tot €': 'Revenue Totale',
-        }).reset_index()
-
-            # Calcolo del Growth
-        trend_df = trend_df.sort_values('Periodo')
+        # Preparazione dei dati per il trend temporale
+        trend_df = aggregate_by_period(data_filtered, filter_key, frequenze_periodo.get(periodo_temporale, 'D')).copy()
+
+        # Calcolo del Growth
         trend_df['Growth (%)'] = trend_df[metrica_selezionata].pct_change() * 100
 
-            # Grafico del trend temporale
-        fig_trend = px.line(trend_df, x='Periodo', y=metrica_selezionata,
+        # Punti ridotti entro la larghezza del grafico, mantenendo i picchi
+        trend_plot_df = downsample_for_chart(trend_df, 'Periodo', [metrica_selezionata, 'Growth (%)'])
+        trend_render_mode = chart_render_mode(trend_plot_df, [metrica_selezionata])
+
+        # Grafico del trend temporale
+        def build_trend():
+            fig_trend = px.line(trend_plot_df, x='Periodo', y=metrica_selezionata,
                                 title=f"Trend temporale di {metrica_selezionata}",
-                                markers=True)
-        fig_trend.update_layout(
+                                markers=True, render_mode=trend_render_mode)
+            fig_trend.update_layout(
                 xaxis_title="Periodo",
                 yaxis_title=metrica_selezionata,
                 legend_title="",
                 hovermode="x unified"
             )
-        st.plotly_chart(fig_trend, use_container_width=True)
+            return fig_trend
+        fig_trend = cached_figure('trend', trend_plot_df, (metrica_selezionata, trend_render_mode), build_trend)
+        show_chart(fig_trend, 'trend')
 
-            # Grafico del Growth
+        # Grafico del Growth
         st.subheader(f"Variazione Percentuale di {metrica_selezionata}")
-        fig_growth = px.bar(trend_df, x='Periodo', y='Growth (%)',
+        def build_growth():
+            fig_growth = px.bar(trend_plot_df, x='Periodo', y='Growth (%)',
                                 title=f"Variazione Percentuale di {metrica_selezionata} nel tempo",
                                 color_discrete_sequence=['#007bff'])
-        fig_growth.update_layout(
+            fig_growth.update_layout(
                 xaxis_title="Periodo",
                 yaxis_title="Growth (%)",
                 hovermode="x unified"
             )
-        st.plotly_chart(fig_growth, use_container_width=True)
+            return fig_growth
+        fig_growth = cached_figure('growth', trend_plot_df, (metrica_selezionata,), build_growth)
+        show_chart(fig_growth, 'growth')
+
+        # KPI su finestre mobili, calcolati dalle somme cumulative giornaliere
+        st.subheader("KPI su Finestre Mobili")
+        finestre = st.multiselect("Seleziona le finestre mobili (giorni)", [7, 30, 60, 90, 180, 365], default=[30, 90], key='finestre_mobili')
+        prefix_sums = compute_daily_prefix_sums(data_filtered, filter_key)
+
+        if finestre and not prefix_sums.empty:
+            rolling_df = pd.concat(
+                {f"{window} giorni": rolling_from_prefix_sums(prefix_sums, window) for window in sorted(finestre)},
+                names=['Finestra', 'Data'],
+            ).reset_index()
+            rolling_plot_df = downsample_for_chart(rolling_df, 'Data', [metrica_selezionata, 'Win Rate', 'Pipeline Velocity'], group='Finestra')
+            rolling_render_mode = chart_render_mode(rolling_plot_df, [metrica_selezionata])
+
+            def build_rolling():
+                fig_rolling = px.line(rolling_plot_df, x='Data', y=metrica_selezionata, color='Finestra',
+                                      title=f"{metrica_selezionata} su finestre mobili",
+                                      render_mode=rolling_render_mode)
+                fig_rolling.update_layout(
+                    xaxis_title="Data",
+                    yaxis_title=metrica_selezionata,
+                    hovermode="x unified"
+                )
+                return fig_rolling
+            fig_rolling = cached_figure('rolling', rolling_plot_df, (metrica_selezionata, rolling_render_mode), build_rolling)
+            show_chart(fig_rolling, 'rolling')
+
+            col1, col2 = st.columns(2)
+            for col, indicatore in zip([col1, col2], ['Win Rate', 'Pipeline Velocity']):
+                def build_indicatore():
+                    fig_indicatore = px.line(rolling_plot_df, x='Data', y=indicatore, color='Finestra',
+                                             title=f"{indicatore} su finestre mobili",
+                                             render_mode=rolling_render_mode)
+                    fig_indicatore.update_layout(
+                        xaxis_title="Data",
+                        yaxis_title=indicatore,
+                        hovermode="x unified"
+                    )
+                    return fig_indicatore
+                fig_indicatore = cached_figure('rolling_indicatore', rolling_plot_df, (indicatore, rolling_render_mode), build_indicatore)
+                with col:
+                    show_chart(fig_indicatore, 'indicatore')
+
+        # Zoom temporale avanzato
+        st.subheader("Zoom Temporale Avanzato")
+        zoom_options = ['Tutto', 'Ultimi 12 periodi', 'Ultimi 6 periodi', 'Ultimi 3 periodi']
+        zoom_selection = st.selectbox("Seleziona il range temporale", zoom_options, key='zoom_selection')
+
+        if zoom_selection == 'Tutto':
+            zoom_df = trend_df
+        else:
+            n_periods = int(zoom_selection.split(' ')[1])
+            zoom_df = trend_df.tail(n_periods)
+        zoom_df = downsample_for_chart(zoom_df, 'Periodo', [metrica_selezionata])
+        zoom_render_mode = chart_render_mode(zoom_df, [metrica_selezionata])
+
+        def build_zoom():
+            fig_zoom = px.line(zoom_df, x='Periodo', y=metrica_selezionata,
+                               title=f"{metrica_selezionata} - {zoom_selection}",
+                               markers=True, render_mode=zoom_render_mode)
+            fig_zoom.update_layout(
+                xaxis_title="Periodo",
+                yaxis_title=metrica_selezionata,
+                hovermode="x unified"
+            )
+            return fig_zoom
+        fig_zoom = cached_figure('zoom', zoom_df, (metrica_selezionata, zoom_selection, zoom_render_mode), build_zoom)
+        show_chart(fig_zoom, 'zoom')
+
+    # Sezione confronto tra canali
+    @st.fragment
+    @profiled("Sezione Confronto tra Canali")
+    def render_channel_section(filter_key):
+        import plotly.express as px
+
+        data_filtered = fragment_filtered_dataset(filter_key)
 
-            # Grafico di confronto canali
         st.subheader("Confronto tra Canali")
         metrica_canali = st.selectbox("Seleziona la metrica per il confronto canali", metriche_disponibili, index=0, key='metrica_confronto')
 
-        confronto_df = data_filtered.groupby('MainChannel').agg({
-                'Opportunity_Created': 'count',
-                'Closed_Won': lambda x: x.notnull().sum(),
-                'Closed_Lost': lambda x: x.notnull().sum(),
-                'Valore Tot €': 'sum'
-        }).rename(columns={
-                'Opportunity_Created': 'Opportunità Create',
-                'Closed_Won': 'Opportunità Vinte',
-                'Closed_Lost': 'Opportunità Perse',
-                'Valore Tot €': 'Revenue Totale',
-        }).reset_index()
-
-            # Ordinamento per valore nei grafici
-        confronto_df = confronto_df.sort_values(by=metrica_canali, ascending=False)
-
-        fig_confronto = px.bar(confronto_df, x=metrica_canali, y='MainChannel',
-                                title=f"Confronto Canali - {metrica_canali}",
-                                text=metrica_canali,
-                                orientation='h',
-                                color='MainChannel',
-                                color_discrete_sequence=px.colors.qualitative.Safe)
-        fig_confronto.update_layout(
+        # Ordinamento per valore nei grafici
+        confronto_df = aggregate_by_channel(data_filtered, filter_key).sort_values(by=metrica_canali, ascending=False)
+
+        def build_confronto():
+            fig_confronto = px.bar(confronto_df, x=metrica_canali, y='MainChannel',
+                                   title=f"Confronto Canali - {metrica_canali}",
+                                   text=metrica_canali,
+                                   orientation='h',
+                                   color='MainChannel',
+                                   color_discrete_sequence=px.colors.qualitative.Safe)
+            fig_confronto.update_layout(
                 xaxis_title=metrica_canali,
                 yaxis_title="Canale",
                 showlegend=False,
                 hovermode="y"
             )
-        st.plotly_chart(fig_confronto, use_container_width=True)
+            return fig_confronto
+        fig_confronto = cached_figure('confronto_canali', confronto_df, (metrica_canali,), build_confronto)
+        show_chart(fig_confronto, 'confronto')
+
+    # Sezione pipeline funnel con breakdown per canale
+    @st.fragment
+    @profiled("Sezione Pipeline Funnel")
+    def render_funnel_section(filter_key):
+        import plotly.graph_objects as go
+
+        data_filtered = fragment_filtered_dataset(filter_key)
 
-            # Pipeline Funnel con breakdown per canale
         st.subheader("Pipeline Funnel")
-        funnel_option = st.selectbox("Seleziona il canale per visualizzare il funnel", ['Tutti'] + list(data_filtered['MainChannel'].unique()), key='funnel_option')
+
+        # Il funnel è calcolato per tutti i canali insieme: cambiare canale è una semplice lettura
+        funnel_df, persi = compute_stage_funnel(data_filtered, filter_key)
+        canali_funnel = [canale for canale in funnel_df.index.unique(level='Canale') if canale != 'Tutti']
+        funnel_option = st.selectbox("Seleziona il canale per visualizzare il funnel", ['Tutti'] + canali_funnel, key='funnel_option')
 
         if funnel_option == 'Tutti':
-                funnel_data = data_filtered
-                funnel_title = "Pipeline Funnel - Tutti i Canali"
+            funnel_title = "Pipeline Funnel - Tutti i Canali"
         else:
-                funnel_data = data_filtered[data_filtered['MainChannel'] == funnel_option]
-                funnel_title = f"Pipeline Funnel - {funnel_option}"
-
-        funnel_stages = ['Opportunità Create', 'Opportunità Vinte', 'Opportunità Perse']
-        funnel_values = [
-                funnel_data['Opportunity_Created'].count(),
-                funnel_data['Closed_Won'].notnull().sum(),
-                funnel_data['Closed_Lost'].notnull().sum()
-            ]
+            funnel_title = f"Pipeline Funnel - {funnel_option}"
 
-            # Calcolo delle percentuali per il funnel
-        funnel_percentages = [f"{(value / funnel_values[0]) * 100:.2f}%" if funnel_values[0] > 0 else "0%" for value in funnel_values]
+        funnel_channel_df = funnel_df.loc[funnel_option]
 
-        fig_funnel = go.Figure(go.Funnel(
-                y=funnel_stages,
-                x=funnel_values,
+        def build_funnel():
+            fig_funnel = go.Figure(go.Funnel(
+                y=funnel_channel_df.index,
+                x=funnel_channel_df['Opportunità'],
                 textinfo="value+percent previous",
                 textposition="inside",
                 texttemplate="<b>%{label}</b><br>%{value} (%{percentPrevious:.2%})"
             ))
-        fig_funnel.update_layout(
+            fig_funnel.update_layout(
                 title=funnel_title,
                 yaxis_title="Fase",
                 xaxis_title="Numero di Opportunità"
             )
-        st.plotly_chart(fig_funnel, use_container_width=True)
+            return fig_funnel
+        fig_funnel = cached_figure('funnel', funnel_channel_df, (funnel_title,), build_funnel)
+        show_chart(fig_funnel, 'funnel')
+
+        # Conversioni tra le fasi e tempo mediano trascorso in ciascuna fase
+        render_table(funnel_channel_df, (filter_key, 'funnel', funnel_option), (
+            ('Conversione dalla Fase Precedente (%)', 'percentuale'),
+            ('Conversione dalla Prima Fase (%)', 'percentuale'),
+            ('Giorni Mediani nella Fase', 'numero'),
+        ))
+        st.caption(f"Opportunità perse: {persi.get(funnel_option, 0)}")
+
+    # Sezione distribuzione del ciclo di vendita
+    @st.fragment
+    @profiled("Sezione Ciclo di Vendita")
+    def render_cycle_section(filter_key):
+        data_filtered = fragment_filtered_dataset(filter_key)
+        st.subheader("Distribuzione del Ciclo di Vendita")
+
+        cells = build_cycle_sketches(fragment_dataset(), filter_key[0])
+        totale_df, canali_df, reps_df = compute_cycle_percentiles(cells, data_filtered, filter_key)
+
+        render_kpi_cards([
+            {'titolo': f"Ciclo di Vendita - {title.split(' ')[0]}", 'valore': f"{format_number(totale_df[title].iloc[0])} giorni"}
+            for title in ['Mediana (giorni)', 'P75 (giorni)', 'P90 (giorni)']
+        ])
+
+        formato_percentili = tuple((title, 'numero') for title in ['Mediana (giorni)', 'P75 (giorni)', 'P90 (giorni)'])
+        st.markdown("**Per Canale**")
+        render_table(canali_df, (filter_key, 'ciclo_canali'), formato_percentili)
+        st.markdown("**Per Sales Rep**")
+        render_table(reps_df, (filter_key, 'ciclo_reps'), formato_percentili)
+
+    # Sezione analisi delle coorti per mese di creazione
+    @st.fragment
+    @profiled("Sezione Analisi Coorti")
+    def render_cohort_section(filter_key):
+        import plotly.express as px
+
+        data_filtered = fragment_filtered_dataset(filter_key)
+
+        st.subheader("Analisi delle Coorti per Mese di Creazione")
+
+        matrice_coorti, finestre_df = compute_cohorts(data_filtered, filter_key)
+
+        def build_coorti():
+            fig_coorti = px.imshow(
+                matrice_coorti,
+                labels=dict(x="Mesi dalla Creazione", y="Coorte", color="% Vinte"),
+                title="Percentuale cumulativa di opportunità vinte per coorte",
+                color_continuous_scale="Blues",
+                aspect="auto",
+                text_auto=".1f",
+            )
+            fig_coorti.update_yaxes(type='category')
+            return fig_coorti
+        fig_coorti = cached_figure('coorti', matrice_coorti, (), build_coorti)
+        show_chart(fig_coorti, 'coorti')
+
+        formato_finestre = tuple((col, 'percentuale') for col in finestre_df.columns if col != 'Opportunità Create')
+        render_table(finestre_df, (filter_key, 'coorti'), formato_finestre)
+
+    # Sezione classifiche di sales rep e aziende
+    @st.fragment
+    @profiled("Sezione Classifiche")
+    def render_leaderboard_section(filter_key):
+        data_filtered = fragment_filtered_dataset(filter_key)
+        st.subheader("Classifiche")
+
+        dimensioni_classifica = {'Sales Rep': 'TeamMember', 'Azienda': 'Azienda'}
+        metriche_classifica = ['Revenue Totale', 'Win Rate', 'Pipeline Velocity', 'Opportunità Vinte']
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            dimensione = st.selectbox("Classifica per", list(dimensioni_classifica), key='classifica_dimensione')
+        with col2:
+            metrica_classifica = st.selectbox("Metrica", metriche_classifica, key='classifica_metrica')
+        with col3:
+            n = st.number_input("Numero di posizioni", min_value=1, max_value=100, value=10, key='classifica_n')
+
+        top_df, bottom_df = compute_leaderboards(data_filtered, filter_key, dimensioni_classifica[dimensione], metrica_classifica, int(n))
+
+        columns_to_display = ['Opportunità Create', 'Opportunità Vinte', 'Revenue Totale', 'Win Rate', 'Pipeline Velocity']
+        formato_classifica = tuple((col, formato) for col, formato in formato_metriche if col in columns_to_display)
+        classifica_key = (filter_key, dimensione, metrica_classifica, int(n))
+
+        col_top, col_bottom = st.columns(2, gap="large")
+        with col_top:
+            st.markdown(f"**Top {int(n)} per {metrica_classifica}**")
+            render_table(top_df[columns_to_display], classifica_key + ('top',), formato_classifica)
+        with col_bottom:
+            st.markdown(f"**Bottom {int(n)} per {metrica_classifica}**")
+            render_table(bottom_df[columns_to_display], classifica_key + ('bottom',), formato_classifica)
+
+    # Sezione previsione della pipeline ponderata per probabilità di vittoria
+    @st.fragment
+    @profiled("Sezione Previsione Pipeline")
+    def render_forecast_section(filter_key):
+        data_filtered = fragment_filtered_dataset(filter_key)
+        st.subheader("Previsione della Pipeline")
+
+        win_model = train_win_model(fragment_dataset(), filter_key[0])
+        if win_model is None:
+            st.info("Non ci sono abbastanza opportunità chiuse (vinte e perse) per addestrare il modello di previsione.")
+            return
+
+        # Le probabilità sono già calcolate per tutte le opportunità aperte: qui si selezionano solo quelle filtrate
+        aperte = data_filtered[data_filtered['Stato'] == 'In Progress']
+        probabilita = win_model['probabilita'].reindex(aperte.index)
+        valore_ponderato = probabilita * aperte['Valore Tot €']
+
+        render_kpi_cards([
+            {'titolo': 'Pipeline Ponderata', 'valore': f"€{format_number(valore_ponderato.sum())}"},
+            {'titolo': 'Pipeline Aperta', 'valore': f"€{format_number(aperte['Valore Tot €'].sum())}"},
+            {'titolo': 'Probabilità Media di Vittoria', 'valore': f"{format_number(probabilita.mean() * 100 if len(probabilita) else 0)}%"},
+        ])
+
+        st.caption(f"Modello addestrato su {win_model['opportunita_addestramento']} opportunità chiuse "
+                   f"(win rate storico {format_number(win_model['win_rate_addestramento'])}%).")
+        calibrazione = win_model['calibrazione']
+        if calibrazione is not None:
+            messaggio = (f"Verifica sulle {calibrazione['opportunita']} opportunità chiuse più recenti: probabilità media prevista "
+                         f"{format_number(calibrazione['probabilita_media'])}%, win rate effettivo {format_number(calibrazione['win_rate_effettivo'])}%.")
+            if abs(calibrazione['probabilita_media'] - calibrazione['win_rate_effettivo']) > win_model_scarto_calibrazione:
+                st.warning(messaggio + " Lo scarto è ampio: la pipeline ponderata va letta con cautela.")
+            else:
+                st.caption(messaggio)
+
+        previsione_df = aperte[['Azienda', 'MainChannel', 'TeamMember', 'Servizio', 'Valore Tot €']].assign(**{
+            'Probabilità di Vittoria': probabilita * 100,
+            'Valore Ponderato': valore_ponderato,
+        })
+        render_table(select_top_k(previsione_df, 'Valore Ponderato', 50), (filter_key, 'previsione'), (
+            ('Valore Tot €', 'euro'),
+            ('Valore Ponderato', 'euro'),
+            ('Probabilità di Vittoria', 'percentuale'),
+        ), hide_index=True)
+
+    # Sezione pivot multidimensionale con drill-in e drill-out
+    @st.fragment
+    @profiled("Sezione Pivot")
+    def render_pivot_section(filter_key):
+        data_filtered = fragment_filtered_dataset(filter_key)
+        st.subheader("Pivot Multidimensionale")
+
+        dimensioni = st.multiselect("Seleziona da 1 a 3 dimensioni (l'ordine definisce la gerarchia)", list(pivot_dimensioni),
+                                    default=['Canale', 'Sales Rep'], max_selections=3, key='pivot_dimensioni')
+        if not dimensioni:
+            st.info("Seleziona almeno una dimensione.")
+            return
+
+        # Il cubo sparso è calcolato una volta per stato dei filtri: cambiare dimensioni o dettaglio lo ri-aggrega soltanto
+        cube = build_pivot_cube(data_filtered, filter_key)
+        valori_dettaglio = sorted(cube[dimensioni[0]].astype(str).unique())
+        dettaglio = st.selectbox(f"Dettaglio su {dimensioni[0]}", ['Tutti'] + valori_dettaglio, key='pivot_dettaglio')
+
+        pivot_df = compute_pivot(cube, filter_key, tuple(dimensioni), None if dettaglio == 'Tutti' else dettaglio)
+
+        render_table(pivot_df, (filter_key, 'pivot', tuple(dimensioni), dettaglio), formato_metriche)
+
+        if (cube[list(pivot_dimensioni)] == pivot_altri).any().any():
+            st.caption(f"Per restare entro {pivot_max_celle} combinazioni, i valori meno rilevanti delle dimensioni ad alta cardinalità sono accorpati in '{pivot_altri}'.")
+
+    # Sezione esploratore dei dati grezzi: al browser arriva solo la pagina visibile
+    @st.fragment
+    @profiled("Sezione Dati Grezzi")
+    def render_raw_data_section(filter_key):
+        st.subheader("Dati Grezzi")
+        data = fragment_dataset()
+        data_filtered = fragment_filtered_dataset(filter_key)
+
+        colonne_predefinite = [col for col in data.columns if col not in colonne_testo_libero]
+        colonne = st.multiselect("Colonne da visualizzare", list(data.columns), default=colonne_predefinite, key='dati_grezzi_colonne')
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            colonna_ordinamento = st.selectbox("Ordina per", ['Nessuno'] + list(data.columns), key='dati_grezzi_ordinamento')
+        with col2:
+            decrescente = st.toggle("Ordine decrescente", key='dati_grezzi_decrescente')
+        with col3:
+            righe_per_pagina = st.selectbox("Righe per pagina", [25, 50, 100, 250], index=1, key='dati_grezzi_righe')
+
+        totale_righe = len(data_filtered)
+        numero_pagine = max(1, -(-totale_righe // righe_per_pagina))
+        pagina = st.number_input("Pagina", min_value=1, max_value=numero_pagine, value=1, step=1, key='dati_grezzi_pagina')
+
+        pagina_df, totale_righe = raw_data_page(
+            data, filter_key[0], data_filtered,
+            None if colonna_ordinamento == 'Nessuno' else colonna_ordinamento,
+            decrescente, int(pagina), righe_per_pagina,
+        )
+        pagina_df = pagina_df[colonne].copy()
+
+        # I testi lunghi vengono troncati per non appesantire la pagina
+        for colonna in pagina_df.columns.intersection(colonne_testo_libero):
+            pagina_df[colonna] = pagina_df[colonna].astype(str).where(pagina_df[colonna].notnull()).str.slice(0, lunghezza_massima_testo)
+
+        st.dataframe(pagina_df, use_container_width=True)
+        inizio = (int(pagina) - 1) * righe_per_pagina
+        st.caption(f"Righe {min(inizio + 1, totale_righe)}-{min(inizio + righe_per_pagina, totale_righe)} di {totale_righe} (pagina {int(pagina)} di {numero_pagine})")
+
+    # Sezione confronti temporali
+    @st.fragment
+    @profiled("Sezione Confronti Temporali")
+    def render_time_comparison_section(filter_key):
+        import plotly.express as px
+
+        data_filtered = fragment_filtered_dataset(filter_key)
 
-            # Confronti temporali
         st.subheader("Confronti Temporali")
         periodi = ['Mese', 'Trimestre', 'Anno']
         periodo_selezionato = st.selectbox("Seleziona il periodo per il confronto", periodi, key='periodo_confronto')
 
-        if periodo_selezionato == 'Mese':
-                data_filtered['Periodo'] = data_filtered['Opportunity_Created'].dt.to_period('M').astype(str)
-        elif periodo_selezionato == 'Trimestre':
-                data_filtered['Periodo'] = data_filtered['Opportunity_Created'].dt.to_period('Q').astype(str)
-        elif periodo_selezionato == 'Anno':
-                data_filtered['Periodo'] = data_filtered['Opportunity_Created'].dt.to_period('A').astype(str)
-
-        confronto_temporale_df = data_filtered.groupby('Periodo').agg({
-                'Opportunity_Created': 'count',
-                'Closed_Won': lambda x: x.notnull().sum(),
-                'Closed_Lost': lambda x: x.notnull().sum(),
-                'Valore Tot €': 'sum'
-        }).rename(columns={
-                'Opportunity_Created': 'Opportunità Create',
-                'Closed_Won': 'Opportunità Vinte',
-                'Closed_Lost': 'Opportunità Perse',
-                'Valore Tot €': 'Revenue Totale',
-        }).reset_index()
-
-            # Calcolo del Growth per ogni metrica
-        confronto_temporale_df = confronto_temporale_df.sort_values('Periodo')
+        confronto_temporale_df = aggregate_by_period(data_filtered, filter_key, frequenze_periodo[periodo_selezionato]).copy()
+
+        # Calcolo del Growth per ogni metrica
         for metrica in metriche_disponibili:
-                confronto_temporale_df[f"{metrica} Growth (%)"] = confronto_temporale_df[metrica].pct_change() * 100
+            confronto_temporale_df[f"{metrica} Growth (%)"] = confronto_temporale_df[metrica].pct_change() * 100
 
-            # Grafico per il confronto temporale
-        fig_confronto_temporale = px.line(confronto_temporale_df, x='Periodo', y=metriche_disponibili,
-                                            title=f"Confronto Temporale delle Metriche - {periodo_selezionato}",
-                                            markers=True)
-        fig_confronto_temporale.update_layout(
+        confronto_temporale_df = downsample_for_chart(confronto_temporale_df, 'Periodo', metriche_disponibili)
+        confronto_render_mode = chart_render_mode(confronto_temporale_df, metriche_disponibili)
+
+        # Grafico per il confronto temporale
+        def build_confronto_temporale():
+            fig_confronto_temporale = px.line(confronto_temporale_df, x='Periodo', y=metriche_disponibili,
+                                              title=f"Confronto Temporale delle Metriche - {periodo_selezionato}",
+                                              markers=True, render_mode=confronto_render_mode)
+            fig_confronto_temporale.update_layout(
                 xaxis_title="Periodo",
                 yaxis_title="Valore",
                 hovermode="x unified"
-        )
-        st.plotly_chart(fig_confronto_temporale, use_container_width=True)
+            )
+            return fig_confronto_temporale
+        fig_confronto_temporale = cached_figure('confronto_temporale', confronto_temporale_df, (periodo_selezionato, confronto_render_mode), build_confronto_temporale)
+        show_chart(fig_confronto_temporale, 'confronto_temporale')
 
-            # Zoom temporale avanzato
-        st.subheader("Zoom Temporale Avanzato")
-        zoom_options = ['Tutto', 'Ultimi 12 periodi', 'Ultimi 6 periodi', 'Ultimi 3 periodi']
-        zoom_selection = st.selectbox("Seleziona il range temporale", zoom_options, key='zoom_selection')
+    # Caricamento dati
+    st.header("Caricamento dei Dati")
 
-        if zoom_selection == 'Tutto':
-                zoom_df = trend_df
+    # Aggiunta del pulsante per pulire la cache
+    if st.button("Pulisci Cache"):
+        st.cache_data.clear()
+        figure_cache = get_figure_cache()
+        with figure_cache['lock']:
+            figure_cache['figure'].clear()
+        qa_cache = get_qa_cache()
+        with qa_cache['lock']:
+            qa_cache['voci'].clear()
+            save_qa_cache(qa_cache)
+        st.success("Cache pulita con successo!")
+
+    uploaded_file = st.file_uploader("Carica un file Excel con i dati di vendita", type=["xlsx"])
+    if uploaded_file is not None:
+        # I risultati in cache sono indicizzati per contenuto del file: un nuovo file
+        # produce nuove chiavi, quindi non serve svuotare la cache a ogni rerun.
+        # Lo stesso file caricato da più sessioni è tenuto in memoria una sola volta.
+        with profile_span("Caricamento dati"):
+            file_bytes = uploaded_file.getvalue()
+            data_key = hashlib.sha1(file_bytes).hexdigest()
+            data, missing_columns = acquire_dataset(file_bytes, data_key)
+
+        if missing_columns:
+            st.error(f"Le seguenti colonne sono mancanti nel file caricato: {', '.join(missing_columns)}")
         else:
-                n_periods = int(zoom_selection.split(' ')[1])
-                zoom_df = trend_df.tail(n_periods)
+            st.success("Dati caricati con successo! I dati grezzi sono consultabili nella sezione 'Dati Grezzi'.")
+            st.session_state['data_key'] = data_key
 
-        fig_zoom = px.line(zoom_df, x='Periodo', y=metrica_selezionata,
-                            title=f"{metrica_selezionata} - {zoom_selection}",
-                            markers=True)
-        fig_zoom.update_layout(
-                xaxis_title="Periodo",
-                yaxis_title=metrica_selezionata,
-                hovermode="x unified"
+    else:
+        st.warning("Per favore, carica un file Excel per iniziare.")
+
+    # Il dataset della sessione è nel registro condiviso; se è stato rimosso per liberare memoria
+    # e il file non è più caricato, va caricato di nuovo
+    data = session_dataset() if 'data_key' in st.session_state else None
+    if data is None and 'data_key' in st.session_state:
+        del st.session_state['data_key']
+        st.info("Il dataset è stato rimosso dalla memoria del server: carica di nuovo il file.")
+
+    if data is not None:
+        data_key = st.session_state['data_key']
+
+        # Selezione dei filtri e filtro dei dati
+        with profile_span("Filtri"):
+            st.sidebar.header("Filtri")
+            # Periodo temporale specifico per mese/trimestre/anno
+            periodo_temporale = st.sidebar.selectbox("Filtro Temporale", ["Intervallo Date", "Mese", "Trimestre", "Anno"])
+
+            if periodo_temporale == "Intervallo Date":
+                # Periodo temporale
+                min_date = data['Opportunity_Created'].min()
+                max_date = data['Opportunity_Created'].max()
+                if pd.isnull(min_date) or pd.isnull(max_date):
+                    min_date = datetime.today()
+                    max_date = datetime.today()
+                start_date, end_date = st.sidebar.date_input("Seleziona il periodo", [min_date, max_date])
+                selezione_date = (start_date, end_date)
+            elif periodo_temporale == "Mese":
+                mesi = data['Opportunity_Created'].dt.to_period('M').unique().astype(str)
+                selected_months = st.sidebar.multiselect("Seleziona Mese/i", mesi, default=mesi)
+                selezione_date = tuple(selected_months)
+            elif periodo_temporale == "Trimestre":
+                trimestri = data['Opportunity_Created'].dt.to_period('Q').unique().astype(str)
+                selected_quarters = st.sidebar.multiselect("Seleziona Trimestre/i", trimestri, default=trimestri)
+                selezione_date = tuple(selected_quarters)
+            elif periodo_temporale == "Anno":
+                anni = data['Opportunity_Created'].dt.year.unique()
+                selected_years = st.sidebar.multiselect("Seleziona Anno/i", anni, default=anni)
+                selezione_date = tuple(selected_years)
+
+            # Canale
+            canali = data['MainChannel'].unique()
+            selected_canali = st.sidebar.multiselect("Seleziona Canali", canali, default=canali)
+
+            # Sales Rep
+            sales_reps = data['TeamMember'].dropna().unique()
+            selected_sales_reps = st.sidebar.multiselect("Seleziona Sales Rep", sales_reps, default=sales_reps)
+
+            # Tipo di opportunità (Servizio)
+            servizi = data['Servizio'].dropna().unique()
+            selected_servizi = st.sidebar.multiselect("Seleziona Servizi", servizi, default=servizi)
+
+            # Stato opportunità
+            stati = data['Stato'].dropna().unique()
+            selected_stati = st.sidebar.multiselect("Seleziona Stato Opportunità", stati, default=stati)
+
+            # Impostazioni di rendering dei grafici
+            with st.sidebar.expander("Impostazioni Grafici"):
+                st.number_input("Punti massimi per serie (larghezza del grafico in px)", min_value=100, max_value=10000, value=1200, step=100, key='larghezza_grafici')
+                st.number_input("Soglia di punti per il rendering WebGL", min_value=100, max_value=100000, value=5000, step=500, key='soglia_webgl')
+
+            # Stato dei filtri: insieme all'impronta del dataset è la chiave delle cache
+            filtri = (
+                periodo_temporale,
+                selezione_date,
+                tuple(selected_canali),
+                tuple(selected_sales_reps),
+                tuple(selected_servizi),
+                tuple(selected_stati),
             )
-        st.plotly_chart(fig_zoom, use_container_width=True)
+            filter_key = (data_key, filtri)
+
+            # Filtro dei dati in base alle selezioni, condiviso tra le sessioni attraverso il registro
+            data_filtered = registry_filtered_view(get_dataset_registry(), filter_key)
+            if data_filtered is None:
+                data_filtered = filter_data(data, filtri)
+
+        # Calcolo delle metriche
+        with profile_span("KPI"):
+            metrics = calculate_metrics(data_filtered, filter_key)
+
+            # Sezione metriche chiave
+            st.subheader("Key Performance Indicators")
+
+            # Tutte le schede KPI in un unico blocco, a partire dal record precalcolato
+            render_kpi_cards(compute_kpi_record(data, data_filtered, filter_key))
+
+        # Sezioni di analisi: solo la sezione selezionata viene calcolata e visualizzata,
+        # e ogni sezione è un fragment che si riesegue da sola quando cambiano i suoi widget
+        sezioni = ["Tabella Riepilogativa", "Interpretazione AI", "Trend Temporale", "Confronto tra Canali", "Pipeline Funnel", "Ciclo di Vendita", "Analisi Coorti", "Classifiche", "Previsione Pipeline", "Pivot", "Confronti Temporali", "Dati Grezzi"]
+        sezione_attiva = st.radio("Sezione", sezioni, horizontal=True, key='sezione_attiva', label_visibility="collapsed")
+
+        if sezione_attiva == "Tabella Riepilogativa":
+            render_summary_section(filter_key)
+        elif sezione_attiva == "Interpretazione AI":
+            render_ai_section(filter_key, metrics)
+        elif sezione_attiva == "Trend Temporale":
+            st.subheader("Visualizzazioni Grafiche")
+            render_trend_section(filter_key, periodo_temporale)
+        elif sezione_attiva == "Confronto tra Canali":
+            render_channel_section(filter_key)
+        elif sezione_attiva == "Pipeline Funnel":
+            render_funnel_section(filter_key)
+        elif sezione_attiva == "Ciclo di Vendita":
+            render_cycle_section(filter_key)
+        elif sezione_attiva == "Analisi Coorti":
+            render_cohort_section(filter_key)
+        elif sezione_attiva == "Classifiche":
+            render_leaderboard_section(filter_key)
+        elif sezione_attiva == "Previsione Pipeline":
+            render_forecast_section(filter_key)
+        elif sezione_attiva == "Pivot":
+            render_pivot_section(filter_key)
+        elif sezione_attiva == "Confronti Temporali":
+            render_time_comparison_section(filter_key)
+        elif sezione_attiva == "Dati Grezzi":
+            render_raw_data_section(filter_key)
+
+        # Statistiche della cache dei grafici
+        figure_cache = get_figure_cache()
+        richieste = figure_cache['hit'] + figure_cache['miss']
+        hit_rate = figure_cache['hit'] / richieste * 100 if richieste else 0
+        st.sidebar.caption(f"Cache grafici: {len(figure_cache['figure'])} figure, hit rate {format_number(hit_rate)}% "
+                           f"({figure_cache['hit']} hit / {figure_cache['miss']} miss)")
 
     else:
         st.warning("Per favore, carica i dati nella sezione 'Caricamento Dati' per continuare.")
 
+    render_dataset_usage()
+
+    # Chiusura della profilazione del rerun e pannello dei tempi
+    finish_profile_rerun()
+    if st.session_state.get('profilazione_attiva'):
+        render_profiler_panel()
+
 
         # Footer
     st.markdown("""